@@ -1,203 +1,552 @@
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
 from memory_usage import memory_usage
 from bloomFilter import BloomFilter
+from blockedBloomFilter import BlockedBloomFilter
+from concurrentFilters import ConcurrentBloomFilter, ConcurrentCountingBloomFilter, ConcurrentScalableBloomFilter
 from countingBloomFilter import CountingBloomFilter
+from cuckooFilter import CuckooFilter
+from filterClient import FilterClient
+from filterServer import WINDOW
+from filterServer import main as server_main
+from rotatingBloomFilter import RotatingBloomFilter
 from scalableBloomFilter import ScalableBloomFilter
 from shiftingBloomFilter import ShiftingBloomFilterM
-import time
-
-
-def main():
-    input_size = 10000
-    fp_rate = 0.01
-
-    count_size = 4
-
-    bloom_filter = BloomFilter(input_size, fp_rate)
-    start_time = time.time()
-    for i in range(0, input_size):
-        bloom_filter.add(str(i))
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    fp_count = 0
-    for i in range(input_size, input_size * 2):
-        if str(i) in bloom_filter:
-            fp_count += 1
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-
-    print("Expected false positive rate for all calculations is :" + str(fp_rate))
-    print()
-    print("For Standard Bloom Filter : \nFalse positive count:" + str(fp_count) + "  in " + str(
-        input_size) + " try. " + str(
-        (fp_count / input_size)) + " rate of false positive")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-    print("Memory usage in bytes :" + str(
-        memory_usage.get_obj_size(bloom_filter) + bloom_filter.get_bitarray_size()))
-
-    shifting_bloom_filter = ShiftingBloomFilterM(input_size, fp_rate)
-    start_time = time.time()
-    for i in range(0, input_size):
-        shifting_bloom_filter.add(str(i))
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    fp_count = 0
-    for i in range(input_size, input_size * 2):
-        if str(i) in shifting_bloom_filter:
-            fp_count += 1
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-
-    print()
-    print("For Shifting Bloom Filter : \nFalse positive count:" + str(fp_count) + "  in " + str(
-        input_size) + " try. " + str(
-        (fp_count / input_size)) + " rate of false positive")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-    print("Memory usage in bytes :" + str(
-        memory_usage.get_obj_size(shifting_bloom_filter) + shifting_bloom_filter.get_bitarray_size()))
-
-    counting_bloom_filter = CountingBloomFilter(input_size, fp_rate, count_size=count_size)
-
-    start_time = time.time()
-    for i in range(0, input_size):
-        counting_bloom_filter.add(str(i))
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    fp_count = 0
-    for i in range(input_size, input_size * 2):
-        if str(i) in counting_bloom_filter:
-            fp_count += 1
-
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-    for i in range(0, input_size):
-        if not str(i) in counting_bloom_filter:
-            print(str(i))
-    print()
-    print("For counting filter :\nFalse positive count:" + str(fp_count) + "  in " + str(input_size) + " try. " + str(
-        (fp_count / input_size)) + " rate of false positive")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-    print("Memory usage in bytes :" + str(
-        memory_usage.get_obj_size(counting_bloom_filter) + counting_bloom_filter.get_bitarray_size() ))
-
-    scalable_bloom_filter = ScalableBloomFilter(fp_prob=fp_rate, growth=ScalableBloomFilter.SMALL_GROWTH)
-
-    start_time = time.time()
-    for i in range(0, input_size):
-        scalable_bloom_filter.add(str(i))
-
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    fp_count = 0
-    for i in range(input_size, input_size * 2):
-        if str(i) in scalable_bloom_filter:
-            fp_count += 1
-
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-    print()
-    print("For scalable filter :\nFalse positive count:" + str(fp_count) + "  in " + str(input_size) + " try. " + str(
-        (fp_count / input_size)) + " rate of false positive")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-
-    print("Memory usage in bytes :" + str(memory_usage.get_obj_size(scalable_bloom_filter) + scalable_bloom_filter.get_bitarray_size()))
-
-    c_scalable_bloom_filter = ScalableBloomFilter(fp_prob=fp_rate, growth=ScalableBloomFilter.SMALL_GROWTH,
-                                                  countable=True, count_size=count_size)
-
-    start_time = time.time()
-    for i in range(0, input_size):
-        c_scalable_bloom_filter.add(str(i))
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    fp_count = 0
-    for i in range(input_size, input_size * 2):
-        if str(i) in c_scalable_bloom_filter:
-            fp_count += 1
-
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-    print()
-    print("For counting scalable filter :\nFalse positive count:" + str(fp_count) + "  in " + str(
-        input_size) + " try. " + str(
-        (fp_count / input_size)) + " rate of false positive")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-
-    print("Memory usage in bytes :" + str(memory_usage.get_obj_size(c_scalable_bloom_filter) + c_scalable_bloom_filter.get_bitarray_size()))
-
-    size_sum = 0
-    filled_bit_count = 0
-    max_count = 0
-    for a in c_scalable_bloom_filter.bloom_filters:
-        for i in range(0, len(a)):
-            if counting_bloom_filter.get_bit_value(i) > 0:
-                size_sum += counting_bloom_filter.get_bit_value(i)
-                filled_bit_count += 1
-                if max_count < counting_bloom_filter.get_bit_value(i):
-                    max_count = counting_bloom_filter.get_bit_value(i)
-
-    avg_size = size_sum / filled_bit_count
-    print("For counting filter -------- avg count:" + str(avg_size))
-    print("For counting filter-------- max count:" + str(max_count))
-
-    hasmap = {}
-    start_time = time.time()
-    for i in range(0, input_size):
-        hasmap[str(i)] = i
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    for i in range(input_size, input_size * 2):
-        if str(i) in hasmap:
-            pass
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-    print()
-    print("For Hashmap ")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-    print("Memory usage in bytes :" + str(memory_usage.get_obj_size(hasmap)))
-
-    py_list = []
-    start_time = time.time()
-    for i in range(0, input_size):
-        py_list.append(str(i))
-    end_time = time.time()
-    avg_add_time = (end_time - start_time) / input_size
-
-    start_time = time.time()
-    for i in range(input_size, input_size * 2):
-        if str(i) in py_list:
-            pass
-    end_time = time.time()
-    avg_lookup_time = (end_time - start_time) / input_size
-    print()
-    print("For List ")
-    print("Avg lookup time :" + str('{:.20f}'.format(avg_lookup_time)) + "  Avg add time:" + str(
-        '{:.20f}'.format(avg_add_time)))
-    print("Memory usage in bytes :" + str(memory_usage.get_obj_size(py_list)))
-
-    temp = 0
-    for i in c_scalable_bloom_filter.bloom_filters:
-        temp += memory_usage.get_obj_size(i)
-    print("aaa" + str(memory_usage.get_obj_size(c_scalable_bloom_filter.bloom_filters)))
-    print("xxx" + str(temp))
+from t_CountingBloomFilter import T_CountingBloomFilter
+from xorFilter import XorFilter
+
+"""
+Benchmark harness for all filters.
+
+    python benchmark.py run --capacities 10000 100000 --fp-rates 0.01 0.001 --output run.json
+    python benchmark.py run --filters BloomFilter BlockedBloomFilter --modes batch \\
+        --capacities 1000000 10000000 100000000 --lookups 1000000 --output blocked.csv
+    python benchmark.py run --filters CountingBloomFilter[4] CountingBloomFilter[8] T_CountingBloomFilter \\
+        --modes batch --capacities 1000000 --output counting.csv
+    python benchmark.py compare base.json run.json --threshold 0.1
+    python benchmark.py scalable --items 1000000 --growths 2 4 --ratios 0.8 0.9 --output scalable.csv
+    python benchmark.py threads --threads 1 2 4 8 --items 200000 --read-ratio 0.9 --output threads.csv
+    python benchmark.py service --transport unix tcp --clients 1 16 64 --keys-per-request 1 16 --output service.csv
+
+Every case is built `repeat` times, timed with perf_counter_ns, and the best
+run is reported: add and lookup throughput (operations per second), the
+empirical fp rate on keys that were never added and the bytes per key
+(filter payload plus metadata, from memory_report).
+Keys are the same ids as str, bytes, python ints or one numpy uint64 array
+(--key-types), the gap between str and uint64 in batch mode is the cost of
+encoding and hashing every key as a python object.
+The [seeded] filters hash with the original per seed mmh3 scheme instead
+of the default double hashing (see hashing.py).
+compare flags cases whose throughput dropped or whose memory or fp rate grew
+by more than the threshold, and exits with status 1 if any regressed.
+scalable records the memory of a ScalableBloomFilter against the number of
+inserted items, next to the memory predicted by its layer schedule.
+threads runs a mixed add / lookup workload from a thread pool on the
+concurrent filters (concurrentFilters.py) and reports the total throughput
+per thread count, and the added keys a lookup missed afterwards (always 0).
+With the GIL the throughput does not scale with threads, run it on a
+free-threaded build (python3.13t) to measure the lock striping.
+service starts a filterServer.py process on a loopback Unix or TCP socket
+and reports the request latency (p50 / p99) and the keys per second of
+concurrent client tasks, with the keys per batch after server coalescing.
+"""
+
+# name -> constructor(capacity, fp_rate)
+FILTERS = {
+    "BloomFilter": lambda n, p: BloomFilter(n, p),
+    "BloomFilter[seeded]": lambda n, p: BloomFilter(n, p, hash_strategy="seeded"),
+    "BlockedBloomFilter": lambda n, p: BlockedBloomFilter(n, p),
+    "ShiftingBloomFilterM": lambda n, p: ShiftingBloomFilterM(n, p),
+    "ShiftingBloomFilterM[seeded]": lambda n, p: ShiftingBloomFilterM(n, p, hash_strategy="seeded"),
+    "CountingBloomFilter[4]": lambda n, p: CountingBloomFilter(n, p, count_size=4),
+    "CountingBloomFilter[4,seeded]": lambda n, p: CountingBloomFilter(n, p, count_size=4, hash_strategy="seeded"),
+    "CountingBloomFilter[8]": lambda n, p: CountingBloomFilter(n, p, count_size=8),
+    "CountingBloomFilter[16]": lambda n, p: CountingBloomFilter(n, p, count_size=16),
+    "T_CountingBloomFilter": lambda n, p: T_CountingBloomFilter(n, p),
+    "T_CountingBloomFilter[seeded]": lambda n, p: T_CountingBloomFilter(n, p, hash_strategy="seeded"),
+    "CuckooFilter": lambda n, p: CuckooFilter(n, p),
+    "ScalableBloomFilter": lambda n, p: ScalableBloomFilter(max(n // 16, 100), p),
+    "ScalableBloomFilter[countable]": lambda n, p: ScalableBloomFilter(max(n // 16, 100), p,
+                                                                       countable=True, count_size=4),
+    "ScalableBloomFilter[cuckoo]": lambda n, p: ScalableBloomFilter(max(n // 16, 100), p, layer_type=CuckooFilter),
+    # keys fill two of the four generations, nothing expires during a run
+    "RotatingBloomFilter": lambda n, p: RotatingBloomFilter(max(n // 2, 100), p),
+    "dict": lambda n, p: {},
+    "set": lambda n, p: set(),
+}
+
+# name -> constructor(keys, fp_rate), filters built from the finished key set,
+# their add throughput is the build throughput
+STATIC_FILTERS = {
+    "XorFilter": lambda keys, p: XorFilter.from_keys(keys, p),
+}
+
+# name -> constructor(capacity, fp_rate), the filters of the threads benchmark
+THREAD_FILTERS = {
+    "ConcurrentBloomFilter": lambda n, p: ConcurrentBloomFilter(n, p),
+    "ConcurrentCountingBloomFilter[4]": lambda n, p: ConcurrentCountingBloomFilter(n, p, count_size=4),
+    # the writes of the run create new layers
+    "ConcurrentScalableBloomFilter": lambda n, p: ConcurrentScalableBloomFilter(max(n // 16, 100), p),
+}
+
+MODES = ("loop", "batch")
+
+KEY_TYPES = {
+    "str": lambda start, stop: [str(i) for i in range(start, stop)],
+    "bytes": lambda start, stop: [str(i).encode() for i in range(start, stop)],
+    "int": lambda start, stop: list(range(start, stop)),
+    "uint64": lambda start, stop: np.arange(start, stop, dtype=np.uint64),
+}
+
+# metric -> True if higher is better
+METRICS = {
+    "add_ops_per_sec": True,
+    "lookup_ops_per_sec": True,
+    "bytes_per_key": False,
+    "fp_rate": False,
+}
+
+CASE_KEYS = ("filter", "mode", "key_type", "capacity", "fp_target")
+
+
+def add_loop(container, keys):
+    if isinstance(container, dict):
+        for key in keys:
+            container[key] = True
+    else:
+        for key in keys:
+            container.add(key)
+
+
+def lookup_loop(container, keys):
+    positives = 0
+    for key in keys:
+        if key in container:
+            positives += 1
+    return positives
+
+
+def get_size_in_bytes(container):
+    if isinstance(container, (dict, set)):
+        return memory_usage.get_obj_size(container)
+    return container.memory_report()["total_bytes"]
+
+
+def run_case(filter_name, mode, key_type, capacity, fp_rate, repeat, keys, absent_keys):
+    '''
+    Time one case repeat times and return the result row of the best run
+    '''
+    best_add = best_lookup = None
+    for _ in range(repeat):
+        if filter_name in STATIC_FILTERS:
+            start = time.perf_counter_ns()
+            container = STATIC_FILTERS[filter_name](keys, fp_rate)
+        else:
+            container = FILTERS[filter_name](capacity, fp_rate)
+            start = time.perf_counter_ns()
+            if mode == "batch":
+                container.add_many(keys)
+            else:
+                add_loop(container, keys)
+        add_time = time.perf_counter_ns() - start
+
+        start = time.perf_counter_ns()
+        if mode == "batch":
+            positives = int(container.contains_many(absent_keys).sum())
+        else:
+            positives = lookup_loop(container, absent_keys)
+        lookup_time = time.perf_counter_ns() - start
+
+        best_add = add_time if best_add is None else min(best_add, add_time)
+        best_lookup = lookup_time if best_lookup is None else min(best_lookup, lookup_time)
+
+    size = get_size_in_bytes(container)
+    return {
+        "filter": filter_name,
+        "mode": mode,
+        "key_type": key_type,
+        "capacity": capacity,
+        "fp_target": fp_rate,
+        "repeat": repeat,
+        "add_ops_per_sec": len(keys) * 1e9 / max(best_add, 1),
+        "lookup_ops_per_sec": len(absent_keys) * 1e9 / max(best_lookup, 1),
+        "fp_rate": positives / len(absent_keys),
+        "bytes": size,
+        "bytes_per_key": size / len(keys),
+    }
+
+
+def supports_mode(filter_name, mode):
+    if mode == "loop" or filter_name in STATIC_FILTERS:
+        return True
+    container = FILTERS[filter_name](100, 0.01)
+    return hasattr(container, "add_many") and hasattr(container, "contains_many")
+
+
+def run(filters, modes, key_types, capacities, fp_rates, repeat, lookups=None, log=sys.stderr):
+    results = []
+    for capacity in capacities:
+        for key_type in key_types:
+            keys = KEY_TYPES[key_type](0, capacity)
+            absent_keys = KEY_TYPES[key_type](capacity, capacity + (lookups or capacity))
+            for fp_rate in fp_rates:
+                for filter_name in filters:
+                    for mode in modes:
+                        if not supports_mode(filter_name, mode):
+                            continue
+                        if filter_name in ("dict", "set") and fp_rate != fp_rates[0]:
+                            # baselines do not depend on the fp target
+                            continue
+                        row = run_case(filter_name, mode, key_type, capacity, fp_rate, repeat, keys, absent_keys)
+                        if log is not None:
+                            print(format_row(row), file=log)
+                        results.append(row)
+    return results
+
+
+def run_scalable(items, initial_items_count, fp_rates, growths, ratios, checkpoints, lookups, log=sys.stderr):
+    '''
+    Insert items keys in ScalableBloomFilters and sample their memory at
+    checkpoints evenly spaced sizes
+    '''
+    absent_keys = KEY_TYPES["str"](items, items + lookups)
+    step = max(items // checkpoints, 1)
+    results = []
+    for fp_rate in fp_rates:
+        for growth in growths:
+            for ratio in ratios:
+                scalable = ScalableBloomFilter(initial_items_count, fp_rate, growth=growth, ratio=ratio)
+                for start in range(0, items, step):
+                    for key in KEY_TYPES["str"](start, min(start + step, items)):
+                        scalable.add(key)
+                    report = scalable.memory_report()
+                    layers = len(scalable.bloom_filters)
+                    row = {
+                        "fp_target": fp_rate,
+                        "growth": growth,
+                        "ratio": ratio,
+                        "items": min(start + step, items),
+                        "layers": layers,
+                        "bytes": report["total_bytes"],
+                        "predicted_bytes": scalable.predicted_cost(layers)["nbytes"],
+                        "bits_per_item": report["bits_per_item"],
+                        "probes": scalable.predicted_cost(layers)["probes"],
+                        "fp_rate": lookup_loop(scalable, absent_keys) / len(absent_keys),
+                    }
+                    if log is not None:
+                        print(format_scalable_row(row), file=log)
+                    results.append(row)
+    return results
+
+
+def run_threads(filters, thread_counts, items, fp_rate, read_ratio, log=sys.stderr):
+    '''
+    Pre-fill every filter with items keys, then run items operations split
+    over a pool of threads, each one a lookup of a pre-filled key with
+    probability read_ratio or else the add of a new key
+    '''
+    initial_keys = KEY_TYPES["str"](0, items)
+    new_keys = KEY_TYPES["str"](items, 2 * items)
+    writes = np.random.default_rng(0).random(items) >= read_ratio
+    # operation i reads initial_keys[i] or writes new_keys[i]
+    operations = [(new_keys[i], True) if write else (initial_keys[i], False) for i, write in enumerate(writes.tolist())]
+    results = []
+    for filter_name in filters:
+        for thread_count in thread_counts:
+            container = THREAD_FILTERS[filter_name](2 * items, fp_rate)
+            add_loop(container, initial_keys)
+            shares = [operations[i::thread_count] for i in range(thread_count)]
+            barrier = threading.Barrier(thread_count + 1)
+
+            def work(share):
+                barrier.wait()
+                for key, write in share:
+                    if write:
+                        container.add(key)
+                    else:
+                        key in container
+
+            with ThreadPoolExecutor(thread_count) as executor:
+                futures = [executor.submit(work, share) for share in shares]
+                barrier.wait()
+                start = time.perf_counter_ns()
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter_ns() - start
+            added = [new_keys[i] for i in np.flatnonzero(writes).tolist()]
+            row = {
+                "filter": filter_name,
+                "threads": thread_count,
+                "items": items,
+                "read_ratio": read_ratio,
+                "ops_per_sec": items / (elapsed / 1e9),
+                "false_negatives": len(added) - lookup_loop(container, added),
+                "gil": getattr(sys, "_is_gil_enabled", lambda: True)(),
+            }
+            if log is not None:
+                print(format_threads_row(row), file=log)
+            results.append(row)
+    return results
+
+
+def format_threads_row(row):
+    return ("{filter:<32} threads={threads:<3} items={items:<10} reads={read_ratio:<5} "
+            "ops/s={ops_per_sec:>12.0f} false_negatives={false_negatives} gil={gil}").format(**row)
+
+
+def run_service(filters, transports, client_counts, keys_per_request, requests, capacity, fp_rate, window,
+                log=sys.stderr):
+    '''
+    Serve a filter pre-filled with capacity // 2 keys from a server process,
+    then send requests lookups of keys_per_request keys (half of them added)
+    from client_count concurrent tasks sharing one FilterClient
+    '''
+    keys = KEY_TYPES["str"](0, capacity)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for filter_name in filters:
+            container = FILTERS[filter_name](capacity, fp_rate)
+            add_loop(container, keys[:capacity // 2])
+            container.save(os.path.join(directory, "filter.bf"))
+            for transport in transports:
+                address = os.path.join(directory, "filter.sock") if transport == "unix" else None
+                port = None if address else free_port()
+                argv = ["bench=" + os.path.join(directory, "filter.bf"), "--window", str(window)]
+                argv += ["--unix", address] if address else ["--port", str(port)]
+                # spawned, a forked server would share the state of this process
+                server = multiprocessing.get_context("spawn").Process(target=server_main, args=(argv,), daemon=True)
+                server.start()
+                try:
+                    for client_count in client_counts:
+                        for key_count in keys_per_request:
+                            row = asyncio.run(service_case(address, port, client_count, key_count, requests, keys))
+                            row.update({"filter": filter_name, "transport": transport, "window_us": window * 1e6,
+                                        "clients": client_count, "keys_per_request": key_count,
+                                        "requests": requests})
+                            if log is not None:
+                                print(format_service_row(row), file=log)
+                            results.append(row)
+                finally:
+                    server.terminate()
+                    server.join()
+    return results
+
+
+async def service_case(path, port, client_count, key_count, requests, keys):
+    client = FilterClient(path=path, port=port)
+    # wait for the server to listen
+    for _ in range(500):
+        try:
+            await client.connect()
+            break
+        except (FileNotFoundError, ConnectionError):
+            await client.close()
+            await asyncio.sleep(0.01)
+    else:
+        raise ConnectionError("Filter server did not start")
+    try:
+        info = await client.info("bench")
+        latencies = []
+
+        async def work(task):
+            for request in range(task, requests, client_count):
+                start = (request * key_count) % (len(keys) - key_count + 1)
+                request_keys = keys[start:start + key_count]
+                time_start = time.perf_counter_ns()
+                await client.contains_many("bench", request_keys)
+                latencies.append(time.perf_counter_ns() - time_start)
+
+        start = time.perf_counter_ns()
+        await asyncio.gather(*(work(task) for task in range(client_count)))
+        elapsed = time.perf_counter_ns() - start
+        after = await client.info("bench")
+    finally:
+        await client.close()
+    # the info requests are not part of the batches of the run
+    batches = after["batches"] - info["batches"]
+    return {
+        "qps": requests * key_count / (elapsed / 1e9),
+        "requests_per_sec": requests / (elapsed / 1e9),
+        "p50_us": float(np.percentile(latencies, 50)) / 1e3,
+        "p99_us": float(np.percentile(latencies, 99)) / 1e3,
+        "keys_per_batch": (after["keys"] - info["keys"]) / max(batches, 1),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def format_service_row(row):
+    return ("{filter:<32} {transport:<4} clients={clients:<4} keys/request={keys_per_request:<5} "
+            "qps={qps:>10.0f} requests/s={requests_per_sec:>9.0f} p50={p50_us:>8.1f}us p99={p99_us:>8.1f}us "
+            "keys/batch={keys_per_batch:.1f}").format(**row)
+
+
+def format_scalable_row(row):
+    return ("p={fp_target:<8} growth={growth:<3} r={ratio:<5} items={items:<10} layers={layers:<3} "
+            "bytes={bytes:<10} predicted={predicted_bytes:<10} bits/item={bits_per_item:<8.3f} "
+            "probes={probes:<4} fp={fp_rate:.5f}").format(**row)
+
+
+def format_row(row):
+    return ("{filter:<32} {mode:<6} {key_type:<6} n={capacity:<10} p={fp_target:<8} "
+            "add/s={add_ops_per_sec:>12.0f} lookup/s={lookup_ops_per_sec:>12.0f} "
+            "fp={fp_rate:<8.5f} bytes/key={bytes_per_key:.3f}").format(**row)
+
+
+def write_results(results, path, output_format=None):
+    output_format = output_format or ("csv" if path.endswith(".csv") else "json")
+    with open(path, "w", newline="") as f:
+        if output_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else list(CASE_KEYS))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, f, indent=1)
+
+
+def read_results(path):
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+            for row in rows:
+                for name in ("capacity", "repeat", "bytes"):
+                    row[name] = int(row[name])
+                for name in ("fp_target",) + tuple(METRICS):
+                    row[name] = float(row[name])
+            return rows
+        return json.load(f)
+
+
+def compare(base_results, new_results, threshold):
+    '''
+    Return a list of (case, metric, base value, new value) regressions
+    '''
+    base = {tuple(row[key] for key in CASE_KEYS): row for row in base_results}
+    regressions = []
+    for row in new_results:
+        case = tuple(row[key] for key in CASE_KEYS)
+        if case not in base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base[case][metric], row[metric]
+            if higher_is_better:
+                regressed = new < old * (1 - threshold)
+            elif metric == "fp_rate":
+                # fp rates below the target are not regressions
+                regressed = new > old * (1 + threshold) and new > row["fp_target"]
+            else:
+                regressed = new > old * (1 + threshold)
+            if regressed:
+                regressions.append((case, metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bloom filters")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--filters", nargs="+", default=list(FILTERS) + list(STATIC_FILTERS),
+                            choices=list(FILTERS) + list(STATIC_FILTERS))
+    run_parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    run_parser.add_argument("--key-types", nargs="+", default=list(KEY_TYPES), choices=list(KEY_TYPES))
+    run_parser.add_argument("--capacities", nargs="+", type=int, default=[10000])
+    run_parser.add_argument("--fp-rates", nargs="+", type=float, default=[0.01, 0.001])
+    run_parser.add_argument("--lookups", type=int, default=None,
+                            help="number of absent keys looked up (default: capacity)")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--output", help="write results to a .json or .csv file")
+    run_parser.add_argument("--format", choices=("json", "csv"))
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two runs")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative change reported as a regression")
+
+    scalable_parser = commands.add_parser("scalable", help="memory of ScalableBloomFilter against inserted items")
+    scalable_parser.add_argument("--items", type=int, default=100000)
+    scalable_parser.add_argument("--initial", type=int, default=1000, help="items of the first layer")
+    scalable_parser.add_argument("--fp-rates", nargs="+", type=float, default=[0.001])
+    scalable_parser.add_argument("--growths", nargs="+", type=int,
+                                 default=[ScalableBloomFilter.SMALL_GROWTH, ScalableBloomFilter.LARGE_GROWTH])
+    scalable_parser.add_argument("--ratios", nargs="+", type=float, default=[0.8, ScalableBloomFilter.TIGHTENING_RATIO])
+    scalable_parser.add_argument("--checkpoints", type=int, default=10)
+    scalable_parser.add_argument("--lookups", type=int, default=10000)
+    scalable_parser.add_argument("--output", help="write results to a .json or .csv file")
+    scalable_parser.add_argument("--format", choices=("json", "csv"))
+
+    threads_parser = commands.add_parser("threads", help="mixed add / lookup throughput of the concurrent filters")
+    threads_parser.add_argument("--filters", nargs="+", default=list(THREAD_FILTERS), choices=list(THREAD_FILTERS))
+    threads_parser.add_argument("--threads", nargs="+", type=int, default=[1, 2, 4, 8])
+    threads_parser.add_argument("--items", type=int, default=100000, help="pre-filled keys and operations")
+    threads_parser.add_argument("--fp-rate", type=float, default=0.01)
+    threads_parser.add_argument("--read-ratio", type=float, default=0.9, help="fraction of lookups")
+    threads_parser.add_argument("--output", help="write results to a .json or .csv file")
+    threads_parser.add_argument("--format", choices=("json", "csv"))
+
+    service_parser = commands.add_parser("service", help="loopback latency and throughput of filterServer.py")
+    service_parser.add_argument("--filters", nargs="+", default=["BloomFilter"],
+                                choices=[name for name in FILTERS if name not in ("dict", "set")])
+    service_parser.add_argument("--transport", nargs="+", default=["unix"], choices=("unix", "tcp"))
+    service_parser.add_argument("--clients", nargs="+", type=int, default=[1, 16, 64],
+                                help="concurrent client tasks")
+    service_parser.add_argument("--keys-per-request", nargs="+", type=int, default=[1, 16])
+    service_parser.add_argument("--requests", type=int, default=20000)
+    service_parser.add_argument("--capacity", type=int, default=100000)
+    service_parser.add_argument("--fp-rate", type=float, default=0.01)
+    service_parser.add_argument("--window", type=float, default=WINDOW, help="server coalescing window in seconds")
+    service_parser.add_argument("--output", help="write results to a .json or .csv file")
+    service_parser.add_argument("--format", choices=("json", "csv"))
+
+    args = parser.parse_args(argv)
+    if args.command == "service":
+        results = run_service(args.filters, args.transport, args.clients, args.keys_per_request, args.requests,
+                              args.capacity, args.fp_rate, args.window)
+        if args.output:
+            write_results(results, args.output, args.format)
+        return 0
+    if args.command == "threads":
+        results = run_threads(args.filters, args.threads, args.items, args.fp_rate, args.read_ratio)
+        if args.output:
+            write_results(results, args.output, args.format)
+        return 0
+    if args.command == "scalable":
+        results = run_scalable(args.items, args.initial, args.fp_rates, args.growths, args.ratios, args.checkpoints,
+                               args.lookups)
+        if args.output:
+            write_results(results, args.output, args.format)
+        return 0
+    if args.command == "run":
+        results = run(args.filters, args.modes, args.key_types, args.capacities, args.fp_rates, args.repeat,
+                      args.lookups)
+        if args.output:
+            write_results(results, args.output, args.format)
+        return 0
+
+    regressions = compare(read_results(args.base), read_results(args.new), args.threshold)
+    for case, metric, old, new in regressions:
+        print("REGRESSION " + " ".join(str(value) for value in case) + " " + metric + ": " +
+              str(old) + " -> " + str(new))
+    print(str(len(regressions)) + " regression(s)")
+    return 1 if regressions else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import numpy as np
+
+"""
+Vectorized helpers that work on the raw buffer of a big endian bitarray.
+Bit i lives in byte i >> 3 under the mask 0x80 >> (i & 7), which is the
+layout bitarray uses for endian='big'.
+"""
+
+
+def byte_view(bit_array):
+    '''
+    Return a uint8 numpy view over the buffer of the bitarray (no copy)
+    '''
+    return np.frombuffer(bit_array, dtype=np.uint8)
+
+
+def bit_masks(indexes):
+    return np.left_shift(1, 7 - (indexes & 7)).astype(np.uint8)
+
+
+def check_writeable(array):
+    '''
+    Raise TypeError (like bitarray) if a numpy view is read-only, e.g. the
+    buffer of a filter loaded with mmap=True or attached from shared memory.
+    ufunc.at does not check the flag and would write into the mapping.
+    '''
+    if not array.flags.writeable:
+        raise TypeError("cannot modify read-only memory")
+
+
+def set_bits(bit_array, indexes):
+    '''
+    Set every bit position in indexes to 1
+    '''
+    indexes = np.asarray(indexes, dtype=np.int64).ravel()
+    view = byte_view(bit_array)
+    check_writeable(view)
+    # bitwise_or.at is unbuffered so repeated bytes are handled correctly
+    np.bitwise_or.at(view, indexes >> 3, bit_masks(indexes))
+
+
+def get_bits(bit_array, indexes):
+    '''
+    Return a boolean array with the value of every bit position in indexes
+    '''
+    indexes = np.asarray(indexes, dtype=np.int64)
+    return (byte_view(bit_array)[indexes >> 3] & bit_masks(indexes)) != 0
+
+
+def chunks(iterable, chunk_size):
+    '''
+    Yield lists of at most chunk_size items from iterable, a numpy array
+    is sliced into views instead
+    '''
+    if isinstance(iterable, np.ndarray):
+        for start in range(0, len(iterable), chunk_size):
+            yield iterable[start:start + chunk_size]
+        return
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
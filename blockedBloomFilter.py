@@ -0,0 +1,290 @@
+import math
+import numpy as np
+from bitarray import bitarray
+
+from bitOps import chunks, get_bits, set_bits
+from hashing import DoubleHashing, get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
+
+
+class BlockedBloomFilter(object):
+    """
+    Cache-line blocked Bloom filter
+    -The bit array is split in blocks of 512 bits (one 64 byte cache line)
+    -A key picks one block and all of its k bits are set inside that block,
+    so a lookup touches a single cache line instead of k
+    -The price is a slightly higher fp rate than BloomFilter for the same size,
+    because the load of the blocks is not perfectly even
+    """
+    BLOCK_BITS = 512
+    # bits in a block, 64 bytes = one cache line on x86-64 and most arm64
+    BLOCK_PRIME = 509
+    # positions inside a block are taken modulo the largest prime below 512,
+    # with a double hashing step in 1..BLOCK_PRIME - 1 the k positions of a
+    # key are distinct
+    PROBE = "nonzero_step"
+    # probe sequence recorded in saved files, files saved before the step was
+    # forced to be non zero cannot be read
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by add_many / contains_many
+
+    def __init__(self, items_count, fp_prob, count_size=0, hash_strategy=None):
+        """
+        items_count : int
+            Number of items expected to be stored in bloom filter
+        fp_prob : float
+            False Positive probability in decimal
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
+        """
+        self.item_low_count = items_count
+        # False posible probability in decimal
+        self.fp_prob = fp_prob
+
+        # Size of bit array to use, in whole blocks
+        self.block_count = max(1, -(-self.get_size(items_count, fp_prob) // self.BLOCK_BITS))
+        self.size = self.block_count * self.BLOCK_BITS
+
+        # number of hash functions to use
+        self.hash_count = self.get_hash_count(self.size, items_count)
+        if self.hash_count == 0:
+            self.hash_count = 1
+
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        self.bit_array = self.aligned_bitarray(self.size)
+
+        self.count = 0
+
+    @classmethod
+    def aligned_bitarray(cls, size):
+        '''
+        Return a zeroed bitarray whose buffer starts on a cache line boundary
+        '''
+        line = cls.BLOCK_BITS // 8
+        memory = np.zeros(size // 8 + line, dtype=np.uint8)
+        offset = -memory.ctypes.data % line
+        return bitarray(buffer=memory[offset:offset + size // 8], endian='big')
+
+    def add(self, item):
+        '''
+        Add an item in the filter
+        '''
+        return self.add_digest(self.hash_strategy.digest(item))
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        '''
+        if self.count > self.item_low_count:
+            print("BloomFilter reached it's limit")
+            return False
+        start_point = next(self.hash_strategy.indexes(item_digest, 1, self.block_count)) * self.BLOCK_BITS
+        for digest in self.block_indexes(item_digest):
+            self.bit_array[start_point + digest] = True
+        self.count += 1
+        return True
+
+    def __contains__(self, item):
+        '''
+        Check for existence of an item in filter
+        '''
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+        '''
+        Check for existence of an item in filter from its digest
+        '''
+        start_point = next(self.hash_strategy.indexes(item_digest, 1, self.block_count)) * self.BLOCK_BITS
+        for digest in self.block_indexes(item_digest):
+            if not self.bit_array[start_point + digest]:
+                return False
+        return True
+
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter
+        Returns the number of items added
+        '''
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            remaining = self.item_low_count + 1 - self.count
+            if remaining <= 0:
+                print("BloomFilter reached it's limit")
+                break
+            if len(chunk) > remaining:
+                print("BloomFilter reached it's limit")
+                chunk = chunk[:remaining]
+            set_bits(self.bit_array, self.hash_many(chunk))
+            self.count += len(chunk)
+            added += len(chunk)
+        return added
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        results = [get_bits(self.bit_array, self.hash_many(chunk)).all(axis=1)
+                   for chunk in chunks(items, self.CHUNK_SIZE)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def hash_many(self, items):
+        '''
+        Return a (len(items), hash_count) array of bit positions
+        '''
+        digests = self.hash_strategy.digest_many(items, self.hash_count + 1)
+        start_points = self.hash_strategy.indexes_many(digests, 1, self.block_count) * self.BLOCK_BITS
+        return self.block_indexes_many(digests) + start_points
+
+    def block_indexes(self, item_digest):
+        '''
+        Return the k bit positions of a key inside its block
+        (h1 + i * step) % BLOCK_PRIME for i in 1..k, step = h2 % (BLOCK_PRIME - 1) + 1
+        '''
+        if not isinstance(self.hash_strategy, DoubleHashing):
+            # seeded hashes are independent, there is no step
+            return self.hash_strategy.indexes(item_digest, self.hash_count + 1, self.BLOCK_PRIME, start=1)
+        step = item_digest[1] % (self.BLOCK_PRIME - 1) + 1
+        index = item_digest[0] % self.BLOCK_PRIME
+        indexes = []
+        for _ in range(self.hash_count):
+            index += step
+            if index >= self.BLOCK_PRIME:
+                index -= self.BLOCK_PRIME
+            indexes.append(index)
+        return indexes
+
+    def block_indexes_many(self, digests):
+        '''
+        block_indexes of a (n, 2) digest array, as a (n, hash_count) array
+        '''
+        if not isinstance(self.hash_strategy, DoubleHashing):
+            return self.hash_strategy.indexes_many(digests, self.hash_count + 1, self.BLOCK_PRIME, start=1)
+        first = (digests[:, :1] % np.uint64(self.BLOCK_PRIME)).astype(np.int64)
+        steps = (digests[:, 1:2] % np.uint64(self.BLOCK_PRIME - 1)).astype(np.int64) + 1
+        return (first + np.arange(1, self.hash_count + 1, dtype=np.int64) * steps) % self.BLOCK_PRIME
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+
+        new_filter = BlockedBloomFilter(self.item_low_count, self.fp_prob, hash_strategy=self.hash_strategy)
+        new_filter.bit_array[:] = self.bit_array
+        return new_filter
+
+    def union(self, other):
+
+        if self.size != other.size:
+            raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
+
+        new_filter = self.copy()
+        new_filter.bit_array |= other.bit_array
+        return new_filter
+
+    def intersection(self, other):
+
+        if self.size != other.size:
+            raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
+
+        new_filter = self.copy()
+        new_filter.bit_array &= other.bit_array
+        return new_filter
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def get_bitarray_size(self):
+        return self.size // 8
+
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the bit array
+        '''
+        return self.bit_array.nbytes
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py)
+        '''
+        return memory_usage.build_report(self.nbytes, memory_usage.get_metadata_size(self, ("bit_array",)),
+                                         self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the bit array is a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.BLOCK_BITS,
+                  "item_low_count": self.item_low_count, "count": self.count, "fp_prob": self.fp_prob,
+                  "hash_strategy": self.hash_strategy.name}
+        return fields, {"probe": self.PROBE}, self.bit_array, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        if fields["slice_size"] != cls.BLOCK_BITS:
+            raise ValueError("Filter was saved with a different block size")
+        if fields["hash_strategy"] == DoubleHashing.name and metadata.get("probe") != cls.PROBE:
+            raise ValueError("Filter was saved with an older probe sequence, rebuild it")
+        new_filter = cls.__new__(cls)
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.size = fields["size"]
+        new_filter.block_count = new_filter.size // cls.BLOCK_BITS
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.bit_array = bitarray(buffer=payload, endian='big')
+        new_filter.count = fields["count"]
+        return new_filter
+
+    @classmethod
+    def get_size(self, n, p):
+        """
+        Return the size of bit array(m) to used using
+        following formula
+        m = -(n * lg(p)) / (lg(2)^2)
+        n : int
+            number of items expected to be stored in filter
+        p : float
+            False Positive probability in decimal
+        """
+        m = -(n * math.log(p)) / (math.log(2) ** 2)
+        return int(m)
+
+    @classmethod
+    def get_hash_count(self, m, n):
+        '''
+        Return the hash function(k) to be used using
+        following formula
+        k = (m/n) * lg(2)
+
+        m : int
+            size of bit array
+        n : int
+            number of items expected to be stored in filter
+        '''
+        k = (m / n) * math.log(2)
+        return int(k)
@@ -1,16 +1,27 @@
 import math
-import mmh3
+import numpy as np
 from bitarray import bitarray
+from bitarray.util import count_and
+
+from bitOps import chunks, get_bits, set_bits
+from fillStats import FillStats, estimate_overlap
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
 
 
 class BloomFilter(object):
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by add_many / contains_many
 
-    def __init__(self, items_count, fp_prob, count_size = 0):
+    def __init__(self, items_count, fp_prob, count_size = 0, hash_strategy=None):
         """
         items_count : int
             Number of items expected to be stored in bloom filter
         fp_prob : float
             False Positive probability in decimal
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
         """
 
         self.item_low_count = items_count
@@ -29,14 +40,19 @@ class BloomFilter(object):
         # slice size
         self.slice_size = self.size // self.hash_count
 
-        # Bit array of given size 
-        self.bit_array = bitarray(self.size)
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        # Bit array of given size, rounded up to whole bytes so a filter
+        # loaded from a file (see serialization.py) has the same length
+        self.bit_array = bitarray(self.size + (-self.size % 8), endian='big')
 
         # initialize all bits as 0 
         self.bit_array.setall(0)
 
         self.count = 0
 
+        self.fill_stats = FillStats(self.slice_size, self.hash_count)
+
     def add(self, item):
         ''' 
         Add an item in the filter 
@@ -45,21 +61,27 @@ class BloomFilter(object):
         if item in self:
             return False
         """
+        return self.add_digest(self.hash_strategy.digest(item))
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        '''
         if self.count > self.item_low_count:
             print("BloomFilter reached it's limit")
             return False
         digests = []
         start_point =0
-        for i in range(self.hash_count):
-            # create digest for given item.
-            # i work as seed to mmh3.hash() function 
-            # With different seed, digest created is different 
-            digest = mmh3.hash(item, i) % self.slice_size
+        dirty, block, blocks_per_slice = self.fill_stats.dirty, 0, self.fill_stats.blocks_per_slice
+        # every slice derives its index from the same digest
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
             digests.append(start_point + digest)
 
             # set the bit True in bit_array
             self.bit_array[start_point + digest] = True
+            dirty[block + (digest >> FillStats.BLOCK_BITS)] = 1
             start_point += self.slice_size
+            block += blocks_per_slice
         self.count += 1
         return True
 
@@ -67,9 +89,14 @@ class BloomFilter(object):
         ''' 
         Check for existence of an item in filter 
         '''
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+        '''
+        Check for existence of an item in filter from its digest
+        '''
         start_point = 0
-        for i in range(self.hash_count):
-            digest = mmh3.hash(item, i) % self.slice_size
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
             if not self.bit_array[start_point + digest]:
                 # if any of bit is False then,its not present
                 # in filter 
@@ -78,6 +105,46 @@ class BloomFilter(object):
             start_point += self.slice_size
         return True
 
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter
+        Returns the number of items added
+        '''
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            remaining = self.item_low_count + 1 - self.count
+            if remaining <= 0:
+                print("BloomFilter reached it's limit")
+                break
+            if len(chunk) > remaining:
+                print("BloomFilter reached it's limit")
+                chunk = chunk[:remaining]
+            positions = self.hash_many(chunk)
+            set_bits(self.bit_array, positions)
+            self.fill_stats.mark_many(positions)
+            self.count += len(chunk)
+            added += len(chunk)
+        return added
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        results = [get_bits(self.bit_array, self.hash_many(chunk)).all(axis=1)
+                   for chunk in chunks(items, self.CHUNK_SIZE)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def hash_many(self, items):
+        '''
+        Return a (len(items), hash_count) array of bit positions
+        '''
+        digests = self.hash_strategy.digest_many(items, self.hash_count)
+        start_points = np.arange(self.hash_count, dtype=np.int64) * self.slice_size
+        return self.hash_strategy.indexes_many(digests, self.hash_count, self.slice_size) + start_points
+
     def set_item(self, item):
         '''
         Add an item in the filter
@@ -85,8 +152,8 @@ class BloomFilter(object):
         if item in self:
             start_point = 0
             temp = ""
-            for i in range(self.hash_count):
-                digest = mmh3.hash(item, i) % self.slice_size
+            item_digest = self.hash_strategy.digest(item)
+            for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
                 temp.join(str(start_point + digest))
                 start_point += self.slice_size
             setattr(self, temp, getattr(self, temp)+1)
@@ -98,15 +165,13 @@ class BloomFilter(object):
         digests = []
         start_point = 0
         temp = ""
-        for i in range(self.hash_count):
-            # create digest for given item.
-            # i work as seed to mmh3.hash() function
-            # With different seed, digest created is different
-            digest = mmh3.hash(item, i) % self.slice_size
+        item_digest = self.hash_strategy.digest(item)
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
             digests.append(start_point + digest)
             temp.join(str(start_point + digest))
             # set the bit True in bit_array
             self.bit_array[start_point + digest] = True
+            self.fill_stats.mark(start_point + digest)
             start_point += self.slice_size
         self.count += 1
         setattr(self, temp, 1)
@@ -115,9 +180,20 @@ class BloomFilter(object):
     def __len__(self):
         return self.count
 
+    def stats(self):
+        '''
+        Return the fill ratio, the estimated number of distinct items, the
+        estimated current fp rate and the fill of every slice (see fillStats.py)
+        '''
+        return self.fill_stats.stats(self.count_set, self.hash_count, self.count)
+
+    def count_set(self, start, stop):
+        # popcount of the bitarray, in C
+        return self.bit_array.count(1, start, stop)
+
     def copy(self):
 
-        new_filter = BloomFilter(self.item_low_count, self.fp_prob)
+        new_filter = BloomFilter(self.item_low_count, self.fp_prob, hash_strategy=self.hash_strategy)
         new_filter.bit_array = self.bit_array.copy()
         return new_filter
 
@@ -126,6 +202,8 @@ class BloomFilter(object):
         if self.size != other.size:
             # or self.fp_prob != other.fp.prob :
             raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
 
         new_filter = self.copy()
         new_filter.bit_array = new_filter.bit_array | other.bit_array
@@ -136,11 +214,59 @@ class BloomFilter(object):
         if self.size != other.size:
             # or self.fp_prob != other.fp.prob :
             raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
 
         new_filter = self.copy()
         new_filter.bit_array = new_filter.bit_array & other.bit_array
         return new_filter
 
+    def estimate_union_size(self, other):
+        '''
+        Return the estimated number of distinct items in the union of both
+        filters, without building the union
+        '''
+        return float(self.compare_many([other])["union_size"][0])
+
+    def estimate_intersection_size(self, other):
+        '''
+        Return the estimated number of items added to both filters
+        '''
+        return float(self.compare_many([other])["intersection_size"][0])
+
+    def jaccard(self, other):
+        '''
+        Return the estimated Jaccard similarity of the sets of both filters
+        '''
+        return float(self.compare_many([other])["jaccard"][0])
+
+    def compare_many(self, others):
+        '''
+        Compare the filter with every filter of others (of the same size)
+        Returns a dict of float numpy arrays, "union_size",
+        "intersection_size" and "jaccard", one value per filter of others
+        -The set bits of every filter come from its cached stats(), the set
+        bits of every AND from one popcount over both buffers (count_and, in
+        C, no array is allocated), the OR has X1 + X2 - X_and set bits
+        '''
+        for other in others:
+            if self.size != other.size:
+                raise ValueError("Filters must have same size to be compared")
+            if self.hash_strategy.name != other.hash_strategy.name:
+                raise ValueError("Filters must use the same hash strategy")
+        set_count = self.stats()["set_positions"]
+        other_set_counts = np.fromiter((other.stats()["set_positions"] for other in others), dtype=np.float64,
+                                       count=len(others))
+        and_counts = np.fromiter((count_and(self.bit_array, other.bit_array) for other in others), dtype=np.float64,
+                                 count=len(others))
+        union_sizes, intersection_sizes = estimate_overlap(self.size, self.hash_count, set_count, other_set_counts,
+                                                           and_counts)
+        jaccard = np.zeros(len(others))
+        # nan when the union is saturated (inf / inf)
+        with np.errstate(invalid="ignore"):
+            np.divide(intersection_sizes, union_sizes, out=jaccard, where=union_sizes > 0)
+        return {"union_size": union_sizes, "intersection_size": intersection_sizes, "jaccard": jaccard}
+
     def __or__(self, other):
         return self.union(other)
 
@@ -150,6 +276,55 @@ class BloomFilter(object):
     def get_bitarray_size(self):
         return self.bit_array.buffer_info()[4]
 
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the bit array
+        '''
+        return self.bit_array.nbytes
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py)
+        '''
+        return memory_usage.build_report(self.nbytes, memory_usage.get_metadata_size(self, ("bit_array",)),
+                                         self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the bit array is a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.slice_size,
+                  "item_low_count": self.item_low_count, "count": self.count, "fp_prob": self.fp_prob,
+                  "hash_strategy": self.hash_strategy.name}
+        return fields, {}, self.bit_array, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = cls.__new__(cls)
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.size = fields["size"]
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.slice_size = fields["slice_size"]
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.bit_array = bitarray(buffer=payload, endian='big')
+        new_filter.count = fields["count"]
+        new_filter.fill_stats = FillStats(new_filter.slice_size, new_filter.hash_count)
+        return new_filter
+
     """
 
     def calculate_hashes(self, item):
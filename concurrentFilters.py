@@ -0,0 +1,345 @@
+import contextlib
+import threading
+import numpy as np
+
+from bitOps import chunks, set_bits
+from bloomFilter import BloomFilter
+from countingBloomFilter import CountingBloomFilter
+from fillStats import FillStats
+from scalableBloomFilter import ScalableBloomFilter
+
+"""
+Thread-safe variants of the filters, for a pool of threads adding and
+looking up keys concurrently (also on free-threaded python builds).
+
+Lookups take no lock. Bits are only ever set by a bloom filter, so a lookup
+running next to an add of the same key sees it as absent or present, never
+corrupted. Writes of a position are serialized by the lock of its stripe
+(StripedLocks), so the read-modify-write of a bit byte or of a counter never
+loses a concurrent update, and writes to different stripes run in parallel.
+The item count is updated under its own lock.
+Bulk operations (copy, union, intersection, combine, set_values, compact) are
+not synchronized with concurrent writers: they read or replace the whole
+array without taking the stripe locks, so writers must be paused while they
+run. The filters they return (copy, union, intersection, and difference of the
+counting filter) are concurrent filters of the same class with fresh locks.
+"""
+
+
+class StripedLocks(object):
+    """
+    A fixed set of locks guarding the positions of a bit or counter array
+    -The array is split in blocks of 2^STRIPE_BITS positions, block b is
+    guarded by lock b % stripes, consecutive blocks use different locks
+    -A block covers whole bytes for every count_size, so positions sharing a
+    byte always share a lock
+    """
+    STRIPE_BITS = 6
+    # 64 positions per block
+    STRIPES = 64
+
+    def __init__(self, stripes=STRIPES):
+        if stripes & (stripes - 1):
+            raise ValueError("stripes must be a power of 2")
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.mask = stripes - 1
+
+    def lock(self, position):
+        return self.locks[(position >> self.STRIPE_BITS) & self.mask]
+
+    def hold(self, positions):
+        '''
+        Return a context manager holding the locks of all the positions, they
+        are taken in stripe order so two holders cannot deadlock
+        '''
+        with contextlib.ExitStack() as stack:
+            for stripe in sorted({(position >> self.STRIPE_BITS) & self.mask for position in positions}):
+                stack.enter_context(self.locks[stripe])
+            return stack.pop_all()
+
+    def apply(self, positions, update):
+        '''
+        Call update(positions of one stripe) for every stripe of a numpy array
+        of positions, holding the lock of the stripe
+        '''
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        stripes = (positions >> self.STRIPE_BITS) & self.mask
+        order = np.argsort(stripes, kind="stable")
+        positions = positions[order]
+        bounds = np.searchsorted(stripes[order], np.arange(len(self.locks) + 1)).tolist()
+        for stripe, lock in enumerate(self.locks):
+            if bounds[stripe] < bounds[stripe + 1]:
+                with lock:
+                    update(positions[bounds[stripe]:bounds[stripe + 1]])
+
+
+class ConcurrentBloomFilter(BloomFilter):
+    """
+    BloomFilter safe for concurrent add / add_many and lookups
+    """
+
+    def __init__(self, items_count, fp_prob, count_size=0, hash_strategy=None, stripes=StripedLocks.STRIPES):
+        """
+        stripes : int
+            Number of write locks, a power of 2
+        """
+        super().__init__(items_count, fp_prob, count_size=count_size, hash_strategy=hash_strategy)
+        self.init_locks(stripes)
+
+    def init_locks(self, stripes=StripedLocks.STRIPES):
+        self.stripe_locks = StripedLocks(stripes)
+        # guards count, the capacity of a write is reserved before the write
+        self.count_lock = threading.Lock()
+
+    def copy(self):
+        '''
+        Copy of the filter with its own locks, union and intersection go
+        through it and return concurrent filters too
+        '''
+        new_filter = type(self)(self.item_low_count, self.fp_prob, hash_strategy=self.hash_strategy,
+                                stripes=len(self.stripe_locks.locks))
+        new_filter.bit_array = self.bit_array.copy()
+        return new_filter
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        '''
+        with self.count_lock:
+            if self.count > self.item_low_count:
+                print("BloomFilter reached it's limit")
+                return False
+            self.count += 1
+        start_point = 0
+        dirty, block, blocks_per_slice = self.fill_stats.dirty, 0, self.fill_stats.blocks_per_slice
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+            with self.stripe_locks.lock(start_point + digest):
+                self.bit_array[start_point + digest] = True
+            dirty[block + (digest >> FillStats.BLOCK_BITS)] = 1
+            start_point += self.slice_size
+            block += blocks_per_slice
+        return True
+
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter, keys are hashed without
+        any lock and bits are set one stripe at a time
+        Returns the number of items added
+        '''
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            with self.count_lock:
+                remaining = self.item_low_count + 1 - self.count
+                if remaining <= 0:
+                    print("BloomFilter reached it's limit")
+                    break
+                if len(chunk) > remaining:
+                    print("BloomFilter reached it's limit")
+                    chunk = chunk[:remaining]
+                self.count += len(chunk)
+            positions = self.hash_many(chunk)
+            self.stripe_locks.apply(positions, lambda stripe: set_bits(self.bit_array, stripe))
+            self.fill_stats.mark_many(positions)
+            added += len(chunk)
+        return added
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = super().from_file_record(fields, metadata, payload, children)
+        new_filter.init_locks()
+        return new_filter
+
+
+class ConcurrentCountingBloomFilter(CountingBloomFilter):
+    """
+    CountingBloomFilter safe for concurrent add / add_many / delete and lookups
+    -Every counter is incremented or decremented under the lock of its stripe,
+    a delete holds the locks of all the counters of the item
+    -With overflow, the overflow table entry of a counter is guarded by the
+    lock of the counter, overflow_count by the count lock
+    """
+
+    def __init__(self, items_count, fp_prob, count_size=4, hash_strategy=None, overflow=False,
+                 stripes=StripedLocks.STRIPES):
+        """
+        stripes : int
+            Number of write locks, a power of 2
+        """
+        super().__init__(items_count, fp_prob, count_size=count_size, hash_strategy=hash_strategy,
+                         overflow=overflow)
+        self.init_locks(stripes)
+
+    def init_locks(self, stripes=StripedLocks.STRIPES):
+        self.stripe_locks = StripedLocks(stripes)
+        # guards count and overflow_count
+        self.count_lock = threading.Lock()
+
+    def copy(self):
+        '''
+        Copy of the filter with its own locks, union, intersection and
+        difference go through it and return concurrent filters too
+        '''
+        new_filter = type(self)(self.item_low_count, self.fp_prob, count_size=self.count_size,
+                                hash_strategy=self.hash_strategy, overflow=self.overflow is not None,
+                                stripes=len(self.stripe_locks.locks))
+        new_filter.bit_array = self.bit_array.copy()
+        if self.overflow is not None:
+            new_filter.overflow = dict(self.overflow)
+            new_filter.overflow_count = self.overflow_count
+        return new_filter
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        '''
+        with self.count_lock:
+            if self.count > self.item_low_count:
+                print("BloomFilter reached it's limit")
+                return False
+            self.count += 1
+        start_point = 0
+        dirty, block, blocks_per_slice = self.fill_stats.dirty, 0, self.fill_stats.blocks_per_slice
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+            with self.stripe_locks.lock(start_point + digest):
+                if self.overflow is not None:
+                    self.increment_counter(start_point + digest)
+                elif self.packed:
+                    self.bit_array.increment(start_point + digest)
+                else:
+                    self.binary_bitarray_adder(1, start_point + digest)
+            dirty[block + (digest >> FillStats.BLOCK_BITS)] = 1
+            start_point += self.slice_size
+            block += blocks_per_slice
+        return True
+
+    def increment_counter(self, index):
+        '''
+        Increment a counter (under the lock of its stripe), a saturated
+        counter also updates the shared overflow_count
+        '''
+        if self.get_bit_value(index) >= self.max_value:
+            with self.count_lock:
+                super().increment_counter(index)
+        else:
+            super().increment_counter(index)
+
+    def delete_digest(self, item_digest):
+        '''
+        Delete an item from its digest, the locks of all its counters are held
+        from the membership check to the last decrement, so two threads
+        deleting the same item cannot both see it and decrement twice
+        '''
+        digests = list(self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size))
+        positions = [slice_index * self.slice_size + digest for slice_index, digest in enumerate(digests)]
+        with self.stripe_locks.hold(positions):
+            if not self.contains_digest(item_digest):
+                return False
+            for position in positions:
+                if self.overflow is not None:
+                    self.decrement_counter(position)
+                elif self.packed:
+                    self.bit_array.decrement(position)
+                else:
+                    self.binary_bitarray_sub(1, position)
+        dirty, blocks_per_slice = self.fill_stats.dirty, self.fill_stats.blocks_per_slice
+        for slice_index, digest in enumerate(digests):
+            dirty[slice_index * blocks_per_slice + (digest >> FillStats.BLOCK_BITS)] = 1
+        with self.count_lock:
+            self.count -= 1
+        return True
+
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter, keys are hashed without
+        any lock and counters are incremented one stripe at a time
+        Returns the number of items added
+        '''
+        if not self.packed:
+            return sum(1 for item in items if self.add(item))
+        update = self.increment_many if self.overflow is not None else self.bit_array.increment_many
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            with self.count_lock:
+                remaining = self.item_low_count + 1 - self.count
+                if remaining <= 0:
+                    print("BloomFilter reached it's limit")
+                    break
+                if len(chunk) > remaining:
+                    print("BloomFilter reached it's limit")
+                    chunk = chunk[:remaining]
+                self.count += len(chunk)
+            positions = self.hash_many(chunk)
+            self.stripe_locks.apply(positions, update)
+            self.fill_stats.mark_many(positions)
+            added += len(chunk)
+        return added
+
+    def increment_many(self, indexes):
+        '''
+        Add 1 to the counter of every index, with overflow tracking, the
+        locks of the stripes of indexes must be held
+        '''
+        indexes, counts = np.unique(np.asarray(indexes, dtype=np.int64).ravel(), return_counts=True)
+        values = self.bit_array.get_many(indexes) + counts
+        saturated = values > self.max_value
+        if saturated.any():
+            with self.count_lock:
+                for index, count in zip(indexes[saturated].tolist(), counts[saturated].tolist()):
+                    old_value = self.overflow.get(index, self.bit_array.get(index))
+                    self.overflow[index] = old_value + count
+                    self.overflow_count += old_value + count - max(old_value, self.max_value)
+        self.bit_array.set_many(indexes, values)
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = super().from_file_record(fields, metadata, payload, children)
+        new_filter.init_locks()
+        return new_filter
+
+
+class ConcurrentScalableBloomFilter(ScalableBloomFilter):
+    """
+    ScalableBloomFilter safe for concurrent add / delete and lookups
+    -Layers are ConcurrentBloomFilter or ConcurrentCountingBloomFilter
+    -A new layer is created under layers_lock only if the full layer is
+    still the last one, so threads that find the last layer full at the same
+    time create a single new layer
+    -Two threads adding the same new key at the same time may both add it
+    """
+    LAYER_TYPES = {layer_type.__name__: layer_type
+                   for layer_type in (ConcurrentBloomFilter, ConcurrentCountingBloomFilter)}
+
+    def __init__(self, initial_items_count=100, fp_prob=0.001, growth=ScalableBloomFilter.SMALL_GROWTH,
+                 countable=False, count_size=8, hash_strategy=None, ratio=ScalableBloomFilter.TIGHTENING_RATIO,
+                 layer_type=None):
+        if layer_type is None:
+            layer_type = ConcurrentCountingBloomFilter if countable else ConcurrentBloomFilter
+        if layer_type not in self.LAYER_TYPES.values():
+            raise ValueError("layer_type must be one of " + ", ".join(self.LAYER_TYPES))
+        super().__init__(initial_items_count, fp_prob, growth=growth, countable=countable, count_size=count_size,
+                         hash_strategy=hash_strategy, ratio=ratio, layer_type=layer_type)
+
+    def add(self, item):
+
+        item_digest = self.hash_strategy.digest(item)
+        if self.contains_digest(item_digest):
+            return True
+        while True:
+            layers = self.bloom_filters
+            last = layers[-1] if layers else None
+            # add_digest reserves the capacity of the layer under its count
+            # lock and fails once the layer is full
+            if last is not None and last.count < last.item_low_count and last.add_digest(item_digest):
+                return False
+            self.open_layer(last)
+
+    def open_layer(self, full_layer):
+        '''
+        Append a new layer, unless full_layer is no longer the last layer
+        (another thread already appended one)
+        '''
+        with self.layers_lock:
+            last = self.bloom_filters[-1] if self.bloom_filters else None
+            if last is full_layer:
+                self.bloom_filters.append(self.create_layer(self.next_layer))
+                self.next_layer += 1
@@ -0,0 +1,317 @@
+import heapq
+import math
+import numpy as np
+
+from bitOps import chunks
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from packedCounters import PackedCounterArray, saturating_add
+from serialization import load_filter, save_filter
+
+
+class CountMinSketch(object):
+    """
+    Count-Min sketch (Cormode and Muthukrishnan)
+    -depth slices of width counters, laid out like the slices of
+    CountingBloomFilter, an item increments one counter per slice
+    -estimate_count is the minimum of its counters, it never underestimates
+    and overestimates by more than epsilon * total count with probability
+    at most delta
+    -With conservative update a counter is only raised up to the new
+    estimate of the item, which reduces the overestimation, but counts can
+    no longer be subtracted
+    -Optionally tracks the top_k most frequent items (heavy hitters)
+    """
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by update_many
+
+    def __init__(self, epsilon, delta, count_size=32, conservative=False, top_k=0, hash_strategy=None):
+        """
+        epsilon : float
+            Error of an estimate relative to the total count
+        delta : float
+            Probability that an estimate exceeds the error
+        count_size : int
+            Bits per counter, 16 (numpy uint16) or 32 (numpy uint32),
+            counters saturate at their max value
+        conservative : bool
+            Use conservative update
+        top_k : int
+            Number of heavy hitters to track, 0 to disable tracking
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
+        """
+        if count_size not in (16, 32):
+            raise ValueError("count_size must be 16 or 32")
+        self.epsilon = epsilon
+        self.delta = delta
+        self.count_size = count_size
+        self.conservative = conservative
+        self.top_k = top_k
+
+        self.slice_size = self.get_width(epsilon)
+        self.hash_count = self.get_depth(delta)
+        self.size = self.slice_size * self.hash_count
+
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+        self.bit_array = PackedCounterArray(self.size, count_size)
+
+        # total count of all updates
+        self.count = 0
+        # heavy hitter candidates, item -> estimate when last updated, pruned
+        # back to top_k items when it reaches 2 * top_k
+        self.candidates = {}
+
+    def add(self, item, count=1):
+        '''
+        Add count occurrences of an item
+        Returns the new estimate of the item
+        '''
+        return self.add_digest(self.hash_strategy.digest(item), count, item)
+
+    def add_digest(self, item_digest, count=1, item=None):
+        '''
+        Add count occurrences of an item from its digest, item is only
+        needed for top-K tracking
+        '''
+        positions = self.positions(item_digest)
+        if self.conservative:
+            estimate = min(self.bit_array.get(position) for position in positions) + count
+            for position in positions:
+                if self.bit_array.get(position) < estimate:
+                    self.bit_array.set(position, estimate)
+            estimate = min(estimate, self.bit_array.max_value)
+        else:
+            estimate = min(self.bit_array.increment(position, count) for position in positions)
+        self.count += count
+        if self.top_k and item is not None:
+            self.track(item, estimate)
+        return estimate
+
+    def estimate_count(self, item):
+        '''
+        Return the estimated number of occurrences of an item
+        '''
+        return self.estimate_count_digest(self.hash_strategy.digest(item))
+
+    def estimate_count_digest(self, item_digest):
+        return min(self.bit_array.get(position) for position in self.positions(item_digest))
+
+    def __getitem__(self, item):
+        return self.estimate_count(item)
+
+    def __contains__(self, item):
+        '''
+        Check whether an item may have been added
+        '''
+        return self.estimate_count(item) > 0
+
+    def positions(self, item_digest):
+        start_point = 0
+        positions = []
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+            positions.append(start_point + digest)
+            start_point += self.slice_size
+        return positions
+
+    def update_many(self, items, counts=None):
+        '''
+        Add every item of the iterable, once or counts[i] times
+        Returns the new estimates as a numpy array
+        '''
+        items = items if isinstance(items, np.ndarray) else list(items)
+        counts = np.ones(len(items), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        if len(counts) != len(items):
+            raise ValueError("items and counts must have the same length")
+        results = []
+        for start, chunk in zip(range(0, len(items), self.CHUNK_SIZE), chunks(items, self.CHUNK_SIZE)):
+            chunk_counts = counts[start:start + len(chunk)]
+            positions = self.hash_many(chunk)
+            if self.conservative:
+                self.conservative_update_many(positions, chunk_counts)
+            else:
+                # the updates of a counter are summed first so repeated
+                # counters are read and written once
+                indexes, inverse = np.unique(positions.ravel(), return_inverse=True)
+                sums = np.bincount(inverse, weights=np.repeat(chunk_counts, self.hash_count)).astype(np.int64)
+                self.bit_array.set_many(indexes, self.bit_array.get_many(indexes) + sums)
+            self.count += int(chunk_counts.sum())
+            estimates = self.bit_array.get_many(positions).min(axis=1)
+            if self.top_k:
+                for item, estimate in zip(chunk, estimates.tolist()):
+                    self.track(item, estimate)
+            results.append(estimates)
+        if not results:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(results)
+
+    def conservative_update_many(self, positions, counts):
+        '''
+        Every item raises its counters to (minimum before the batch + its
+        total count in the batch), a counter never ends below the estimate of
+        any item mapped to it, so estimates still never underestimate
+        '''
+        rows, inverse = np.unique(positions, axis=0, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=counts).astype(np.int64)
+        targets = self.bit_array.get_many(rows).min(axis=1) + totals
+        indexes, slots = np.unique(rows.ravel(), return_inverse=True)
+        raised = self.bit_array.get_many(indexes)
+        np.maximum.at(raised, slots, np.repeat(targets, self.hash_count))
+        self.bit_array.set_many(indexes, raised)
+
+    def estimate_many(self, items):
+        '''
+        Return the estimated counts of every item of the iterable as a numpy array
+        '''
+        results = [self.bit_array.get_many(self.hash_many(chunk)).min(axis=1)
+                   for chunk in chunks(items, self.CHUNK_SIZE)]
+        if not results:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(results)
+
+    def hash_many(self, items):
+        '''
+        Return a (len(items), depth) array of counter positions
+        '''
+        digests = self.hash_strategy.digest_many(items, self.hash_count)
+        start_points = np.arange(self.hash_count, dtype=np.int64) * self.slice_size
+        return self.hash_strategy.indexes_many(digests, self.hash_count, self.slice_size) + start_points
+
+    def track(self, item, estimate):
+        self.candidates[item] = estimate
+        if len(self.candidates) >= 2 * self.top_k:
+            self.prune()
+
+    def prune(self):
+        '''
+        Keep the top_k candidates with the highest estimates
+        '''
+        self.candidates = dict(heapq.nlargest(self.top_k, self.candidates.items(), key=lambda pair: pair[1]))
+
+    def top(self, n=None):
+        '''
+        Return the n (default top_k) most frequent tracked items as a list of
+        (item, estimated count), most frequent first
+        '''
+        n = self.top_k if n is None else n
+        candidates = list(self.candidates)
+        estimates = self.estimate_many(candidates).tolist()
+        return heapq.nlargest(n, zip(candidates, estimates), key=lambda pair: pair[1])
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+
+        new_sketch = CountMinSketch(self.epsilon, self.delta, count_size=self.count_size,
+                                    conservative=self.conservative, top_k=self.top_k, hash_strategy=self.hash_strategy)
+        new_sketch.bit_array = self.bit_array.copy()
+        new_sketch.count = self.count
+        new_sketch.candidates = dict(self.candidates)
+        return new_sketch
+
+    def merge(self, other):
+        '''
+        Return the sketch of both streams, counters are added
+        '''
+        new_sketch = self.copy()
+        new_sketch |= other
+        return new_sketch
+
+    def __ior__(self, other):
+        '''
+        In place merge, counters are added and saturate at the counter range
+        '''
+        if self.size != other.size or self.hash_count != other.hash_count or self.count_size != other.count_size:
+            raise ValueError("Sketches must have the same shape to merge")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Sketches must use the same hash strategy")
+        self.bit_array.combine(other.bit_array, saturating_add)
+        self.count += other.count
+        if self.top_k:
+            candidates = list(set(self.candidates) | set(other.candidates))
+            self.candidates = dict(zip(candidates, self.estimate_many(candidates).tolist()))
+            self.prune()
+        return self
+
+    def __or__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def get_bitarray_size(self):
+        return self.bit_array.nbytes
+
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the counter array
+        '''
+        return self.bit_array.nbytes
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per counted item
+        (constant time, see memory_usage.py, top-K candidates are counted
+        as one dict)
+        '''
+        metadata_bytes = memory_usage.get_metadata_size(self, ("bit_array",)) + self.bit_array.metadata_nbytes
+        return memory_usage.build_report(self.nbytes, metadata_bytes, self.count)
+
+    def save(self, path):
+        '''
+        Save the sketch in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved sketch, with mmap=True the counters are a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        # top-K candidates are saved only if they can be stored as json
+        candidates = self.candidates if all(isinstance(item, str) for item in self.candidates) else {}
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.slice_size,
+                  "count_size": self.count_size, "count": self.count, "fp_prob": self.epsilon,
+                  "hash_strategy": self.hash_strategy.name}
+        metadata = {"delta": self.delta, "conservative": self.conservative, "top_k": self.top_k,
+                    "candidates": candidates}
+        return fields, metadata, self.bit_array.buffer, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_sketch = cls.__new__(cls)
+        new_sketch.epsilon = fields["fp_prob"]
+        new_sketch.delta = metadata["delta"]
+        new_sketch.count_size = fields["count_size"]
+        new_sketch.conservative = metadata["conservative"]
+        new_sketch.top_k = metadata["top_k"]
+        new_sketch.slice_size = fields["slice_size"]
+        new_sketch.hash_count = fields["hash_count"]
+        new_sketch.size = fields["size"]
+        new_sketch.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_sketch.bit_array = PackedCounterArray(new_sketch.size, new_sketch.count_size, buffer=payload)
+        new_sketch.count = fields["count"]
+        new_sketch.candidates = metadata["candidates"]
+        return new_sketch
+
+    @classmethod
+    def get_width(self, epsilon):
+        '''
+        Return the counters per slice(w) using following formula
+        w = e / epsilon
+        '''
+        return math.ceil(math.e / epsilon)
+
+    @classmethod
+    def get_depth(self, delta):
+        '''
+        Return the number of slices(d) using following formula
+        d = ln(1 / delta)
+        '''
+        return max(math.ceil(math.log(1 / delta)), 1)
@@ -1,20 +1,38 @@
 import math
-import mmh3
 import numpy as np
 from bitarray import bitarray
 from bitstring import BitArray
 
+from bitOps import check_writeable, chunks
+from fillStats import FillStats
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
+from packedCounters import PackedCounterArray, clamped_subtract, minimum, saturating_add
+
 
 class CountingBloomFilter(object):
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by add_many / contains_many
 
-    def __init__(self, items_count, fp_prob, count_size=4):
+    def __init__(self, items_count, fp_prob, count_size=4, hash_strategy=None, overflow=False):
         """
         items_count : int
             Number of items expected to be stored in bloom filter
         fp_prob : float
             False Positive probability in decimal
+        count_size : int
+            Bits per counter, 1, 2, 4, 8, 16 and 32 use the packed numpy
+            backend (packedCounters.py), other sizes use a bitarray
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
+        overflow : bool
+            Saturate counters at their max value and keep the exact count of
+            saturated counters in an overflow table, so deletes stay correct
+            whatever count_size is
         """
         self.count_size = count_size
+        self.max_value = (1 << count_size) - 1
         self.item_low_count = items_count
         # False posible probability in decimal
         self.fp_prob = fp_prob
@@ -31,16 +49,33 @@ class CountingBloomFilter(object):
         # slice size
         self.slice_size = self.size // self.hash_count
 
-        if self.count_size == 8:
-            self.bit_array = bytearray(self.size)
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        self.packed = self.count_size in PackedCounterArray.COUNT_SIZES
+        if self.packed:
+            self.bit_array = PackedCounterArray(self.size, self.count_size)
         else:
-            self.bit_array = bitarray(self.size*self.count_size)
+            self.bit_array = bitarray(self.size*self.count_size, endian='big')
             self.bit_array.setall(0)
 
+        # counter index -> exact count, for the saturated counters whose count
+        # is above max_value, None when overflow tracking is off
+        self.overflow = {} if overflow else None
+        # number of increments that went over max_value, a count_size that is
+        # too small shows up here
+        self.overflow_count = 0
+
         self.count = 0
 
+        self.fill_stats = FillStats(self.slice_size, self.hash_count)
+
     def set_value_bit(self, index, value):
 
+        self.fill_stats.mark(index)
+        if self.packed:
+            self.bit_array.set(index, value)
+            return
+
         temp = bitarray(('{0:0' + str(self.count_size) + 'b}').format(value))
         if temp.length() == self.count_size:
             for i in range(self.count_size - 1, -1, -1):
@@ -50,8 +85,8 @@ class CountingBloomFilter(object):
 
     def get_bit_value(self, index):
 
-        if self.count_size == 8:
-            return self.bit_array[index]
+        if self.packed:
+            return self.bit_array.get(index)
 
         value = 0
         for i in range(self.count_size - 1, -1, -1):
@@ -100,41 +135,89 @@ class CountingBloomFilter(object):
         if item in self:
             return False
         """
+        return self.add_digest(self.hash_strategy.digest(item))
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        '''
         if self.count > self.item_low_count:
             print("BloomFilter reached it's limit")
             return False
 
         start_point = 0
-        for i in range(self.hash_count):
-            # create digest for given item.
-            # i work as seed to mmh3.hash() function
-            # With different seed, digest created is different
-            digest = mmh3.hash(item, i) % self.slice_size
-
-
-            # set the bit True in int_array
-            if self.count_size == 8:
-                self.bit_array[start_point + digest] += 1
+        dirty, block, blocks_per_slice = self.fill_stats.dirty, 0, self.fill_stats.blocks_per_slice
+        # every slice derives its index from the same digest
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+
+            # increment the counter
+            if self.overflow is not None:
+                self.increment_counter(start_point + digest)
+            elif self.packed:
+                self.bit_array.increment(start_point + digest)
             else:
                 self.binary_bitarray_adder(1, start_point + digest)
+            dirty[block + (digest >> FillStats.BLOCK_BITS)] = 1
             start_point += self.slice_size
+            block += blocks_per_slice
         self.count += 1
         return True
 
+    def increment_counter(self, index):
+        '''
+        Increment a counter, a saturated counter stays at max_value and its
+        exact count goes to the overflow table
+        '''
+        if self.get_bit_value(index) >= self.max_value:
+            self.overflow[index] = self.overflow.get(index, self.max_value) + 1
+            self.overflow_count += 1
+        elif self.packed:
+            self.bit_array.increment(index)
+        else:
+            self.binary_bitarray_adder(1, index)
+
+    def decrement_counter(self, index):
+        '''
+        Decrement a counter, using the exact count of a saturated counter
+        '''
+        if index in self.overflow:
+            self.overflow[index] -= 1
+            if self.overflow[index] <= self.max_value:
+                del self.overflow[index]
+        elif self.packed:
+            self.bit_array.decrement(index)
+        else:
+            self.binary_bitarray_sub(1, index)
+
+    def get_count(self, index):
+        '''
+        Return the exact value of a counter, from the overflow table if it is saturated
+        '''
+        if self.overflow and index in self.overflow:
+            return self.overflow[index]
+        return self.get_bit_value(index)
+
     def delete(self, item):
 
-        if item in self:
+        return self.delete_digest(self.hash_strategy.digest(item))
 
-            start_point = 0
-            for i in range(self.hash_count):
-                digest = mmh3.hash(item, i) % self.slice_size
+    def delete_digest(self, item_digest):
+
+        if self.contains_digest(item_digest):
 
-                if self.count_size == 8:
-                    self.bit_array[start_point + digest] -= 1
+            start_point = 0
+            dirty, block, blocks_per_slice = self.fill_stats.dirty, 0, self.fill_stats.blocks_per_slice
+            for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+                if self.overflow is not None:
+                    self.decrement_counter(start_point + digest)
+                elif self.packed:
+                    self.bit_array.decrement(start_point + digest)
                 else:
                     self.binary_bitarray_sub(1,start_point + digest)
 
+                dirty[block + (digest >> FillStats.BLOCK_BITS)] = 1
                 start_point += self.slice_size
+                block += blocks_per_slice
             self.count -= 1
             return True
         return False
@@ -143,11 +226,16 @@ class CountingBloomFilter(object):
         '''
         Check for existence of an item in filter
         '''
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+        '''
+        Check for existence of an item in filter from its digest
+        '''
         start_point = 0
-        for i in range(self.hash_count):
-            digest = mmh3.hash(item, i) % self.slice_size
-            if self.count_size == 8:
-                if not self.bit_array[start_point + digest] > 0:
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+            if self.packed:
+                if not self.bit_array.get(start_point + digest) > 0:
                     # if
                     return False
             else:
@@ -157,46 +245,126 @@ class CountingBloomFilter(object):
             start_point += self.slice_size
         return True
 
+    def estimate_count(self, item):
+        '''
+        Return the minimum counter of the item over the slices, an upper
+        bound of the number of times it was added (as in a Count-Min sketch,
+        see countMinSketch.py for counters that do not saturate)
+        '''
+        start_point = 0
+        estimate = None
+        for digest in self.hash_strategy.indexes(self.hash_strategy.digest(item), self.hash_count, self.slice_size):
+            value = self.get_count(start_point + digest)
+            if estimate is None or value < estimate:
+                estimate = value
+            start_point += self.slice_size
+        return estimate
+
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter
+        Returns the number of items added
+        '''
+        if not self.packed:
+            return sum(1 for item in items if self.add(item))
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            remaining = self.item_low_count + 1 - self.count
+            if remaining <= 0:
+                print("BloomFilter reached it's limit")
+                break
+            if len(chunk) > remaining:
+                print("BloomFilter reached it's limit")
+                chunk = chunk[:remaining]
+            positions = self.hash_many(chunk)
+            if self.overflow is not None:
+                self.increment_many(positions)
+            else:
+                self.bit_array.increment_many(positions)
+            self.fill_stats.mark_many(positions)
+            self.count += len(chunk)
+            added += len(chunk)
+        return added
+
+    def increment_many(self, indexes):
+        '''
+        Add 1 to the counter of every index, with overflow tracking
+        '''
+        # before the overflow table is touched
+        check_writeable(self.bit_array.array)
+        indexes, counts = np.unique(np.asarray(indexes, dtype=np.int64).ravel(), return_counts=True)
+        values = self.bit_array.get_many(indexes) + counts
+        # only the counters going over max_value are handled one by one
+        for index, count in zip(indexes[values > self.max_value].tolist(), counts[values > self.max_value].tolist()):
+            old_value = self.overflow.get(index, self.bit_array.get(index))
+            self.overflow[index] = old_value + count
+            self.overflow_count += old_value + count - max(old_value, self.max_value)
+        self.bit_array.set_many(indexes, values)
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        if not self.packed:
+            return np.fromiter((item in self for item in items), dtype=bool)
+        results = [self.bit_array.get_many(self.hash_many(chunk)).all(axis=1)
+                   for chunk in chunks(items, self.CHUNK_SIZE)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def hash_many(self, items):
+        '''
+        Return a (len(items), hash_count) array of counter positions
+        '''
+        digests = self.hash_strategy.digest_many(items, self.hash_count)
+        start_points = np.arange(self.hash_count, dtype=np.int64) * self.slice_size
+        return self.hash_strategy.indexes_many(digests, self.hash_count, self.slice_size) + start_points
+
     def __len__(self):
 
         return self.count
 
+    def stats(self):
+        '''
+        Return the fraction of non zero counters, the estimated number of
+        distinct items, the estimated current fp rate and the fill of every
+        slice (see fillStats.py)
+        '''
+        return self.fill_stats.stats(self.count_set, self.hash_count, self.count)
+
+    def count_set(self, start, stop):
+        if self.packed:
+            return self.bit_array.count_nonzero(start, stop)
+        first = start * self.count_size
+        bits = np.unpackbits(np.frombuffer(self.bit_array, dtype=np.uint8)[first >> 3:-(-stop * self.count_size // 8)])
+        bits = bits[first & 7:(first & 7) + (stop - start) * self.count_size]
+        return int(np.count_nonzero(bits.reshape(-1, self.count_size).any(axis=1)))
+
     # TODO consider union and intersection operations can be useful and work correctly
     #  for counting and scalable bloom filters
 
     def copy(self):
 
-        new_filter = CountingBloomFilter(self.item_low_count, self.fp_prob, count_size=self.count_size)
+        new_filter = CountingBloomFilter(self.item_low_count, self.fp_prob, count_size=self.count_size,
+                                         hash_strategy=self.hash_strategy, overflow=self.overflow is not None)
         new_filter.bit_array = self.bit_array.copy()
+        if self.overflow is not None:
+            new_filter.overflow = dict(self.overflow)
+            new_filter.overflow_count = self.overflow_count
         return new_filter
 
     def union(self, other):
 
-        if self.size != other.size:
-            # or self.fp_prob != other.fp.prob :
-            raise ValueError("Filters must have same size for union")
-
         new_filter = self.copy()
-        for i in range(0, new_filter.size):
-            if new_filter.count_size == 8:
-                new_filter.bit_array[i] += other.bit_array[i]
-            else:
-                new_filter.binary_bitarray_adder(other.get_bit_value(i), i)
+        new_filter |= other
         return new_filter
 
     def intersection(self, other):
 
-        if self.size != other.size:
-            # or self.fp_prob != other.fp.prob :
-            raise ValueError("Filters must have same size for union")
-
         new_filter = self.copy()
-
-        for i in range(0, new_filter.size):
-            if self.count_size == 8:
-                new_filter.bit_array[i] = min(new_filter.bit_array[i], other.bit_array[i])
-            else:
-                new_filter.set_value_bit(i, min(new_filter.get_bit_value(i), other.get_bit_value(i)))
+        new_filter &= other
         return new_filter
 
     def __or__(self, other):
@@ -206,26 +374,167 @@ class CountingBloomFilter(object):
         return self.intersection(other)
 
     def __sub__(self, other):
-        if self.size != other.size:
-            # or self.fp_prob != other.fp.prob :
-            raise ValueError("Filters must have same size for union")
 
         new_filter = self.copy()
-
-        for i in range(0, new_filter.size):
-            if self.count_size == 8:
-                new_filter.bit_array[i] -= other.bit_array[i]
-            else:
-                new_filter.binary_bitarray_sub(other.get_bit_value(i), i)
-                new_filter.set_value_bit(i, min(new_filter.get_bit_value(i), other.get_bit_value(i)))
+        new_filter -= other
         return new_filter
 
     def __add__(self, other):
         return self.union(other)
 
+    def __ior__(self, other):
+        '''
+        In place union, counters are added and saturate at the counter range
+        '''
+        self.combine(other, saturating_add)
+        return self
+
+    def __iand__(self, other):
+        '''
+        In place intersection, element-wise minimum of the counters
+        '''
+        self.combine(other, minimum)
+        return self
+
+    def __isub__(self, other):
+        '''
+        In place subtraction, counters are clamped at 0
+        '''
+        self.combine(other, clamped_subtract)
+        return self
+
+    def __iadd__(self, other):
+        return self.__ior__(other)
+
+    def combine(self, other, operation):
+
+        if self.size != other.size:
+            # or self.fp_prob != other.fp.prob :
+            raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
+
+        if self.overflow is not None:
+            # combine the exact counts, the counters saturate again and the
+            # counts above max_value go back to the overflow table
+            values = self.get_counts()
+            operation(values, other.get_counts(), np.iinfo(np.int64).max)
+            self.set_values(values)
+            self.overflow = {index: value for index, value in
+                             zip(np.flatnonzero(values > self.max_value).tolist(),
+                                 values[values > self.max_value].tolist())}
+            # increments above max_value of the combined counts
+            self.overflow_count = sum(value - self.max_value for value in self.overflow.values())
+        elif self.packed and other.packed and self.count_size == other.count_size:
+            self.bit_array.combine(other.bit_array, operation)
+        else:
+            values = self.get_values()
+            operation(values, other.get_values(), self.max_value)
+            self.set_values(values)
+        self.fill_stats.invalidate()
+
+    def get_values(self):
+        '''
+        Return all counters as an int64 numpy array
+        '''
+        if self.packed:
+            return self.bit_array.values()
+        bits = np.unpackbits(np.frombuffer(self.bit_array, dtype=np.uint8))[:self.size * self.count_size]
+        weights = 1 << np.arange(self.count_size - 1, -1, -1, dtype=np.int64)
+        return bits.reshape(self.size, self.count_size).astype(np.int64) @ weights
+
+    def get_counts(self):
+        '''
+        Return all exact counts as an int64 numpy array, the counters with
+        the overflow table applied
+        '''
+        values = self.get_values()
+        if self.overflow:
+            values[list(self.overflow)] = list(self.overflow.values())
+        return values
+
+    def set_values(self, values):
+        '''
+        Set all counters from a numpy array (clamped to the counter range)
+        '''
+        self.fill_stats.invalidate()
+        if self.packed:
+            self.bit_array.assign(values)
+            return
+        values = np.clip(values, 0, self.max_value)
+        shifts = np.arange(self.count_size - 1, -1, -1, dtype=np.int64)
+        bits = ((values[:, None] >> shifts) & 1).astype(np.uint8)
+        np.frombuffer(self.bit_array, dtype=np.uint8)[:] = np.packbits(bits.ravel())
+
     def get_bitarray_size(self):
+        if self.packed:
+            return self.bit_array.nbytes
         return self.bit_array.buffer_info()[4]
 
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the counter array
+        '''
+        return self.bit_array.nbytes
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py)
+        '''
+        metadata_bytes = memory_usage.get_metadata_size(self, ("bit_array",))
+        if self.packed:
+            metadata_bytes += self.bit_array.metadata_nbytes
+        return memory_usage.build_report(self.nbytes, metadata_bytes, self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the counters are a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.slice_size,
+                  "count_size": self.count_size, "item_low_count": self.item_low_count, "count": self.count,
+                  "fp_prob": self.fp_prob, "hash_strategy": self.hash_strategy.name}
+        payload = self.bit_array.buffer if self.packed else self.bit_array
+        metadata = {}
+        if self.overflow is not None:
+            metadata = {"overflow": [[index, value] for index, value in self.overflow.items()],
+                        "overflow_count": self.overflow_count}
+        return fields, metadata, payload, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = cls.__new__(cls)
+        new_filter.count_size = fields["count_size"]
+        new_filter.max_value = (1 << new_filter.count_size) - 1
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.size = fields["size"]
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.slice_size = fields["slice_size"]
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.packed = new_filter.count_size in PackedCounterArray.COUNT_SIZES
+        if new_filter.packed:
+            new_filter.bit_array = PackedCounterArray(new_filter.size, new_filter.count_size, buffer=payload)
+        else:
+            new_filter.bit_array = bitarray(buffer=payload, endian='big')
+        new_filter.overflow = dict(metadata["overflow"]) if "overflow" in metadata else None
+        new_filter.overflow_count = metadata.get("overflow_count", 0)
+        new_filter.count = fields["count"]
+        new_filter.fill_stats = FillStats(new_filter.slice_size, new_filter.hash_count)
+        return new_filter
+
     """
     def calculate_hashes(self, item):
         hashes = []
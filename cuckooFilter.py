@@ -0,0 +1,479 @@
+import math
+import random
+import numpy as np
+
+from bitOps import check_writeable, chunks
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
+
+
+class CuckooFilter(object):
+    """
+    Cuckoo filter (Fan et al., "Cuckoo Filter: Practically Better Than Bloom")
+    -Every item is stored as a short fingerprint in one of two buckets,
+    i1 = hash(item) and i2 = (hash(fingerprint) - i1) mod m, so the other
+    bucket of a stored fingerprint is known without the item and
+    fingerprints can be moved (kicked) to make room
+    -The bucket count m is not rounded to a power of 2, indexes are mapped
+    to [0, m) by multiply-shift and i -> (hash(fingerprint) - i) mod m is its
+    own inverse for any m
+    -Fingerprints are packed at fingerprint_bits in a big endian bit buffer
+    like XorFilter, a key costs fingerprint_bits / load factor bits:
+    10.5 bits at 1% against 38 for CountingBloomFilter with count_size 4,
+    13.7 bits at 0.1% against 58, with delete support as well
+    -Bucket i holds slots i * bucket_size to (i + 1) * bucket_size - 1, the
+    occupied slots of a bucket are always the first ones, an empty slot
+    holds 0
+    """
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by add_many / contains_many
+    BUCKET_SIZE = 4
+    # fingerprints per bucket, 4 reaches a 95% load factor
+    LOAD_FACTORS = {1: 0.5, 2: 0.84, 4: 0.95, 8: 0.98}
+    MAX_KICKS = 500
+    # relocations tried by add before the filter is reported full
+    HASH_RANGE = 1 << 32
+    # range of the two values taken from the digest, bucket index and fingerprint
+    FINGERPRINT_MULTIPLIER = 0x9E3779B97F4A7C15
+    # hash(fingerprint) is multiplicative (fibonacci) hashing, the top 32 bits
+    # of the 64 bit product are scaled to the bucket count
+    LAYOUT = "packed"
+    # bucket layout of the saved buffer, checked on load
+
+    def __init__(self, items_count, fp_prob, count_size=0, hash_strategy=None, bucket_size=BUCKET_SIZE,
+                 fingerprint_bits=None):
+        """
+        items_count : int
+            Number of items expected to be stored in the filter
+        fp_prob : float
+            False Positive probability in decimal
+        count_size : int
+            Unused, accepted so the filter can be a ScalableBloomFilter layer
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
+        bucket_size : int
+            Fingerprints per bucket, one of LOAD_FACTORS
+        fingerprint_bits : int
+            Bits of a fingerprint (up to 32), computed from fp_prob if None
+        """
+        if bucket_size not in self.LOAD_FACTORS:
+            raise ValueError("bucket_size must be one of " + str(tuple(self.LOAD_FACTORS)))
+        self.item_low_count = items_count
+        # False posible probability in decimal
+        self.fp_prob = fp_prob
+        self.bucket_size = bucket_size
+        self.fingerprint_bits = fingerprint_bits or self.get_fingerprint_bits(fp_prob, bucket_size)
+        if not 1 <= self.fingerprint_bits <= 32:
+            raise ValueError("fingerprint_bits must be between 1 and 32")
+
+        self.bucket_count = self.get_bucket_count(items_count, bucket_size)
+        self.size = self.bucket_count * bucket_size
+
+        # a lookup reads two buckets
+        self.hash_count = 2
+
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        # 8 bytes of padding for the unaligned loads
+        self.set_buffer(bytearray((self.size * self.fingerprint_bits + 7) // 8 + 8))
+        # fingerprint that could not be placed after MAX_KICKS relocations, as
+        # (bucket, fingerprint), the filter is full while it is set
+        self.victim = None
+
+        self.count = 0
+
+    def set_buffer(self, buffer):
+        self.buffer = buffer
+        # a slot is read from the 5 bytes holding it (32 bits + 7 bit offset),
+        # numpy reads 8 bytes per slot for batches
+        self.words = np.ndarray(shape=(len(buffer) - 7,), dtype='>u8', buffer=buffer, strides=(1,))
+        self.bytes = np.frombuffer(buffer, dtype=np.uint8)
+        self.fingerprint_mask = (1 << self.fingerprint_bits) - 1
+
+    def get_slot(self, slot):
+        bit = slot * self.fingerprint_bits
+        start = bit >> 3
+        word = int.from_bytes(self.buffer[start:start + 5], 'big')
+        return (word >> (40 - self.fingerprint_bits - (bit & 7))) & self.fingerprint_mask
+
+    def set_slot(self, slot, fingerprint):
+        bit = slot * self.fingerprint_bits
+        start = bit >> 3
+        shift = 40 - self.fingerprint_bits - (bit & 7)
+        word = int.from_bytes(self.buffer[start:start + 5], 'big')
+        word = (word & ~(self.fingerprint_mask << shift)) | (fingerprint << shift)
+        self.buffer[start:start + 5] = word.to_bytes(5, 'big')
+
+    def locate(self, item_digest):
+        '''
+        Return the first bucket and the fingerprint of a digest
+        '''
+        index, fingerprint = self.hash_strategy.indexes(item_digest, 2, self.HASH_RANGE)
+        return (index * self.bucket_count) >> 32, (fingerprint & self.fingerprint_mask) or 1
+
+    def alt_index(self, index, fingerprint):
+        offset = ((((fingerprint * self.FINGERPRINT_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> 32) * self.bucket_count) >> 32
+        return (offset - index) % self.bucket_count
+
+    def add(self, item):
+        '''
+        Add an item in the filter
+        '''
+        return self.add_digest(self.hash_strategy.digest(item))
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        Returns False if the filter is full
+        '''
+        if self.victim is not None:
+            return False
+        index, fingerprint = self.locate(item_digest)
+        if not self.insert(index, fingerprint):
+            self.insert(self.alt_index(index, fingerprint), fingerprint) or self.kick(index, fingerprint)
+        self.count += 1
+        return True
+
+    def insert(self, index, fingerprint):
+        '''
+        Put fingerprint in the first empty slot of the bucket, if any
+        '''
+        start = index * self.bucket_size
+        for slot in range(start, start + self.bucket_size):
+            if not self.get_slot(slot):
+                self.set_slot(slot, fingerprint)
+                return True
+        return False
+
+    def kick(self, index, fingerprint):
+        '''
+        Relocate fingerprints until one lands in a bucket with an empty slot,
+        the last fingerprint moved is kept as victim if none does
+        '''
+        if random.getrandbits(1):
+            index = self.alt_index(index, fingerprint)
+        for _ in range(self.MAX_KICKS):
+            slot = index * self.bucket_size + random.randrange(self.bucket_size)
+            old_fingerprint = self.get_slot(slot)
+            self.set_slot(slot, fingerprint)
+            fingerprint = old_fingerprint
+            index = self.alt_index(index, fingerprint)
+            if self.insert(index, fingerprint):
+                return True
+        self.victim = (index, fingerprint)
+        return False
+
+    def delete(self, item):
+
+        return self.delete_digest(self.hash_strategy.digest(item))
+
+    def delete_digest(self, item_digest):
+
+        index, fingerprint = self.locate(item_digest)
+        alt_index = self.alt_index(index, fingerprint)
+        if self.victim is not None and self.victim[1] == fingerprint and self.victim[0] in (index, alt_index):
+            self.victim = None
+        elif not (self.remove(index, fingerprint) or self.remove(alt_index, fingerprint)):
+            return False
+        self.count -= 1
+        if self.victim is not None:
+            # a slot was freed, retry the fingerprint that did not fit
+            index, fingerprint = self.victim
+            self.victim = None
+            if not self.insert(index, fingerprint):
+                self.kick(index, fingerprint)
+        return True
+
+    def remove(self, index, fingerprint):
+        '''
+        Remove one copy of fingerprint from the bucket, the last occupied slot
+        moves into its place so occupied slots stay first
+        '''
+        start = index * self.bucket_size
+        stop = start + self.bucket_size
+        for slot in range(start, stop):
+            if self.get_slot(slot) == fingerprint:
+                last = slot
+                while last + 1 < stop and self.get_slot(last + 1):
+                    last += 1
+                self.set_slot(slot, self.get_slot(last))
+                self.set_slot(last, 0)
+                return True
+        return False
+
+    def bucket_contains(self, index, fingerprint):
+        start = index * self.bucket_size
+        return any(self.get_slot(slot) == fingerprint for slot in range(start, start + self.bucket_size))
+
+    def __contains__(self, item):
+        '''
+        Check for existence of an item in filter
+        '''
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+        '''
+        Check for existence of an item in filter from its digest
+        '''
+        index, fingerprint = self.locate(item_digest)
+        if self.bucket_contains(index, fingerprint):
+            return True
+        alt_index = self.alt_index(index, fingerprint)
+        if self.bucket_contains(alt_index, fingerprint):
+            return True
+        return self.victim is not None and self.victim[1] == fingerprint and self.victim[0] in (index, alt_index)
+
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter
+        Returns the number of items added
+        '''
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            if self.victim is not None:
+                break
+            indexes, fingerprints = self.locate_many(chunk)
+            alt_indexes = self.alt_index_many(indexes, fingerprints)
+            # place what fits in the emptier of the two buckets, then in the
+            # other one, then relocate the rest in vectorized rounds, one at a
+            # time with kick if the rounds do not place them all
+            emptier = (np.count_nonzero(self.read_buckets(alt_indexes), axis=1) <
+                       np.count_nonzero(self.read_buckets(indexes), axis=1))
+            indexes, alt_indexes = np.where(emptier, alt_indexes, indexes), np.where(emptier, indexes, alt_indexes)
+            _, pending = self.place_many(indexes, fingerprints)
+            alt_indexes = alt_indexes[pending]
+            fingerprints = fingerprints[pending]
+            _, pending = self.place_many(alt_indexes, fingerprints)
+            alt_indexes, fingerprints = alt_indexes[pending], fingerprints[pending]
+            # the rounds only get the keys that fit below the load factor,
+            # where relocations succeed, the others go to kick
+            room = int(self.LOAD_FACTORS[self.bucket_size] * self.size) - self.count - (len(chunk) - len(fingerprints))
+            room = min(max(room, 0), len(fingerprints))
+            if room and self.kick_many(alt_indexes[:room], fingerprints[:room]):
+                alt_indexes, fingerprints = alt_indexes[room:], fingerprints[room:]
+            self.count += len(chunk) - len(fingerprints)
+            added += len(chunk) - len(fingerprints)
+            for index, fingerprint in zip(alt_indexes.tolist(), fingerprints.tolist()):
+                if self.victim is not None:
+                    break
+                self.kick(index, fingerprint)
+                self.count += 1
+                added += 1
+        return added
+
+    def kick_many(self, indexes, fingerprints):
+        '''
+        Relocate fingerprints whose two buckets are full, in rounds: every
+        fingerprint takes a random slot of its bucket (one per slot and round)
+        and the fingerprint it evicts moves to its other bucket, as kick does
+        one fingerprint at a time
+        Returns False, with the buckets restored, if fingerprints are still
+        pending after MAX_KICKS rounds, so no fingerprint already in the
+        filter is lost when it is full
+        '''
+        # (slots, previous fingerprints) of every write, undone in reverse
+        writes = []
+        for _ in range(self.MAX_KICKS):
+            slots = indexes * self.bucket_size + np.random.randint(self.bucket_size, size=len(indexes))
+            slots, first = np.unique(slots, return_index=True)
+            evicted = self.read_slots(slots)
+            self.write_slots(slots, fingerprints[first])
+            writes.append((slots, evicted))
+            waiting = np.ones(len(indexes), dtype=bool)
+            waiting[first] = False
+            indexes = np.concatenate([indexes[waiting], self.alt_index_many(indexes[first], evicted)])
+            fingerprints = np.concatenate([fingerprints[waiting], evicted])
+            placed, pending = self.place_many(indexes, fingerprints)
+            writes.append((placed, np.zeros(len(placed), dtype=np.uint64)))
+            indexes, fingerprints = indexes[pending], fingerprints[pending]
+            if not len(indexes):
+                return True
+        for slots, previous in reversed(writes):
+            self.write_slots(slots, previous)
+        return False
+
+    def place_many(self, indexes, fingerprints):
+        '''
+        Put every fingerprint in the next empty slot of its bucket
+        Returns the slots written and a boolean array of the fingerprints
+        that did not fit
+        '''
+        order = np.argsort(indexes, kind="stable")
+        sorted_indexes = indexes[order]
+        # rank of every fingerprint among the ones going to the same bucket
+        first = np.searchsorted(sorted_indexes, sorted_indexes, side="left")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order)) - first
+        slots = np.count_nonzero(self.read_buckets(indexes), axis=1) + rank
+        fits = slots < self.bucket_size
+        slots = indexes[fits] * self.bucket_size + slots[fits]
+        self.write_slots(slots, fingerprints[fits])
+        return slots, ~fits
+
+    def read_buckets(self, indexes):
+        '''
+        Return the fingerprints of the buckets at indexes as a (len(indexes),
+        bucket_size) uint64 array
+        '''
+        return self.read_slots(indexes[:, None] * self.bucket_size + np.arange(self.bucket_size))
+
+    def read_slots(self, slots):
+        bits = np.uint64(self.fingerprint_bits)
+        positions = np.asarray(slots).astype(np.uint64) * bits
+        words = self.words[(positions >> np.uint64(3)).astype(np.int64)]
+        return (words >> (np.uint64(64) - bits - (positions & np.uint64(7)))) & np.uint64(self.fingerprint_mask)
+
+    def write_slots(self, slots, fingerprints):
+        '''
+        Overwrite distinct slots, slots of a batch may share bytes so the 5
+        bytes of every slot are cleared and ORed in with ufunc.at
+        '''
+        check_writeable(self.bytes)
+        positions = slots.astype(np.uint64) * np.uint64(self.fingerprint_bits)
+        shifts = np.uint64(40 - self.fingerprint_bits) - (positions & np.uint64(7))
+        masks = np.uint64(self.fingerprint_mask) << shifts
+        values = fingerprints.astype(np.uint64) << shifts
+        starts = (positions >> np.uint64(3)).astype(np.int64)
+        for i in range(5):
+            shift = np.uint64(32 - 8 * i)
+            np.bitwise_and.at(self.bytes, starts + i, ~((masks >> shift) & np.uint64(0xFF)).astype(np.uint8))
+            np.bitwise_or.at(self.bytes, starts + i, ((values >> shift) & np.uint64(0xFF)).astype(np.uint8))
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        results = []
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            indexes, fingerprints = self.locate_many(chunk)
+            alt_indexes = self.alt_index_many(indexes, fingerprints)
+            found = ((self.read_buckets(indexes) == fingerprints[:, None]).any(axis=1) |
+                     (self.read_buckets(alt_indexes) == fingerprints[:, None]).any(axis=1))
+            if self.victim is not None:
+                found |= ((fingerprints == self.victim[1]) &
+                          ((indexes == self.victim[0]) | (alt_indexes == self.victim[0])))
+            results.append(found)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def locate_many(self, items):
+        '''
+        Return the first buckets and the fingerprints of the items as numpy arrays
+        '''
+        values = self.hash_strategy.indexes_many(self.hash_strategy.digest_many(items, 2), 2, self.HASH_RANGE)
+        values = values.astype(np.uint64)
+        fingerprints = values[:, 1] & np.uint64(self.fingerprint_mask)
+        fingerprints[fingerprints == 0] = 1
+        indexes = (values[:, 0] * np.uint64(self.bucket_count)) >> np.uint64(32)
+        return indexes.astype(np.int64), fingerprints
+
+    def alt_index_many(self, indexes, fingerprints):
+        hashes = (fingerprints * np.uint64(self.FINGERPRINT_MULTIPLIER)) >> np.uint64(32)
+        offsets = ((hashes * np.uint64(self.bucket_count)) >> np.uint64(32)).astype(np.int64)
+        return (offsets - indexes) % self.bucket_count
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+
+        new_filter = CuckooFilter(self.item_low_count, self.fp_prob, hash_strategy=self.hash_strategy,
+                                  bucket_size=self.bucket_size, fingerprint_bits=self.fingerprint_bits)
+        new_filter.buffer[:] = self.buffer
+        new_filter.victim = self.victim
+        new_filter.count = self.count
+        return new_filter
+
+    def get_bitarray_size(self):
+        return len(self.buffer)
+
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the fingerprint buffer
+        '''
+        return len(self.buffer)
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py)
+        '''
+        return memory_usage.build_report(
+            self.nbytes, memory_usage.get_metadata_size(self, ("buffer", "words", "bytes")), self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the buckets are a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.bucket_size,
+                  "count_size": self.fingerprint_bits, "item_low_count": self.item_low_count, "count": self.count,
+                  "fp_prob": self.fp_prob, "hash_strategy": self.hash_strategy.name}
+        return fields, {"victim": self.victim, "layout": self.LAYOUT}, self.buffer, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        if metadata.get("layout") != cls.LAYOUT:
+            raise ValueError("Filter was saved with an older bucket layout, rebuild it")
+        new_filter = cls.__new__(cls)
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.bucket_size = fields["slice_size"]
+        new_filter.fingerprint_bits = fields["count_size"]
+        new_filter.size = fields["size"]
+        new_filter.bucket_count = new_filter.size // new_filter.bucket_size
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.set_buffer(payload)
+        new_filter.victim = tuple(metadata["victim"]) if metadata["victim"] else None
+        new_filter.count = fields["count"]
+        return new_filter
+
+    @classmethod
+    def get_fingerprint_bits(self, p, bucket_size=BUCKET_SIZE):
+        '''
+        Return the fingerprint bits(f) for a false positive probability p
+        f = lg(2 * b / p)
+        a lookup compares the fingerprint with the 2 * b slots of two buckets
+        '''
+        return min(max(math.ceil(math.log2(2 * bucket_size / p)), 1), 32)
+
+    @classmethod
+    def get_bucket_count(self, n, bucket_size=BUCKET_SIZE):
+        '''
+        Return the number of buckets for n items at the load factor of the
+        bucket size
+        '''
+        return max(math.ceil(n / (bucket_size * self.LOAD_FACTORS[bucket_size])), 1)
+
+    @classmethod
+    def get_size(self, n, p):
+        """
+        Return the size of the fingerprint buffer in bits, for the default bucket size
+        n : int
+            number of items expected to be stored in filter
+        p : float
+            False Positive probability in decimal
+        """
+        return self.get_bucket_count(n) * self.BUCKET_SIZE * self.get_fingerprint_bits(p)
+
+    @classmethod
+    def get_hash_count(self, m, n):
+        '''
+        Return the number of buckets read by a lookup, always 2
+        '''
+        return 2
@@ -0,0 +1,147 @@
+import math
+import numpy as np
+
+"""
+Live statistics of the bit array filters (see stats() of BloomFilter,
+ShiftingBloomFilterM, CountingBloomFilter and ScalableBloomFilter).
+"""
+
+
+class FillStats(object):
+    """
+    Cached number of set positions (bits, or non zero counters) of a filter
+    -The array is split in slices (the slices of the filter) and every slice
+    in blocks of BLOCK_SIZE positions, the set positions of every block are
+    cached
+    -Mutations mark the blocks they touch as dirty, a refresh recounts only
+    the dirty blocks with the popcount of the filter, so polling an unchanged
+    filter is O(1) and after an update only the touched blocks are counted
+    """
+    BLOCK_BITS = 16
+    BLOCK_SIZE = 1 << BLOCK_BITS
+    # positions per block
+
+    def __init__(self, slice_size, slice_count):
+        """
+        slice_size : int
+            Positions per slice
+        slice_count : int
+            Number of slices
+        """
+        self.slice_size = slice_size
+        self.slice_count = slice_count
+        self.blocks_per_slice = max(-(-slice_size // self.BLOCK_SIZE), 1)
+        block_count = slice_count * self.blocks_per_slice
+        self.block_counts = np.zeros(block_count, dtype=np.int64)
+        # 1 for a block to recount, every block is counted on the first refresh
+        self.dirty = bytearray(b"\x01" * block_count)
+        self.dirty_view = np.frombuffer(self.dirty, dtype=np.uint8)
+        self.cache = None
+
+    def mark(self, position):
+        '''
+        Mark the block of a position as dirty
+        '''
+        slice_index, offset = divmod(position, self.slice_size)
+        self.dirty[slice_index * self.blocks_per_slice + (offset >> self.BLOCK_BITS)] = 1
+
+    def mark_many(self, positions):
+        '''
+        Mark the blocks of a numpy array of positions as dirty
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        slices = positions // self.slice_size
+        self.dirty_view[slices * self.blocks_per_slice + ((positions - slices * self.slice_size) >> self.BLOCK_BITS)] = 1
+
+    def invalidate(self):
+        '''
+        Mark every block as dirty, after a change of the whole array
+        '''
+        self.dirty_view[:] = 1
+
+    def slice_counts(self, count_range):
+        '''
+        Return the number of set positions of every slice as a numpy array,
+        count_range(start, stop) counts the set positions of [start, stop)
+        '''
+        for block in np.flatnonzero(self.dirty_view).tolist():
+            slice_index, block_offset = divmod(block, self.blocks_per_slice)
+            start = slice_index * self.slice_size + block_offset * self.BLOCK_SIZE
+            stop = slice_index * self.slice_size + min((block_offset + 1) * self.BLOCK_SIZE, self.slice_size)
+            # cleared before the count, writers mark after writing, so a
+            # concurrent write is either counted or leaves the block dirty
+            self.dirty[block] = 0
+            self.block_counts[block] = count_range(start, stop)
+        return self.block_counts.reshape(self.slice_count, self.blocks_per_slice).sum(axis=1)
+
+    def stats(self, count_range, bits_per_item, count):
+        '''
+        Return the statistics of the filter as a dict, cached until a block
+        is marked dirty
+        bits_per_item : int
+            Positions set by one item (hash_count, or 2 * hash_count for the
+            shifting filter), a lookup tests as many positions
+        count : int
+            Number of adds counted by the filter
+        '''
+        if self.cache is not None and 1 not in self.dirty:
+            self.cache["count"] = count
+            return dict(self.cache, slice_fill=list(self.cache["slice_fill"]))
+        set_counts = self.slice_counts(count_range)
+        size = self.slice_size * self.slice_count
+        fill_ratio = int(set_counts.sum()) / size
+        slice_fill = set_counts / self.slice_size
+        self.cache = {
+            "count": count,
+            "size": size,
+            "set_positions": int(set_counts.sum()),
+            "fill_ratio": fill_ratio,
+            "estimated_items": self.estimate_items(fill_ratio, size, bits_per_item),
+            # a lookup of an absent item tests bits_per_item positions, one
+            # per slice when the slices are the hash functions
+            "fp_prob": self.fp_prob(slice_fill, bits_per_item),
+            "slice_fill": slice_fill.tolist(),
+            # 1 when every slice is equally full
+            "slice_imbalance": float(slice_fill.max() / slice_fill.mean()) if fill_ratio else 1.0,
+        }
+        return dict(self.cache, slice_fill=list(self.cache["slice_fill"]))
+
+    @classmethod
+    def estimate_items(self, fill_ratio, size, bits_per_item):
+        '''
+        Return the number of distinct items(n) that set a fill ratio X/m of
+        a filter, Swamidass and Baldi estimate
+        n = -(m / k) * ln(1 - X / m)
+        '''
+        if fill_ratio >= 1:
+            return math.inf
+        return -(size / bits_per_item) * math.log(1 - fill_ratio)
+
+    def fp_prob(self, slice_fill, bits_per_item):
+        if self.slice_count == bits_per_item:
+            return float(np.prod(slice_fill))
+        return float(slice_fill.mean() ** bits_per_item)
+
+
+def estimate_overlap(size, bits_per_item, set_counts, other_set_counts, and_counts):
+    '''
+    Estimate the union and intersection sizes of pairs of filters of the same
+    shape from numpy arrays of their set bits and of the set bits of their AND
+    Returns (union_sizes, intersection_sizes) as float numpy arrays
+    -the OR has X1 + X2 - X_and set bits, its Swamidass and Baldi estimate is
+    the union size
+    -the intersection is estimated from the AND (Papapetrou et al.), the
+    bits set by both sets beyond the X1 * X2 / m expected by chance
+    n_and = -(m / k) * ln(1 - (X_and * m - X1 * X2) / (m * (m - X_or)))
+    '''
+    set_counts = np.asarray(set_counts, dtype=np.float64)
+    other_set_counts = np.asarray(other_set_counts, dtype=np.float64)
+    and_counts = np.asarray(and_counts, dtype=np.float64)
+    unset_counts = size - (set_counts + other_set_counts - and_counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        union_sizes = -(size / bits_per_item) * np.log(unset_counts / size)
+        shared = (and_counts * size - set_counts * other_set_counts) / (size * unset_counts)
+        intersection_sizes = -(size / bits_per_item) * np.log1p(-np.maximum(shared, 0))
+    # a saturated OR gives no information, both estimates are infinite
+    intersection_sizes[unset_counts <= 0] = np.inf
+    return union_sizes, np.minimum(intersection_sizes, union_sizes)
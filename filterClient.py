@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import json
+import struct
+import numpy as np
+
+from filterServer import (ERRORS, KEYS_BYTES, KEYS_INT, MAX_BATCH, OP_ADD, OP_CONTAINS, OP_DELETE, OP_INFO,
+                          REQUEST, RESPONSE, STATUS_OK)
+from hashing import INT_TYPES, int_keys
+
+"""
+Async client of the membership service (filterServer.py).
+
+    async with FilterClient(path="/tmp/filters.sock") as client:
+        await client.add_many("users", ["alice", "bob"])
+        await client.contains("users", "alice")              # True
+        await client.contains_many("users", user_ids)        # numpy bool array
+
+The client keeps a pool of connections and sends requests round robin over
+them without waiting for the previous responses (pipelining), so any number
+of tasks can share one client. Keys are str, bytes or integers as for the
+filters; a numpy integer array or a list of ints is sent as 64 bit keys, a
+list mixing integers with str or bytes raises ValueError.
+"""
+
+POOL_SIZE = 4
+# connections of a client
+
+
+class FilterConnection(asyncio.Protocol):
+    """
+    One connection and its in-flight requests
+    -Responses are parsed in data_received and resolve the future of their
+    request id
+    -If the connection is lost every in-flight request fails with
+    ConnectionError
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.buffer = bytearray()
+        self.pending = {}
+        self.request_ids = itertools.count()
+        # requests of the current event loop iteration, sent in one write
+        self.outgoing = []
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def request(self, opcode, name, encoding=KEYS_BYTES, count=0, body=b""):
+        '''
+        Send a request, returns a future of (count, body)
+        '''
+        if self.transport is None or self.transport.is_closing():
+            raise ConnectionError("Connection closed")
+        request_id = next(self.request_ids) & 0xFFFFFFFF
+        future = self.closed.get_loop().create_future()
+        self.pending[request_id] = future
+        if not self.outgoing:
+            future.get_loop().call_soon(self.send)
+        self.outgoing.append(REQUEST.pack(len(name) + len(body), request_id, opcode, encoding, len(name), count))
+        self.outgoing.append(name)
+        self.outgoing.append(body)
+        return future
+
+    def send(self):
+        outgoing, self.outgoing = self.outgoing, []
+        if not self.transport.is_closing():
+            self.transport.write(b"".join(outgoing))
+
+    def data_received(self, data):
+        self.buffer += data
+        offset = 0
+        while len(self.buffer) - offset >= RESPONSE.size:
+            body_length, request_id, status, count = RESPONSE.unpack_from(self.buffer, offset)
+            end = offset + RESPONSE.size + body_length
+            if len(self.buffer) < end:
+                break
+            body = bytes(self.buffer[offset + RESPONSE.size:end])
+            offset = end
+            future = self.pending.pop(request_id, None)
+            if future is None or future.done():
+                continue
+            if status == STATUS_OK:
+                future.set_result((count, body))
+            else:
+                future.set_exception(ERRORS.get(status, RuntimeError)(body.decode()))
+        del self.buffer[:offset]
+
+    def connection_lost(self, exc):
+        error = ConnectionError("Connection lost: " + str(exc) if exc else "Connection closed")
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+        self.closed.set_result(None)
+
+    async def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            await self.closed
+
+
+class FilterClient(object):
+    """
+    Client of a FilterServer, on a Unix socket path or host:port
+    -Batches of more than MAX_BATCH keys are split in several requests
+    -Server errors are raised as ValueError (unknown filter, bad request),
+    TypeError (operation not supported by the filter) or RuntimeError
+    """
+
+    def __init__(self, path=None, host="127.0.0.1", port=None, pool_size=POOL_SIZE):
+        """
+        path : str
+            Unix socket of the server, or None for TCP
+        host, port :
+            TCP address of the server
+        pool_size : int
+            Number of connections
+        """
+        if path is None and port is None:
+            raise ValueError("path or port is required")
+        self.path = path
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.connections = []
+        self.next_connection = itertools.cycle(range(pool_size))
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        for _ in range(self.pool_size):
+            if self.path is not None:
+                _, connection = await loop.create_unix_connection(FilterConnection, self.path)
+            else:
+                _, connection = await loop.create_connection(FilterConnection, self.host, self.port)
+            self.connections.append(connection)
+        return self
+
+    async def close(self):
+        connections, self.connections = self.connections, []
+        await asyncio.gather(*(connection.close() for connection in connections))
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def request(self, opcode, name, encoding=KEYS_BYTES, count=0, body=b""):
+        if not self.connections:
+            raise ConnectionError("Client is not connected")
+        connection = self.connections[next(self.next_connection)]
+        return connection.request(opcode, name.encode(), encoding, count, body)
+
+    async def batch_request(self, opcode, name, keys):
+        '''
+        Send the keys in requests of at most MAX_BATCH keys, pipelined,
+        returns the list of (count, body) of the requests
+        '''
+        if len(keys) <= MAX_BATCH:
+            return [await self.request(opcode, name, *encode_keys(keys))]
+        return await asyncio.gather(*(self.request(opcode, name, *encode_keys(keys[start:start + MAX_BATCH]))
+                                      for start in range(0, len(keys), MAX_BATCH)))
+
+    async def contains(self, name, key):
+        return bool((await self.contains_many(name, [key]))[0])
+
+    async def contains_many(self, name, keys):
+        '''
+        Check for existence of every key, returns a boolean numpy array
+        '''
+        return unpack_results(await self.batch_request(OP_CONTAINS, name, keys))
+
+    async def add(self, name, key):
+        return await self.add_many(name, [key]) == 1
+
+    async def add_many(self, name, keys):
+        '''
+        Add every key, returns the number of keys added
+        '''
+        return sum(count for count, _ in await self.batch_request(OP_ADD, name, keys))
+
+    async def delete(self, name, key):
+        return bool((await self.delete_many(name, [key]))[0])
+
+    async def delete_many(self, name, keys):
+        '''
+        Delete every key, returns a boolean numpy array of the deleted keys
+        '''
+        return unpack_results(await self.batch_request(OP_DELETE, name, keys))
+
+    async def info(self, name):
+        '''
+        Return the class, item count, size and batching counters of a filter
+        '''
+        _, body = await self.request(OP_INFO, name)
+        return json.loads(body)
+
+
+def encode_keys(keys):
+    '''
+    Return (encoding, count, body) of the keys of a request
+    '''
+    integers = int_keys(keys)
+    if integers is not None:
+        return KEYS_INT, len(integers), integers.astype("<u8").tobytes()
+    if any(isinstance(key, INT_TYPES) for key in keys):
+        # an integer is hashed as a 64 bit key, not as its decimal string
+        raise ValueError("Keys mix integers with str or bytes, send them in separate calls")
+    encoded = [key.encode() if isinstance(key, str) else key for key in keys]
+    return KEYS_BYTES, len(encoded), struct.pack("<" + str(len(encoded)) + "I", *map(len, encoded)) + b"".join(encoded)
+
+
+def unpack_results(responses):
+    results = [np.unpackbits(np.frombuffer(body, dtype=np.uint8), count=count, bitorder="little").astype(bool)
+               for count, body in responses]
+    if not results:
+        return np.zeros(0, dtype=bool)
+    return np.concatenate(results)
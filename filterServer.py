@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+from serialization import load_filter
+
+"""
+Membership service: an asyncio server hosting named filters on a Unix or
+TCP socket, so services share one filter instead of embedding their own.
+
+    python filterServer.py --unix /tmp/filters.sock users=users.bf orders=orders.bf
+    python filterServer.py --host 127.0.0.1 --port 7700 users=users.bf
+
+Any filter serialization.py can save can be hosted (see filterClient.py for
+the client). Requests of all the connections for the same filter and
+operation that arrive within `window` seconds are coalesced into one
+contains_many / add_many call, so a burst of single key lookups or inserts
+costs one vectorized call instead of one per request. Batches run on the event loop
+thread one at a time, in arrival order, so the filters need no locking.
+
+Protocol, every integer little endian:
+    request:  body length u32, request id u32, opcode u8, key encoding u8,
+              name length u16, key count u32, then the body:
+              filter name (UTF-8), then the keys
+              KEYS_BYTES: key count u32 lengths, then the concatenated keys
+              KEYS_INT: key count uint64 keys (ints hashed natively)
+    response: body length u32, request id u32, status u8, count u32, then
+              the body
+              OP_CONTAINS, OP_DELETE: one bit per key (np.packbits, little)
+              OP_ADD: no body, count is the number of keys of the request
+              that were not in the filter and are after the batch (a key
+              repeated in a batch counts once)
+              OP_INFO: JSON description of the filter
+              an error status carries the error message
+A client can send requests without waiting for the responses (pipelining),
+responses carry the request id and may come back in any order.
+"""
+
+REQUEST = struct.Struct("<IIBBHI")
+RESPONSE = struct.Struct("<IIBI")
+
+OP_CONTAINS = 1
+OP_ADD = 2
+OP_DELETE = 3
+OP_INFO = 4
+
+KEYS_BYTES = 0
+KEYS_INT = 1
+
+STATUS_OK = 0
+STATUS_VALUE_ERROR = 1
+STATUS_TYPE_ERROR = 2
+STATUS_ERROR = 3
+# status -> exception raised by the client
+ERRORS = {STATUS_VALUE_ERROR: ValueError, STATUS_TYPE_ERROR: TypeError, STATUS_ERROR: RuntimeError}
+
+MAX_BODY = 1 << 28
+# bytes, a connection sending a larger request is closed
+WINDOW = 50e-6
+# seconds a request waits for others to join its batch
+MAX_BATCH = 65536
+# keys, a batch reaching it runs without waiting for the window
+TIMER_RESOLUTION = 1e-3
+# seconds, the selector can not wait less, shorter windows are polled
+
+
+class FilterService(object):
+    """
+    A named filter and its pending batch
+    -The batch holds consecutive requests of the same operation and key
+    encoding, a request of another kind runs the batch first, so requests
+    are applied in arrival order
+    -The batch runs window seconds after its first request or once it holds
+    MAX_BATCH keys
+    """
+
+    def __init__(self, name, bloom_filter, window=WINDOW):
+        self.name = name
+        self.filter = bloom_filter
+        self.window = window
+        self.pending = []
+        # (opcode, encoding) of the pending requests
+        self.pending_kind = None
+        self.pending_keys = 0
+        self.timer = None
+        self.deadline = 0
+        self.requests = 0
+        self.batches = 0
+        self.keys = 0
+
+    def submit(self, transport, request_id, opcode, encoding, keys):
+        '''
+        Queue a request, its response is written to transport when its batch runs
+        '''
+        if self.pending and self.pending_kind != (opcode, encoding):
+            self.flush()
+        self.pending.append((transport, request_id, keys))
+        self.pending_kind = (opcode, encoding)
+        self.pending_keys += len(keys)
+        if self.pending_keys >= MAX_BATCH:
+            self.flush()
+        elif self.timer is None:
+            loop = asyncio.get_running_loop()
+            if self.window >= TIMER_RESOLUTION:
+                self.timer = loop.call_later(self.window, self.flush)
+            else:
+                self.deadline = loop.time() + self.window
+                self.timer = loop.call_soon(self.poll)
+
+    def poll(self):
+        '''
+        Run the batch once the window is over, else check again on the next
+        event loop iteration (the sockets are polled in between, so requests
+        keep joining the batch). Only used for windows under
+        TIMER_RESOLUTION, call_later can not wait less.
+        '''
+        self.timer = None
+        loop = asyncio.get_running_loop()
+        if loop.time() >= self.deadline:
+            self.flush()
+        else:
+            self.timer = loop.call_soon(self.poll)
+
+    def flush(self):
+        '''
+        Run the pending requests as one batch and write their responses
+        '''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        requests, self.pending, self.pending_keys = self.pending, [], 0
+        if not requests:
+            return
+        opcode, encoding = self.pending_kind
+        if encoding == KEYS_INT:
+            keys = np.concatenate([request_keys for _, _, request_keys in requests])
+        else:
+            keys = [key for _, _, request_keys in requests for key in request_keys]
+        self.requests += len(requests)
+        self.batches += 1
+        self.keys += len(keys)
+        try:
+            results = self.execute(opcode, keys)
+        except Exception as error:
+            for transport, request_id, _ in requests:
+                write_error(transport, request_id, error)
+            return
+        # one write per connection for the whole batch
+        responses = {}
+        start = 0
+        for transport, request_id, request_keys in requests:
+            stop = start + len(request_keys)
+            if opcode == OP_ADD:
+                response = RESPONSE.pack(0, request_id, STATUS_OK, int(np.count_nonzero(results[start:stop])))
+            else:
+                body = np.packbits(results[start:stop], bitorder="little").tobytes()
+                response = RESPONSE.pack(len(body), request_id, STATUS_OK, len(request_keys)) + body
+            responses.setdefault(transport, []).append(response)
+            start = stop
+        for transport, transport_responses in responses.items():
+            if not transport.is_closing():
+                transport.write(b"".join(transport_responses))
+
+    def execute(self, opcode, keys):
+        '''
+        Apply an operation to a batch of keys, returns a boolean numpy array
+        of the keys found, added or deleted
+        '''
+        if opcode == OP_CONTAINS:
+            if hasattr(self.filter, "contains_many"):
+                return np.asarray(self.filter.contains_many(keys), dtype=bool)
+            return np.fromiter((key in self.filter for key in keys), dtype=bool, count=len(keys))
+        if opcode == OP_ADD:
+            # add_many only returns a total, and filters differ on what they
+            # count (keys already present, keys refused by a full filter), so
+            # a key is added if a lookup misses it before and finds it after
+            absent = ~self.execute(OP_CONTAINS, keys)
+            if hasattr(self.filter, "add_many"):
+                self.filter.add_many(keys)
+            else:
+                for key in keys:
+                    self.filter.add(key)
+            return absent & self.execute(OP_CONTAINS, keys) & first_occurrences(keys)
+        if opcode == OP_DELETE:
+            if not hasattr(self.filter, "delete"):
+                raise TypeError(type(self.filter).__name__ + " does not support delete")
+            return np.fromiter((bool(self.filter.delete(key)) for key in keys), dtype=bool, count=len(keys))
+        raise ValueError("Unknown opcode: " + str(opcode))
+
+    def info(self):
+        return {"name": self.name, "class": type(self.filter).__name__, "items": len(self.filter),
+                "nbytes": self.filter.nbytes, "requests": self.requests, "batches": self.batches,
+                "keys": self.keys}
+
+
+class FilterServer(object):
+    """
+    Serves named filters over Unix and / or TCP sockets
+    -filters maps a name to a filter, clients refer to filters by name
+    -window is the coalescing delay in seconds, 0 only coalesces the
+    requests read in the same event loop iteration
+    """
+
+    def __init__(self, filters, window=WINDOW):
+        """
+        filters : dict
+            Name -> filter
+        window : float
+            Seconds a request waits for others to join its batch
+        """
+        self.services = {name: FilterService(name, bloom_filter, window) for name, bloom_filter in filters.items()}
+        self.servers = []
+
+    async def start_unix(self, path):
+        loop = asyncio.get_running_loop()
+        self.servers.append(await loop.create_unix_server(lambda: FilterProtocol(self), path))
+
+    async def start_tcp(self, host="127.0.0.1", port=0):
+        '''
+        Listen on host:port (port 0 picks a free port), returns the port
+        '''
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: FilterProtocol(self), host, port)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    def close(self):
+        for service in self.services.values():
+            service.flush()
+        for server in self.servers:
+            server.close()
+
+    def handle_request(self, transport, request_id, opcode, encoding, name_length, count, body):
+        try:
+            name = body[:name_length].decode()
+            if name not in self.services:
+                raise ValueError("Unknown filter: " + name)
+            service = self.services[name]
+            if opcode == OP_INFO:
+                write_response(transport, request_id, STATUS_OK, 0, json.dumps(service.info()).encode())
+                return
+            keys = decode_keys(body, name_length, encoding, count)
+        except Exception as error:
+            write_error(transport, request_id, error)
+            return
+        service.submit(transport, request_id, opcode, encoding, keys)
+
+
+class FilterProtocol(asyncio.Protocol):
+    """
+    A server connection, requests are parsed from the received bytes in
+    data_received without a task per connection or an await per request
+    -Reading pauses while the responses are not read by the client
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        offset = 0
+        while len(self.buffer) - offset >= REQUEST.size:
+            body_length, request_id, opcode, encoding, name_length, count = REQUEST.unpack_from(self.buffer, offset)
+            if body_length > MAX_BODY:
+                self.transport.close()
+                return
+            end = offset + REQUEST.size + body_length
+            if len(self.buffer) < end:
+                break
+            body = bytes(self.buffer[offset + REQUEST.size:end])
+            self.server.handle_request(self.transport, request_id, opcode, encoding, name_length, count, body)
+            offset = end
+        del self.buffer[:offset]
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+
+def decode_keys(body, offset, encoding, count):
+    '''
+    Return the keys of a request body, a uint64 numpy array or a list of bytes
+    '''
+    if encoding == KEYS_INT:
+        return np.frombuffer(body, dtype="<u8", count=count, offset=offset)
+    if encoding != KEYS_BYTES:
+        raise ValueError("Unknown key encoding: " + str(encoding))
+    # struct and slicing, numpy costs more for the few keys of most requests
+    start = offset + 4 * count
+    keys = []
+    for length in struct.unpack_from("<" + str(count) + "I", body, offset):
+        keys.append(body[start:start + length])
+        start += length
+    if start != len(body):
+        raise ValueError("Key lengths do not match the request size")
+    return keys
+
+
+def first_occurrences(keys):
+    '''
+    Return a boolean numpy array of the keys not seen earlier in the batch
+    '''
+    first = np.zeros(len(keys), dtype=bool)
+    if isinstance(keys, np.ndarray):
+        first[np.unique(keys, return_index=True)[1]] = True
+    else:
+        first_index = {}
+        for index, key in enumerate(keys):
+            first_index.setdefault(key, index)
+        first[list(first_index.values())] = True
+    return first
+
+
+def write_response(transport, request_id, status, count, body=b""):
+    if not transport.is_closing():
+        transport.write(RESPONSE.pack(len(body), request_id, status, count) + body)
+
+
+def write_error(transport, request_id, error):
+    if isinstance(error, ValueError):
+        status = STATUS_VALUE_ERROR
+    elif isinstance(error, TypeError):
+        status = STATUS_TYPE_ERROR
+    else:
+        status = STATUS_ERROR
+    write_response(transport, request_id, status, 0, str(error).encode())
+
+
+async def serve(filters, path=None, host=None, port=None, window=WINDOW):
+    '''
+    Serve filters on a Unix socket path and / or host:port until cancelled
+    '''
+    server = FilterServer(filters, window)
+    if path is not None:
+        await server.start_unix(path)
+    if port is not None:
+        await server.start_tcp(host or "127.0.0.1", port)
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve saved filters over a Unix or TCP socket")
+    parser.add_argument("filters", nargs="+", metavar="NAME=PATH", help="filters saved with save()")
+    parser.add_argument("--unix", help="Unix socket path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--window", type=float, default=WINDOW, help="coalescing window in seconds")
+    args = parser.parse_args(argv)
+    if args.unix is None and args.port is None:
+        parser.error("one of --unix or --port is required")
+    filters = {}
+    for spec in args.filters:
+        name, _, path = spec.partition("=")
+        # loaded in memory, mapped files are read-only
+        filters[name] = load_filter(path, mmap=False)
+    if args.unix is not None and os.path.exists(args.unix):
+        os.unlink(args.unix)
+    try:
+        asyncio.run(serve(filters, args.unix, args.host, args.port, args.window))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
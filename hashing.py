@@ -0,0 +1,174 @@
+import mmh3
+import numpy as np
+
+"""
+Hash strategies shared by the filters.
+
+A strategy turns an item into a digest once, and every filter derives its
+own indexes from that digest for its own hash_count and slice_size.
+
+Items are str (hashed as UTF-8, so "a" and b"a" are the same key), bytes
+or integers. Integers are hashed as 64 bit keys with splitmix64 instead of
+mmh3: a python int, a numpy integer and an element of a numpy integer
+array are the same key (negative values wrap like int64 to uint64), and a
+numpy integer array is hashed in bulk without per element python objects.
+An integer and its decimal string are different keys.
+
+The default strategy is "double". It places keys at other indexes than
+the original per seed mmh3 scheme, so a filter built with the default
+does not match one built by the original code, pass
+hash_strategy="seeded" to keep the original layout of str and bytes keys.
+"""
+
+
+class SeededHashing(object):
+    """
+    Original scheme: one mmh3.hash(item, i) call per seed i.
+    Kept as a compatibility mode, a lookup costs up to hash_count full hashes.
+    The digest is the item itself, hashes are computed lazily so a lookup
+    still stops hashing at the first unset bit.
+    """
+    name = "seeded"
+
+    def digest(self, item):
+        if isinstance(item, INT_TYPES):
+            return int(item) & MASK64
+        return item
+
+    def indexes(self, digest, hash_count, slice_size, start=0):
+        if isinstance(digest, int):
+            for i in range(start, hash_count):
+                yield self.int_hash(digest, i) % slice_size
+            return
+        for i in range(start, hash_count):
+            yield mmh3.hash(digest, i) % slice_size
+
+    def int_hash(self, key, seed):
+        # 63 bits so the numpy digests stay int64
+        return mix64((key + (seed + 1) * GOLDEN_GAMMA) & MASK64) >> 1
+
+    def digest_many(self, items, hash_count):
+        keys = int_keys(items)
+        if keys is not None:
+            seeds = np.arange(1, hash_count + 1, dtype=np.uint64) * np.uint64(GOLDEN_GAMMA)
+            return (mix64_many(keys[:, None] + seeds) >> np.uint64(1)).astype(np.int64)
+        seeds = range(hash_count)
+        try:
+            hashes = [mmh3.hash(item, i) for item in items for i in seeds]
+        except TypeError:
+            # integers mixed with other keys
+            hashes = [self.int_hash(digest, i) if isinstance(digest, int) else mmh3.hash(digest, i)
+                      for digest in map(self.digest, items) for i in seeds]
+        return np.array(hashes, dtype=np.int64).reshape(len(items), hash_count)
+
+    def indexes_many(self, digests, hash_count, slice_size, start=0):
+        return digests[:, start:hash_count] % slice_size
+
+
+class DoubleHashing(object):
+    """
+    Kirsch-Mitzenmacher double hashing: g_i(x) = h1(x) + i * h2(x)
+    h1 and h2 are the two 64 bit halves of one mmh3 128 bit hash,
+    so a lookup costs a single hash regardless of hash_count.
+    The index of slice i is (v ^ (v >> 32)) % slice_size for the 64 bit sum
+    v = h1 + i * h2: without the xorshift the sequence only depends on h1
+    and h2 modulo slice_size, it takes about slice_size^2 distinct values,
+    keys with the same sequence are false positives of each other, which
+    puts a floor of about n / slice_size^2 under the fp rate of a small slice.
+    """
+    name = "double"
+
+    def digest(self, item):
+        if isinstance(item, INT_TYPES):
+            # two outputs of a splitmix64 generator seeded with the key
+            key = int(item) & MASK64
+            return mix64((key + GOLDEN_GAMMA) & MASK64), mix64((key + 2 * GOLDEN_GAMMA) & MASK64)
+        return mmh3.hash64(item, signed=False)
+
+    def indexes(self, digest, hash_count, slice_size, start=0):
+        h2 = digest[1]
+        index = (digest[0] + start * h2) & MASK64
+        for _ in range(start, hash_count):
+            yield (index ^ (index >> 32)) % slice_size
+            index = (index + h2) & MASK64
+
+    def digest_many(self, items, hash_count=None):
+        keys = int_keys(items)
+        if keys is not None:
+            digests = np.empty((len(keys), 2), dtype=np.uint64)
+            digests[:, 0] = mix64_many(keys + np.uint64(GOLDEN_GAMMA))
+            digests[:, 1] = mix64_many(keys + np.uint64(2 * GOLDEN_GAMMA & MASK64))
+            return digests
+        try:
+            # hash_bytes returns the same 128 bits as hash64 as little endian bytes
+            return np.frombuffer(b"".join([mmh3.hash_bytes(item) for item in items]),
+                                 dtype="<u8").reshape(len(items), 2)
+        except TypeError:
+            # integers mixed with other keys
+            return np.array([self.digest(item) for item in items], dtype=np.uint64).reshape(len(items), 2)
+
+    def indexes_many(self, digests, hash_count, slice_size, start=0):
+        seeds = np.arange(start, hash_count, dtype=np.uint64)
+        # uint64 arithmetic wraps like the masks of indexes
+        indexes = digests[:, :1] + seeds * digests[:, 1:2]
+        return ((indexes ^ (indexes >> np.uint64(32))) % np.uint64(slice_size)).astype(np.int64)
+
+
+MASK64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+# increment of the splitmix64 generator
+INT_TYPES = (int, np.integer)
+
+
+def int_keys(items):
+    '''
+    Return integer keys as a uint64 numpy array, or None if items are not
+    a numpy integer array or a list of integers
+    '''
+    if isinstance(items, np.ndarray):
+        return items.astype(np.uint64) if items.dtype.kind in "iu" else None
+    if len(items) and isinstance(items[0], INT_TYPES):
+        keys = np.asarray(items)
+        if keys.dtype.kind in "iu":
+            return keys.astype(np.uint64)
+    return None
+
+
+def mix64(value):
+    '''
+    splitmix64 finalizer, a bijective mixer of 64 bit integers
+    '''
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def mix64_many(values):
+    '''
+    mix64 of a numpy array, uint64 arithmetic wraps like the masks of mix64
+    '''
+    values = np.asarray(values).astype(np.uint64)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+HASH_STRATEGIES = {
+    SeededHashing.name: SeededHashing,
+    DoubleHashing.name: DoubleHashing,
+}
+
+DEFAULT_HASH_STRATEGY = DoubleHashing.name
+
+
+def get_hash_strategy(strategy=None):
+    '''
+    Return a strategy instance from an instance, a strategy name or None (default)
+    '''
+    if strategy is None:
+        strategy = DEFAULT_HASH_STRATEGY
+    if isinstance(strategy, str):
+        if strategy not in HASH_STRATEGIES:
+            raise ValueError("Unknown hash strategy: " + strategy)
+        return HASH_STRATEGIES[strategy]()
+    return strategy
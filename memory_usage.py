@@ -1,6 +1,8 @@
 import gc
 import sys
 
+import numpy as np
+
 
 class memory_usage:
     def get_obj_size(obj):
@@ -26,3 +28,46 @@ class memory_usage:
             marked.update(new_refr.keys())
 
         return sz
+
+    # The functions below do not walk the object graph, they only look at the
+    # attributes of one object so they run in constant time on any filter size
+
+    def get_buffer_overhead(value):
+        '''
+        Return the size of a buffer object (bitarray, bytearray, numpy array)
+        without the data it holds
+        '''
+        size = sys.getsizeof(value)
+        if isinstance(value, np.ndarray):
+            return size - value.nbytes if value.flags.owndata else size
+        if isinstance(value, memoryview):
+            return size
+        try:
+            return max(size - memoryview(value).nbytes, 0)
+        except TypeError:
+            return size
+
+    def get_metadata_size(obj, payload_attributes=()):
+        '''
+        Return the size of obj, its __dict__ and its attribute values, the
+        attributes in payload_attributes are counted without their data
+        '''
+        size = sys.getsizeof(obj) + sys.getsizeof(obj.__dict__)
+        for name, value in vars(obj).items():
+            if name in payload_attributes:
+                size += memory_usage.get_buffer_overhead(value)
+            else:
+                size += sys.getsizeof(value)
+        return size
+
+    def build_report(payload_bytes, metadata_bytes, items):
+        '''
+        Return the memory report of a filter as a dict
+        '''
+        return {
+            "payload_bytes": payload_bytes,
+            "metadata_bytes": metadata_bytes,
+            "total_bytes": payload_bytes + metadata_bytes,
+            "items": items,
+            "bits_per_item": payload_bytes * 8 / items if items else None,
+        }
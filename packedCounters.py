@@ -0,0 +1,524 @@
+import math
+import numpy as np
+
+from bitOps import check_writeable
+from memory_usage import memory_usage
+
+"""
+Counter storage for CountingBloomFilter.
+Counters of count_size bits are packed in a contiguous buffer, several
+counters share a byte for count_size 1, 2 and 4 (most significant bits first,
+the same layout as a big endian bitarray), one counter per byte/word for
+count_size 8, 16 and 32.
+"""
+
+
+def saturating_add(counters, other, max_value):
+    '''
+    counters += other in place, saturating at max_value
+    '''
+    room = max_value - counters
+    np.minimum(room, other, out=room)
+    counters += room
+
+
+def minimum(counters, other, max_value):
+    '''
+    counters = min(counters, other) in place
+    '''
+    np.minimum(counters, other, out=counters)
+
+
+def clamped_subtract(counters, other, max_value):
+    '''
+    counters -= other in place, clamping at 0
+    '''
+    counters -= np.minimum(counters, other)
+
+
+class PackedCounterArray(object):
+    COUNT_SIZES = (1, 2, 4, 8, 16, 32)
+    WORD_TYPES = {8: ('B', np.uint8), 16: ('H', np.uint16), 32: ('I', np.uint32)}
+
+    def __init__(self, size, count_size, buffer=None):
+        """
+        size : int
+            Number of counters
+        count_size : int
+            Number of bits per counter, one of COUNT_SIZES
+        buffer : buffer object
+            Existing counter buffer to use in place (e.g. a memory mapped
+            file), a new zeroed bytearray is allocated if None
+        """
+        if count_size not in self.COUNT_SIZES:
+            raise ValueError("count_size must be one of " + str(self.COUNT_SIZES))
+        self.size = size
+        self.count_size = count_size
+        self.max_value = (1 << count_size) - 1
+        if buffer is None:
+            buffer = bytearray((size * count_size + 7) // 8)
+        self.buffer = buffer
+        self._set_views()
+
+    def _set_views(self):
+        if self.count_size < 8:
+            # counters per byte
+            self.per_byte = 8 // self.count_size
+            self.words = self.buffer
+            self.array = np.frombuffer(self.buffer, dtype=np.uint8)
+        else:
+            typecode, dtype = self.WORD_TYPES[self.count_size]
+            self.per_byte = 0
+            # memoryview gives fast scalar access, numpy is used for batches
+            self.words = memoryview(self.buffer).cast(typecode)
+            self.array = np.frombuffer(self.buffer, dtype=dtype)
+
+    @property
+    def nbytes(self):
+        return len(self.buffer)
+
+    @property
+    def metadata_nbytes(self):
+        '''
+        Size of this object and its views without the counters
+        '''
+        return memory_usage.get_metadata_size(self, ("buffer", "words", "array"))
+
+    def __len__(self):
+        return self.size
+
+    def copy(self):
+        new_array = PackedCounterArray.__new__(PackedCounterArray)
+        new_array.size = self.size
+        new_array.count_size = self.count_size
+        new_array.max_value = self.max_value
+        new_array.buffer = bytearray(self.buffer)
+        new_array._set_views()
+        return new_array
+
+    def _position(self, index):
+        # byte and shift of a sub byte counter
+        byte, slot = divmod(index, self.per_byte)
+        return byte, 8 - self.count_size - slot * self.count_size
+
+    def get(self, index):
+        if not self.per_byte:
+            return self.words[index]
+        byte, shift = self._position(index)
+        return (self.buffer[byte] >> shift) & self.max_value
+
+    def set(self, index, value):
+        value = min(max(value, 0), self.max_value)
+        if not self.per_byte:
+            self.words[index] = value
+            return
+        byte, shift = self._position(index)
+        self.buffer[byte] = (self.buffer[byte] & ~(self.max_value << shift) & 0xFF) | (value << shift)
+
+    def increment(self, index, value=1):
+        '''
+        Add value to the counter, saturating at max_value
+        Returns the new value of the counter
+        '''
+        if not self.per_byte:
+            new_value = self.words[index] + value
+            if new_value > self.max_value:
+                new_value = self.max_value
+            self.words[index] = new_value
+            return new_value
+        byte, shift = self._position(index)
+        current = (self.buffer[byte] >> shift) & self.max_value
+        new_value = current + value
+        if new_value > self.max_value:
+            new_value = self.max_value
+        # no carry leaves the counter since new_value <= max_value
+        self.buffer[byte] += (new_value - current) << shift
+        return new_value
+
+    def decrement(self, index, value=1):
+        '''
+        Subtract value from the counter, clamping at 0
+        Returns the new value of the counter
+        '''
+        if not self.per_byte:
+            new_value = self.words[index] - value
+            if new_value < 0:
+                new_value = 0
+            self.words[index] = new_value
+            return new_value
+        byte, shift = self._position(index)
+        current = (self.buffer[byte] >> shift) & self.max_value
+        new_value = current - value
+        if new_value < 0:
+            new_value = 0
+        self.buffer[byte] -= (current - new_value) << shift
+        return new_value
+
+    def get_many(self, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        if not self.per_byte:
+            return self.array[indexes].astype(np.int64)
+        bytes_, shifts = self._positions(indexes)
+        return ((self.array[bytes_] >> shifts) & self.max_value).astype(np.int64)
+
+    def set_many(self, indexes, values):
+        '''
+        Set counters at unique indexes to values (clamped to the counter range)
+        '''
+        check_writeable(self.array)
+        indexes = np.asarray(indexes, dtype=np.int64)
+        values = np.clip(values, 0, self.max_value)
+        if not self.per_byte:
+            self.array[indexes] = values
+            return
+        bytes_, shifts = self._positions(indexes)
+        old_values = (self.array[bytes_] >> shifts) & self.max_value
+        # xor.at is unbuffered so counters sharing a byte are all updated
+        np.bitwise_xor.at(self.array, bytes_, ((old_values ^ values) << shifts).astype(np.uint8))
+
+    def increment_many(self, indexes):
+        '''
+        Add 1 to the counter of every index (repeated indexes add repeatedly)
+        '''
+        indexes, counts = np.unique(np.asarray(indexes, dtype=np.int64).ravel(), return_counts=True)
+        self.set_many(indexes, self.get_many(indexes) + counts)
+
+    def decrement_many(self, indexes):
+        '''
+        Subtract 1 from the counter of every index (repeated indexes subtract repeatedly)
+        '''
+        indexes, counts = np.unique(np.asarray(indexes, dtype=np.int64).ravel(), return_counts=True)
+        self.set_many(indexes, self.get_many(indexes) - counts)
+
+    def combine(self, other, operation):
+        '''
+        Apply operation (saturating_add, minimum or clamped_subtract) with the
+        counters of other in place, other must have the same size and count_size
+        '''
+        if not self.per_byte:
+            operation(self.array, other.array, self.max_value)
+            return
+        # work on one counter of every byte at a time, values stay in uint8
+        result = np.zeros_like(self.array)
+        for shift in self._shifts():
+            lane = (self.array >> shift) & self.max_value
+            operation(lane, (other.array >> shift) & self.max_value, self.max_value)
+            result |= lane << shift
+        self.array[:] = result
+
+    def values(self):
+        '''
+        Return all counters as an int64 numpy array
+        '''
+        if not self.per_byte:
+            return self.array.astype(np.int64)
+        values = np.empty(len(self.array) * self.per_byte, dtype=np.int64)
+        for slot, shift in enumerate(self._shifts()):
+            values[slot::self.per_byte] = (self.array >> shift) & self.max_value
+        return values[:self.size]
+
+    def count_nonzero(self, start=0, stop=None):
+        '''
+        Return the number of non zero counters in [start, stop)
+        '''
+        stop = self.size if stop is None else stop
+        if not self.per_byte:
+            return int(np.count_nonzero(self.array[start:stop]))
+        first = start // self.per_byte
+        lanes = self.array[first:-(-stop // self.per_byte)]
+        nonzero = np.empty((len(lanes), self.per_byte), dtype=bool)
+        for slot, shift in enumerate(self._shifts()):
+            nonzero[:, slot] = (lanes >> shift) & self.max_value
+        first *= self.per_byte
+        return int(np.count_nonzero(nonzero.ravel()[start - first:stop - first]))
+
+    def assign(self, values):
+        '''
+        Set all counters from a numpy array of size values (clamped to the counter range)
+        '''
+        values = np.clip(values, 0, self.max_value)
+        if not self.per_byte:
+            self.array[:] = values
+            return
+        padded = np.zeros(len(self.array) * self.per_byte, dtype=np.uint8)
+        padded[:self.size] = values
+        result = np.zeros_like(self.array)
+        for slot, shift in enumerate(self._shifts()):
+            result |= padded[slot::self.per_byte] << shift
+        self.array[:] = result
+
+    def _shifts(self):
+        return [8 - self.count_size - slot * self.count_size for slot in range(self.per_byte)]
+
+    def _positions(self, indexes):
+        bytes_ = indexes // self.per_byte
+        shifts = (8 - self.count_size - (indexes % self.per_byte) * self.count_size).astype(np.uint8)
+        return bytes_, shifts
+
+
+class CompactCounterArray(object):
+    """
+    Variable width counters for T_CountingBloomFilter
+    -Every counter has 2 bits in a PackedCounterArray, values 0 to 2 are
+    stored there directly, the base value 3 marks a wide counter
+    -Wide counters live in a small open addressing table (linear probing)
+    of uint32 counter indexes and uint8 values (count - 3), 5 bytes a slot,
+    counts that do not fit in a uint8 are kept exactly in a dict
+    -The table is sized for the expected number of wide counters at
+    TARGET_LOAD (see wide_capacity), any capacity works as slots are found
+    by multiply-shift range reduction, and it grows by GROWTH past MAX_LOAD
+    -In a full counting bloom filter with the optimal number of hashes 2.5%
+    to 3.5% of the counters reach 3, so a counter costs 2 bits plus
+    40 / 0.8 * 3% = 1.5 bits of table, about 3.3 to 3.8 bits against 4 for
+    CountingBloomFilter with count_size 4
+    """
+    ESCAPE = 3
+    # base value of a counter stored in the wide table
+    EMPTY = 0xFFFFFFFF
+    # key of an empty slot of the wide table
+    LARGE = 0xFF
+    # wide table value of a counter whose count is in the large dict
+    TARGET_LOAD = 0.8
+    MAX_LOAD = 0.9
+    GROWTH = 1.25
+    MIN_CAPACITY = 16
+
+    def __init__(self, size, buffer=None, keys=None, values=None, used=0, large=None, capacity=None):
+        """
+        size : int
+            Number of counters
+        buffer, keys, values : buffer objects
+            Existing base buffer and wide table to use in place (e.g. a memory
+            mapped file), new ones are allocated if None
+        capacity : int
+            Slots of a new wide table (default MIN_CAPACITY), see wide_capacity
+        """
+        if size >= self.EMPTY:
+            raise ValueError("CompactCounterArray holds less than 2^32 - 1 counters")
+        self.size = size
+        self.base = PackedCounterArray(size, 2, buffer)
+        if keys is None:
+            capacity = max(capacity or 0, self.MIN_CAPACITY)
+            keys = np.full(capacity, self.EMPTY, dtype=np.uint32)
+            values = np.zeros(capacity, dtype=np.uint8)
+        self._set_table(keys, values)
+        # number of wide counters
+        self.used = used
+        self.large = large if large is not None else {}
+
+    def _set_table(self, keys, values):
+        self.wide_keys = keys
+        self.wide_values = values
+        # memoryviews give fast scalar access, numpy is used for batches
+        self.key_words = memoryview(keys).cast('B').cast('I')
+        self.value_words = memoryview(values).cast('B')
+        self.capacity = len(keys)
+
+    @classmethod
+    def wide_capacity(cls, size, increments):
+        '''
+        Return the table capacity for the expected number of wide counters
+        once increments counter increments are spread over size counters,
+        counts are Poisson with mean increments / size
+        '''
+        mean = increments / size
+        wide = size * (1 - math.exp(-mean) * (1 + mean + mean * mean / 2))
+        return max(math.ceil(wide / cls.TARGET_LOAD), cls.MIN_CAPACITY)
+
+    @property
+    def nbytes(self):
+        return self.base.nbytes + self.wide_keys.nbytes + self.wide_values.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def copy(self):
+        return CompactCounterArray(self.size, bytearray(self.base.buffer), self.wide_keys.copy(), self.wide_values.copy(),
+                                   self.used, dict(self.large))
+
+    def _slot(self, index):
+        '''
+        Return the slot of index in the wide table, or the empty slot where it
+        would be inserted
+        '''
+        slot = self._home(index)
+        while True:
+            key = self.key_words[slot]
+            if key == index or key == self.EMPTY:
+                return slot
+            slot += 1
+            if slot == self.capacity:
+                slot = 0
+
+    def _home(self, index):
+        # multiply-shift hash scaled to the capacity, for a power of 2
+        # capacity it is the top bits of the hash
+        return (((index * 0x9E3779B1) & 0xFFFFFFFF) * self.capacity) >> 32
+
+    def _get_wide(self, index):
+        value = self.value_words[self._slot(index)]
+        if value == self.LARGE:
+            return self.large[index]
+        return value + self.ESCAPE
+
+    def _set_wide(self, index, value):
+        '''
+        Store a wide counter (value >= ESCAPE), inserting it if needed
+        '''
+        slot = self._slot(index)
+        if self.key_words[slot] == self.EMPTY:
+            if (self.used + 1) > self.MAX_LOAD * self.capacity:
+                self._resize(math.ceil(self.GROWTH * self.capacity))
+                slot = self._slot(index)
+            self.key_words[slot] = index
+            self.used += 1
+        if value - self.ESCAPE >= self.LARGE:
+            self.value_words[slot] = self.LARGE
+            self.large[index] = value
+        else:
+            self.value_words[slot] = value - self.ESCAPE
+            self.large.pop(index, None)
+
+    def _delete_wide(self, index):
+        '''
+        Remove a wide counter, the following slots of its probe run are moved
+        back so lookups never need tombstones
+        '''
+        slot = self._slot(index)
+        self.large.pop(index, None)
+        self.used -= 1
+        hole = slot
+        slot = (slot + 1) % self.capacity
+        while self.key_words[slot] != self.EMPTY:
+            key = self.key_words[slot]
+            # move the key into the hole if the hole is between its home slot and its slot
+            if (slot - self._home(key)) % self.capacity >= (slot - hole) % self.capacity:
+                self.key_words[hole] = key
+                self.value_words[hole] = self.value_words[slot]
+                hole = slot
+            slot = (slot + 1) % self.capacity
+        self.key_words[hole] = self.EMPTY
+        self.value_words[hole] = 0
+
+    def _resize(self, capacity):
+        occupied = self.wide_keys != self.EMPTY
+        keys, values = self.wide_keys[occupied].tolist(), self.wide_values[occupied].tolist()
+        self._set_table(np.full(capacity, self.EMPTY, dtype=np.uint32), np.zeros(capacity, dtype=np.uint8))
+        for key, value in zip(keys, values):
+            slot = self._slot(key)
+            self.key_words[slot] = key
+            self.value_words[slot] = value
+
+    def get(self, index):
+        value = self.base.get(index)
+        if value < self.ESCAPE:
+            return value
+        return self._get_wide(index)
+
+    def set(self, index, value):
+        value = max(value, 0)
+        if self.base.get(index) == self.ESCAPE and value < self.ESCAPE:
+            self._delete_wide(index)
+        if value >= self.ESCAPE:
+            self._set_wide(index, value)
+        self.base.set(index, min(value, self.ESCAPE))
+
+    def increment(self, index, value=1):
+        '''
+        Add value to the counter
+        Returns the new value of the counter
+        '''
+        current = self.base.get(index)
+        if current + value < self.ESCAPE:
+            self.base.set(index, current + value)
+            return current + value
+        if current == self.ESCAPE:
+            new_value = self._get_wide(index) + value
+        else:
+            new_value = current + value
+            self.base.set(index, self.ESCAPE)
+        self._set_wide(index, new_value)
+        return new_value
+
+    def decrement(self, index, value=1):
+        '''
+        Subtract value from the counter, clamping at 0
+        Returns the new value of the counter
+        '''
+        current = self.base.get(index)
+        if current < self.ESCAPE:
+            new_value = max(current - value, 0)
+            self.base.set(index, new_value)
+            return new_value
+        new_value = max(self._get_wide(index) - value, 0)
+        if new_value < self.ESCAPE:
+            self._delete_wide(index)
+            self.base.set(index, new_value)
+        else:
+            self._set_wide(index, new_value)
+        return new_value
+
+    def nonzero_many(self, indexes):
+        '''
+        Return a boolean array of the counters at indexes that are not 0,
+        it only reads the base counters
+        '''
+        return self.base.get_many(indexes) > 0
+
+    def get_many(self, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        values = self.base.get_many(indexes)
+        wide = values == self.ESCAPE
+        values[wide] = [self._get_wide(index) for index in indexes[wide].tolist()]
+        return values
+
+    def increment_many(self, indexes):
+        '''
+        Add 1 to the counter of every index (repeated indexes add repeatedly)
+        '''
+        indexes, counts = np.unique(np.asarray(indexes, dtype=np.int64).ravel(), return_counts=True)
+        values = self.base.get_many(indexes) + counts
+        # counters that stay below ESCAPE are updated in the base array at
+        # once, the others one by one
+        small = values < self.ESCAPE
+        self.base.set_many(indexes[small], values[small])
+        for index, count in zip(indexes[~small].tolist(), counts[~small].tolist()):
+            self.increment(index, count)
+
+    def decrement_many(self, indexes):
+        '''
+        Subtract 1 from the counter of every index (repeated indexes subtract repeatedly)
+        '''
+        indexes, counts = np.unique(np.asarray(indexes, dtype=np.int64).ravel(), return_counts=True)
+        values = self.base.get_many(indexes)
+        small = values < self.ESCAPE
+        self.base.set_many(indexes[small], values[small] - counts[small])
+        for index, count in zip(indexes[~small].tolist(), counts[~small].tolist()):
+            self.decrement(index, count)
+
+    def values(self):
+        '''
+        Return all counters as an int64 numpy array
+        '''
+        values = self.base.values()
+        occupied = self.wide_keys != self.EMPTY
+        keys = self.wide_keys[occupied].astype(np.int64)
+        values[keys] = self.wide_values[occupied].astype(np.int64) + self.ESCAPE
+        for index, value in self.large.items():
+            values[index] = value
+        return values
+
+    def assign(self, values):
+        '''
+        Set all counters from a numpy array of size values
+        '''
+        values = np.maximum(values, 0)
+        self.base.assign(np.minimum(values, self.ESCAPE))
+        wide = np.flatnonzero(values >= self.ESCAPE)
+        # keep the table sized for the filter unless the counters need more
+        capacity = max(self.capacity, math.ceil(len(wide) / self.TARGET_LOAD))
+        self._set_table(np.full(capacity, self.EMPTY, dtype=np.uint32), np.zeros(capacity, dtype=np.uint8))
+        self.used = 0
+        self.large = {}
+        for index, value in zip(wide.tolist(), values[wide].tolist()):
+            self._set_wide(index, value)
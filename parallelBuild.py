@@ -0,0 +1,232 @@
+import os
+from multiprocessing import Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty, Full
+
+from bitOps import chunks
+from bloomFilter import BloomFilter
+
+"""
+Parallel bulk build of a filter.
+
+Every worker process owns one shard, a filter of the same size whose buffer
+lives in a shared memory block created by the parent. The workers write
+their bits or counters straight into shared memory, so shards never go
+through a pipe; the parent then merges them with union (OR for bit filters,
+saturating counter sum for CountingBloomFilter). With overflow=True the
+overflow table of every shard is sent back to the parent, and union sums
+the exact counts.
+
+Text files are split in byte ranges of the same size cut at line starts, so
+a single large file is read by every worker. Keys of an iterable are sent to
+the workers round robin in chunks, smaller chunks for a short list or array
+so every worker gets a share. The parent never blocks on a dead worker, it
+raises RuntimeError.
+"""
+
+CHUNK_SIZE = 65536
+# number of keys sent to a worker at a time when building from an iterable
+MIN_CHUNK_SIZE = 1024
+# smallest chunk when a list or array is split across the workers
+POLL_INTERVAL = 0.5
+# seconds between checks of the workers while the parent waits on a queue
+
+
+def build_parallel(iterable_or_paths, items_count, fp_prob, workers=None, filter_class=BloomFilter,
+                   files=None, **filter_args):
+    '''
+    Build a filter from a large input with a pool of worker processes
+
+    iterable_or_paths : iterable or list of paths
+        Keys, or text files holding one key per line
+    items_count, fp_prob :
+        Size of the filter, as for the filter constructors
+    workers : int
+        Number of worker processes (default os.cpu_count())
+    filter_class : class
+        BloomFilter, ShiftingBloomFilterM, BlockedBloomFilter or CountingBloomFilter
+    files : bool
+        Whether iterable_or_paths is a list of files. When None only a list
+        of os.PathLike objects (e.g. pathlib.Path) is read as files, pass
+        files=True for a list of str paths
+    filter_args :
+        Extra arguments of the filter constructor (count_size, hash_strategy)
+    '''
+    workers = workers or os.cpu_count()
+    if files is None:
+        files = is_path_list(iterable_or_paths)
+    if files:
+        shard_ranges = [ranges for ranges in split_files([os.fspath(path) for path in iterable_or_paths], workers)
+                        if ranges] or [[]]
+        workers = len(shard_ranges)
+    else:
+        chunk_size = CHUNK_SIZE
+        if hasattr(iterable_or_paths, "__len__"):
+            chunk_size = min(CHUNK_SIZE, max(MIN_CHUNK_SIZE, -(-len(iterable_or_paths) // workers)))
+            workers = max(1, min(workers, -(-len(iterable_or_paths) // chunk_size)))
+
+    template = filter_class(items_count, fp_prob, **filter_args)
+    fields, metadata, payload, _ = template.file_record()
+    nbytes = memoryview(payload).nbytes
+    del template, payload
+
+    # new shared memory blocks are zero filled, like a new filter
+    memories = [SharedMemory(create=True, size=max(nbytes, 1)) for _ in range(workers)]
+    processes = []
+    queues = []
+    try:
+        results = Queue()
+        for index, memory in enumerate(memories):
+            queue = None if files else Queue(maxsize=4)
+            ranges = shard_ranges[index] if files else None
+            process = Process(target=build_shard,
+                              args=(index, filter_class, fields, metadata, memory.name, nbytes, queue, ranges,
+                                    results))
+            process.start()
+            queues.append(queue)
+            processes.append(process)
+
+        if not files:
+            for index, chunk in enumerate(chunks(iterable_or_paths, chunk_size)):
+                put_checked(queues[index % workers], chunk, processes)
+            for queue in queues:
+                put_checked(queue, None, processes)
+
+        # read the results before joining, a worker exits only once its
+        # overflow table went through the pipe
+        shard_results = dict(get_checked(results, processes) for _ in processes)
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError("Shard worker failed with exit code " + str(process.exitcode))
+
+        merged = None
+        for index, memory in enumerate(memories):
+            shard = filter_class.from_file_record(fields, metadata, memory.buf[:nbytes], [])
+            shard.count, overflow = shard_results[index]
+            if overflow is not None:
+                shard.overflow = overflow
+            # union copies into the heap, so no view on the shared memory survives
+            merged = shard.copy() if merged is None else merged.union(shard)
+            del shard
+        merged.count = sum(count for count, _ in shard_results.values())
+        if getattr(merged, "overflow", None) is not None:
+            # increments above max_value of the whole input, as in a sequential build
+            merged.overflow_count = sum(value - merged.max_value for value in merged.overflow.values())
+        return merged
+    finally:
+        # workers still running after a failure are stopped, chunks left in
+        # their queues are dropped
+        for process, queue in zip(processes, queues):
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            if queue is not None:
+                queue.cancel_join_thread()
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+
+def build_shard(index, filter_class, fields, metadata, memory_name, nbytes, queue, ranges, results):
+    memory = SharedMemory(name=memory_name)
+    shard = filter_class.from_file_record(fields, metadata, memory.buf[:nbytes], [])
+    if ranges is not None:
+        for path, start, stop in ranges:
+            shard.add_many(read_keys(path, start, stop))
+    else:
+        for keys in iter(queue.get, None):
+            shard.add_many(keys)
+    # the counters are in shared memory, only the overflow table is sent
+    results.put((index, (shard.count, getattr(shard, "overflow", None))))
+    del shard
+    memory.close()
+
+
+def put_checked(queue, item, processes):
+    '''
+    Put item in the queue of a worker, raise RuntimeError if a worker died
+    instead of waiting forever for room in its queue
+    '''
+    while True:
+        try:
+            queue.put(item, timeout=POLL_INTERVAL)
+            return
+        except Full:
+            check_workers(processes)
+
+
+def get_checked(queue, processes):
+    '''
+    Get a result of a worker, raise RuntimeError if a worker died before
+    sending its result
+    '''
+    while True:
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            check_workers(processes)
+
+
+def check_workers(processes):
+    for process in processes:
+        if process.exitcode is not None and process.exitcode != 0:
+            raise RuntimeError("Shard worker failed with exit code " + str(process.exitcode))
+
+
+def split_files(paths, workers):
+    '''
+    Split text files in workers lists of (path, start, stop) byte ranges
+    holding about the same number of bytes, cut at line starts so every
+    line is read by exactly one worker
+    '''
+    sizes = [os.path.getsize(path) for path in paths]
+    share = max(-(-sum(sizes) // workers), 1)
+    shard_ranges = [[] for _ in range(workers)]
+    offset = 0
+    for path, size in zip(paths, sizes):
+        with open(path, "rb") as f:
+            start = 0
+            while start < size:
+                worker = min((offset + start) // share, workers - 1)
+                stop = line_start(f, (worker + 1) * share - offset, size)
+                shard_ranges[worker].append((path, start, stop))
+                start = stop
+        offset += size
+    return shard_ranges
+
+
+def line_start(f, position, size):
+    '''
+    Return the offset of the first line starting at or after position
+    '''
+    if position >= size:
+        return size
+    f.seek(position - 1)
+    f.readline()
+    return f.tell()
+
+
+def read_keys(path, start=0, stop=None):
+    '''
+    Yield the non empty lines of a file (or of the lines starting in
+    [start, stop)) as bytes keys, mmh3 hashes a str key as its utf-8 bytes so
+    they match keys added as str
+    '''
+    with open(path, "rb") as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if stop is not None and position >= stop:
+                break
+            position += len(line)
+            line = line.rstrip(b"\r\n")
+            if line:
+                yield line
+
+
+def is_path_list(iterable_or_paths):
+    # a str key may name an existing file, only path objects are taken as files
+    if not isinstance(iterable_or_paths, (list, tuple)) or not iterable_or_paths:
+        return False
+    return all(isinstance(path, os.PathLike) for path in iterable_or_paths)
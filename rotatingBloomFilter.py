@@ -0,0 +1,224 @@
+import time
+import numpy as np
+
+from bitOps import chunks, get_bits, set_bits
+from bloomFilter import BloomFilter
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
+
+
+class RotatingBloomFilter(object):
+    """
+    Sliding window bloom filter for stream deduplication
+    -A ring of generations, BloomFilters of the same size, every generation
+    covers a window of window seconds or of items_count items
+    -Items are added in the newest generation and looked up in all of them
+    -When the newest generation is full or its window is over, the oldest
+    generation is cleared in place and becomes the newest one, so memory and
+    lookup cost stay constant on an unbounded stream
+    -An item is remembered for at least generations - 1 windows
+    """
+    GENERATIONS = 4
+
+    def __init__(self, items_count, fp_prob, generations=GENERATIONS, window=None, hash_strategy=None,
+                 clock=time.monotonic):
+        """
+        items_count : int
+            Number of items expected in the window of one generation
+        fp_prob : float
+            False Positive probability in decimal, for a lookup across all
+            the generations
+        generations : int
+            Number of generations in the ring
+        window : float
+            Seconds covered by a generation, None to rotate only when the
+            newest generation holds items_count items
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
+        clock : function
+            Time source of the windows, in seconds
+        """
+        if generations < 2:
+            raise ValueError("generations must be at least 2")
+        self.item_low_count = items_count
+        self.fp_prob = fp_prob
+        self.window = window
+        self.clock = clock
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        # a lookup fails only if every generation fails:
+        # 1 - (1 - p_gen) ^ generations = fp_prob
+        generation_fp_prob = 1 - (1 - fp_prob) ** (1 / generations)
+        self.generations = [BloomFilter(items_count, generation_fp_prob, hash_strategy=self.hash_strategy)
+                            for _ in range(generations)]
+        # index of the newest generation in the ring
+        self.newest = 0
+        self.rotated_at = clock()
+
+    def rotate(self):
+        '''
+        Expire the oldest generation, it is cleared in place and becomes the newest
+        '''
+        self.newest = (self.newest + 1) % len(self.generations)
+        newest = self.generations[self.newest]
+        newest.bit_array.setall(0)
+        newest.fill_stats.invalidate()
+        newest.count = 0
+        self.rotated_at = self.clock()
+
+    def expire(self):
+        '''
+        Rotate once for every window that ended since the last rotation
+        '''
+        if self.window is None:
+            return
+        elapsed = self.clock() - self.rotated_at
+        if elapsed >= self.window:
+            for _ in range(min(int(elapsed // self.window), len(self.generations))):
+                self.rotate()
+
+    def add(self, item):
+        '''
+        Add an item in the newest generation
+        Returns True if the item was already in the window
+        '''
+        return self.add_digest(self.hash_strategy.digest(item))
+
+    def add_digest(self, item_digest):
+        self.expire()
+        newest = self.generations[self.newest]
+        if newest.contains_digest(item_digest):
+            return True
+        present = self.contains_digest(item_digest)
+        if newest.count >= newest.item_low_count:
+            self.rotate()
+            newest = self.generations[self.newest]
+        newest.add_digest(item_digest)
+        return present
+
+    def __contains__(self, item):
+        '''
+        Check for existence of an item in the live generations
+        '''
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+        self.expire()
+        for temp in self.live_generations():
+            if temp.contains_digest(item_digest):
+                return True
+        return False
+
+    def live_generations(self):
+        '''
+        Yield the non empty generations, newest first
+        '''
+        for offset in range(len(self.generations)):
+            temp = self.generations[(self.newest - offset) % len(self.generations)]
+            if temp.count:
+                yield temp
+
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the newest generation
+        Returns the number of items added, like add an item already in the
+        newest generation or repeated in the iterable is not counted again,
+        so duplicates in a stream do not rotate the generations early
+        '''
+        self.expire()
+        added = 0
+        for chunk in chunks(items, BloomFilter.CHUNK_SIZE):
+            # generations have the same shape, so the positions are shared
+            positions = self.generations[self.newest].hash_many(chunk)
+            _, first = np.unique(positions, axis=0, return_index=True)
+            positions = positions[np.sort(first)]
+            while len(positions):
+                newest = self.generations[self.newest]
+                if newest.count >= newest.item_low_count:
+                    self.rotate()
+                    continue
+                positions = positions[~get_bits(newest.bit_array, positions).all(axis=1)]
+                batch = positions[:newest.item_low_count - newest.count]
+                set_bits(newest.bit_array, batch)
+                newest.fill_stats.mark_many(batch)
+                newest.count += len(batch)
+                added += len(batch)
+                positions = positions[len(batch):]
+        return added
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in the live generations
+        Returns a boolean numpy array
+        '''
+        self.expire()
+        results = []
+        for chunk in chunks(items, BloomFilter.CHUNK_SIZE):
+            positions = self.generations[self.newest].hash_many(chunk)
+            found = np.zeros(len(chunk), dtype=bool)
+            for temp in self.live_generations():
+                found |= get_bits(temp.bit_array, positions).all(axis=1)
+            results.append(found)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def __len__(self):
+        return sum(temp.count for temp in self.generations)
+
+    def get_bitarray_size(self):
+        return sum(temp.get_bitarray_size() for temp in self.generations)
+
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the bit arrays of all generations
+        '''
+        return sum(temp.nbytes for temp in self.generations)
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item of the
+        whole ring, with the report of every generation under "generations"
+        '''
+        generations = [temp.memory_report() for temp in self.generations]
+        metadata_bytes = memory_usage.get_metadata_size(self, ("generations",))
+        metadata_bytes += sum(generation["metadata_bytes"] for generation in generations)
+        report = memory_usage.build_report(self.nbytes, metadata_bytes, len(self))
+        report["generations"] = generations
+        return report
+
+    def save(self, path):
+        '''
+        Save the filter and all its generations in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True every generation is a read-only
+        view on the mapped file (and can not be rotated)
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"item_low_count": self.item_low_count, "count": len(self), "fp_prob": self.fp_prob,
+                  "hash_strategy": self.hash_strategy.name}
+        # the clock is not saved, the current window restarts when loaded
+        metadata = {"window": self.window, "newest": self.newest}
+        return fields, metadata, b"", self.generations
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = cls.__new__(cls)
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.window = metadata["window"]
+        new_filter.clock = time.monotonic
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.generations = children
+        new_filter.newest = metadata["newest"]
+        new_filter.rotated_at = new_filter.clock()
+        return new_filter
@@ -1,76 +1,303 @@
 import math
+import threading
+from concurrent.futures import Future
 
+from bitOps import chunks
 from bloomFilter import BloomFilter
 from countingBloomFilter import CountingBloomFilter
+from cuckooFilter import CuckooFilter
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
 
 
 class ScalableBloomFilter(object):
+    """
+    Scalable bloom filter (Almeida et al., "Scalable Bloom Filters")
+    -Layer i holds initial_items_count * growth^i items
+    -Layer i has fp probability fp_prob * (1 - ratio) * ratio^i, the sum of the
+    layer probabilities is a geometric series bounded by fp_prob, so the
+    compound fp probability 1 - prod(1 - p_i) stays below fp_prob however
+    many layers are added
+    """
+    CHUNK_SIZE = 65536
+    # number of keys checked together by compact
     SMALL_GROWTH = 2
     LARGE_GROWTH = 4
+    LAYER_TYPES = {layer_type.__name__: layer_type for layer_type in (BloomFilter, CountingBloomFilter, CuckooFilter)}
+    TIGHTENING_RATIO = 0.9
+    # ratio r between the fp probabilities of two consecutive layers, 0.8-0.9
+    # is the recommended range, lower values make the later layers larger
 
-    def __init__(self, initial_items_count=100, fp_prob=0.001, growth=SMALL_GROWTH, countable=False , count_size=8):
+    def __init__(self, initial_items_count=100, fp_prob=0.001, growth=SMALL_GROWTH, countable=False , count_size=8,
+                 hash_strategy=None, ratio=TIGHTENING_RATIO, layer_type=None):
+        """
+        layer_type : class
+            Filter class of the layers, BloomFilter by default and
+            CountingBloomFilter when countable. CuckooFilter gives deletable
+            layers for a fraction of the memory of counting layers
+        """
 
-        # TODO ratio calculations needed. New bloom filters fp probability must equal to
-        #  ratio * previous filter's fp_prob
-        #  (for initial filter prob = fp_prob, for second prob = r * fp_prob, for third  r^2 * fp_prob)
+        if not 0 < ratio < 1:
+            raise ValueError("ratio must be between 0 and 1")
         self.countable = countable
         self.initial_items_count = initial_items_count
         self.fp_prob = fp_prob
         self.growth = growth
+        self.ratio = ratio
         self.count_size = count_size
+        self.hash_strategy = get_hash_strategy(hash_strategy)
 
-        if countable:
+        if layer_type is not None:
+            self.create_filter = layer_type
+        elif countable:
             self.create_filter = CountingBloomFilter
         else:
             self.create_filter = BloomFilter
 
         self.bloom_filters = []
+        # schedule index of the next layer, compaction removes layers but the
+        # fp budget of their indexes stays used
+        self.next_layer = 0
+        # held while the layer list is replaced, lookups read it without locking
+        self.layers_lock = threading.Lock()
 
     def add(self, item):
 
-        if item in self:
+        # one digest per key, every layer derives its own indexes from it
+        item_digest = self.hash_strategy.digest(item)
+        if self.contains_digest(item_digest):
             return True
-        if not self.bloom_filters:
-            temp_filter = self.create_filter(self.initial_items_count, self.fp_prob * 0.9, count_size=self.count_size)
-            self.bloom_filters.append(temp_filter)
-        else:
-            temp_filter = self.bloom_filters[-1]
-            if temp_filter.count >= temp_filter.item_low_count:
-                temp_filter = self.create_filter(temp_filter.size * self.growth, temp_filter.fp_prob * 0.1, count_size=self.count_size)  # 0.1 is the ratio for creating next filter
-                # TODO check fp prob
-                self.bloom_filters.append(temp_filter)
-
-        temp_filter.add(item)
+        if not self.bloom_filters or self.bloom_filters[-1].count >= self.bloom_filters[-1].item_low_count:
+            with self.layers_lock:
+                self.bloom_filters.append(self.create_layer(self.next_layer))
+                self.next_layer += 1
+        if not self.bloom_filters[-1].add_digest(item_digest):
+            # a cuckoo layer can be full before its capacity
+            with self.layers_lock:
+                self.bloom_filters.append(self.create_layer(self.next_layer))
+                self.next_layer += 1
+            self.bloom_filters[-1].add_digest(item_digest)
 
         return False
 
+    def layer_parameters(self, index):
+        '''
+        Return the (items_count, fp_prob) of the layer at index
+        '''
+        return (self.initial_items_count * self.growth ** index,
+                self.fp_prob * (1 - self.ratio) * self.ratio ** index)
+
+    def create_layer(self, index):
+        items_count, fp_prob = self.layer_parameters(index)
+        return self.create_filter(items_count, fp_prob, count_size=self.count_size, hash_strategy=self.hash_strategy)
+
+    def predicted_cost(self, layer_count):
+        '''
+        Return the predicted cost of the filter once it has layer_count layers,
+        computed from the schedule without allocating any layer
+        -items_count : number of items the layers can hold
+        -nbytes : bytes of the bit or counter arrays of the layers
+        -probes : bits or counters read by a lookup of an absent key that is
+        not stopped early, the sum of the hash counts of the layers
+        -fp_prob : compound fp probability 1 - prod(1 - p_i)
+        '''
+        items_count = nbytes = probes = 0
+        true_negative = 1.0
+        counter_bits = self.count_size if self.create_filter is CountingBloomFilter else 1
+        for index in range(layer_count):
+            layer_items, layer_fp_prob = self.layer_parameters(index)
+            size = self.create_filter.get_size(layer_items, layer_fp_prob)
+            hash_count = max(self.create_filter.get_hash_count(size, layer_items), 1)
+            size += hash_count - (size % hash_count)
+            items_count += layer_items
+            nbytes += (size * counter_bits + 7) // 8
+            probes += hash_count
+            true_negative *= 1 - layer_fp_prob
+        return {"layers": layer_count, "items_count": items_count, "nbytes": nbytes, "probes": probes,
+                "fp_prob": 1 - true_negative}
+
+    def compact(self, keys, layers=None, background=False, exact=False):
+        '''
+        Rebuild the oldest layers into one layer sized for the items they hold,
+        so lookups probe fewer layers (like the compaction of an LSM tree)
+
+        keys : iterable
+            Key source of the compacted layers, e.g. a log of every added key.
+            It can hold more keys than the layers, only the keys the layers
+            still contain are added in the new layer, so keys deleted from a
+            counting filter are not brought back
+        layers : int
+            Number of oldest layers to compact, default all but the newest one
+        background : bool
+            Build the new layer in a thread and return a Future of the report,
+            the filter can be used meanwhile (keys must not be deleted from the
+            compacted layers until the Future is done)
+        exact : bool
+            keys hold only keys of the filter (e.g. a set kept next to it, the
+            deleted keys removed), so every key the layers report is a real
+            item. Otherwise the source keys that are false positives of the
+            compacted layers are added too: they take capacity and fill in the
+            new layer, and its items are capped at the count of the layers
+
+        The new layer gets the sum of the fp probabilities of the compacted
+        layers, which keeps the compound fp probability below fp_prob.
+        Returns a dict with the number of layers merged, the items kept, and
+        the probes and bytes saved (negative if the new layer is larger)
+        '''
+        old_layers = self.bloom_filters[:len(self.bloom_filters) - 1 if layers is None else layers]
+        if not background:
+            return self._compact(keys, old_layers, exact)
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._compact(keys, old_layers, exact))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def _compact(self, keys, old_layers, exact=False):
+        items = sum(temp.count for temp in old_layers)
+        if len(old_layers) < 2:
+            return {"layers": len(old_layers), "items": items, "probes_saved": 0, "bytes_saved": 0}
+
+        # keep the keys found in the old layers, once each
+        kept = {}
+        for chunk in chunks(keys, self.CHUNK_SIZE):
+            found = old_layers[0].contains_many(chunk)
+            for temp in old_layers[1:]:
+                found |= temp.contains_many(chunk)
+            kept.update(dict.fromkeys(key for key, present in zip(chunk, found) if present))
+
+        merged = self.create_filter(max(len(kept), 1), sum(temp.fp_prob for temp in old_layers),
+                                    count_size=self.count_size, hash_strategy=self.hash_strategy)
+        merged.add_many(kept)
+        if not exact:
+            # false positives of the old layers are not items
+            merged.count = min(merged.count, items)
+
+        with self.layers_lock:
+            if any(a is not b for a, b in zip(self.bloom_filters, old_layers)):
+                raise RuntimeError("Layers were changed by another compaction")
+            self.bloom_filters = [merged] + self.bloom_filters[len(old_layers):]
+
+        return {"layers": len(old_layers), "items": merged.count,
+                "probes_saved": sum(temp.hash_count for temp in old_layers) - merged.hash_count,
+                "bytes_saved": sum(temp.nbytes for temp in old_layers) - merged.nbytes}
+
     def get_bitarray_size(self):
         size = 0
         for i in self.bloom_filters:
             size += i.get_bitarray_size()
         return size
 
-    # TODO fp_prob calculation (which calculates fp prob instantly) operation will added
+    def stats(self):
+        '''
+        Return the statistics of the whole filter from the cached stats of its
+        layers (see fillStats.py), with the stats of every layer under "layers"
+        -estimated_items : sum of the estimates of the layers
+        -fp_prob : compound current fp rate 1 - prod(1 - p_i)
+        -slice_imbalance : largest imbalance of a layer
+        '''
+        if not hasattr(self.create_filter, "stats"):
+            raise TypeError(self.create_filter.__name__ + " layers do not have stats")
+        layers = [temp.stats() for temp in self.bloom_filters]
+        size = sum(layer["size"] for layer in layers)
+        set_positions = sum(layer["set_positions"] for layer in layers)
+        true_negative = 1.0
+        for layer in layers:
+            true_negative *= 1 - layer["fp_prob"]
+        return {
+            "count": sum(layer["count"] for layer in layers),
+            "size": size,
+            "set_positions": set_positions,
+            "fill_ratio": set_positions / size if size else 0.0,
+            "estimated_items": sum(layer["estimated_items"] for layer in layers),
+            "fp_prob": 1 - true_negative,
+            "slice_imbalance": max((layer["slice_imbalance"] for layer in layers), default=1.0),
+            "layers": layers,
+        }
+
     def delete(self, item):
-        if not self.countable:
+        if not hasattr(self.create_filter, "delete_digest"):
             print("Delete operation only available for counting scalable bloom filters")
             return False
+        item_digest = self.hash_strategy.digest(item)
         for temp in reversed(self.bloom_filters):
-            if temp.delete(item):
+            if temp.delete_digest(item_digest):
                 return True
         return False
 
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the bit or counter arrays of all layers
+        '''
+        return sum(temp.nbytes for temp in self.bloom_filters)
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item of the
+        whole filter, with the report of every layer under "layers"
+        '''
+        layers = [temp.memory_report() for temp in self.bloom_filters]
+        metadata_bytes = memory_usage.get_metadata_size(self, ("bloom_filters",))
+        metadata_bytes += sum(layer["metadata_bytes"] for layer in layers)
+        report = memory_usage.build_report(sum(layer["payload_bytes"] for layer in layers), metadata_bytes,
+                                           sum(layer["items"] for layer in layers))
+        report["layers"] = layers
+        return report
+
     def get_total_size(self):
 
         return sum([temp.size for temp in self.bloom_filters])
 
     def __contains__(self, item):
 
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+
         for temp in reversed(self.bloom_filters):
-            if item in temp:
+            if temp.contains_digest(item_digest):
                 return True
         return False
 
+    def save(self, path):
+        '''
+        Save the filter and all its layers in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True every layer is a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"count_size": self.count_size, "item_low_count": self.initial_items_count,
+                  "fp_prob": self.fp_prob, "hash_strategy": self.hash_strategy.name}
+        metadata = {"growth": self.growth, "countable": self.countable, "ratio": self.ratio,
+                    "next_layer": self.next_layer, "layer_type": self.create_filter.__name__}
+        return fields, metadata, b"", self.bloom_filters
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = cls(fields["item_low_count"], fields["fp_prob"], growth=metadata["growth"],
+                         countable=metadata["countable"], count_size=fields["count_size"],
+                         hash_strategy=fields["hash_strategy"],
+                         ratio=metadata.get("ratio", cls.TIGHTENING_RATIO),
+                         layer_type=cls.LAYER_TYPES.get(metadata.get("layer_type")))
+        new_filter.bloom_filters = children
+        new_filter.next_layer = metadata.get("next_layer", len(children))
+        return new_filter
+
     @classmethod
     def get_size(self, n, p):
         """
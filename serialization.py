@@ -0,0 +1,179 @@
+import importlib
+import json
+import mmap as mmap_module
+import struct
+
+"""
+Binary file format shared by the filters.
+
+A file is one record, a record is
+    HEADER | metadata (json) | padding | payload | padding
+where the payload is the raw bit or counter buffer of the filter, and is
+followed by the records of the child filters (layers of a scalable filter).
+Records are 8 byte aligned so counter buffers can be viewed in place.
+Word counters (count_size 16 and 32) are stored in native byte order.
+
+Every filter class implements
+    file_record(self) -> (fields, metadata, payload, children)
+    from_file_record(cls, fields, metadata, payload, children) (classmethod)
+where fields holds the HEADER values below and payload is a buffer.
+"""
+
+MAGIC = b"BLMF"
+VERSION = 2
+# version 2 changed the indexes of the "double" hash strategy
+
+# magic, version, kind, hash strategy, size, hash_count, slice_size, count_size,
+# item_low_count, count, fp_prob, metadata size, payload size, children count
+HEADER = struct.Struct("<4sHH16sQQQQQQdQQQ")
+
+FIELDS = ("size", "hash_count", "slice_size", "count_size", "item_low_count", "count", "fp_prob")
+
+# kind code -> (module, class name)
+FILTER_KINDS = {
+    1: ("bloomFilter", "BloomFilter"),
+    2: ("shiftingBloomFilter", "ShiftingBloomFilterM"),
+    3: ("countingBloomFilter", "CountingBloomFilter"),
+    4: ("scalableBloomFilter", "ScalableBloomFilter"),
+    5: ("blockedBloomFilter", "BlockedBloomFilter"),
+    6: ("cuckooFilter", "CuckooFilter"),
+    7: ("xorFilter", "XorFilter"),
+    8: ("rotatingBloomFilter", "RotatingBloomFilter"),
+    9: ("countMinSketch", "CountMinSketch"),
+    10: ("t_CountingBloomFilter", "T_CountingBloomFilter"),
+    11: ("concurrentFilters", "ConcurrentBloomFilter"),
+    12: ("concurrentFilters", "ConcurrentCountingBloomFilter"),
+    13: ("concurrentFilters", "ConcurrentScalableBloomFilter"),
+}
+
+
+def get_filter_class(kind):
+    module_name, class_name = FILTER_KINDS[kind]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_filter_kind(bloom_filter):
+    for kind, (module_name, class_name) in FILTER_KINDS.items():
+        if type(bloom_filter).__name__ == class_name:
+            return kind
+    raise ValueError("Filter type can not be saved: " + type(bloom_filter).__name__)
+
+
+def padding(size):
+    return b"\0" * (-size % 8)
+
+
+def write_record(f, bloom_filter):
+    fields, metadata, payload, children = bloom_filter.file_record()
+    metadata = json.dumps(metadata).encode()
+    payload = memoryview(payload).cast("B")
+    strategy = fields.get("hash_strategy", "").encode()
+    f.write(HEADER.pack(MAGIC, VERSION, get_filter_kind(bloom_filter), strategy,
+                        *[fields.get(name, 0) for name in FIELDS],
+                        len(metadata), len(payload), len(children)))
+    f.write(metadata)
+    f.write(padding(HEADER.size + len(metadata)))
+    f.write(payload)
+    f.write(padding(len(payload)))
+    for child in children:
+        write_record(f, child)
+
+
+def read_record(view, offset=0):
+    '''
+    Read the record starting at offset of the memoryview
+    Returns the filter and the offset of the next record
+    '''
+    values = HEADER.unpack_from(view, offset)
+    magic, version, kind, strategy = values[:4]
+    if magic != MAGIC:
+        raise ValueError("Not a bloom filter file")
+    if version > VERSION:
+        raise ValueError("Unsupported file version: " + str(version))
+    fields = dict(zip(FIELDS, values[4:4 + len(FIELDS)]))
+    fields["hash_strategy"] = strategy.rstrip(b"\0").decode()
+    if version < 2 and fields["hash_strategy"] == "double":
+        raise ValueError("Filter was saved with an older double hashing layout, rebuild it")
+    metadata_size, payload_size, children_count = values[4 + len(FIELDS):]
+
+    offset += HEADER.size
+    metadata = json.loads(bytes(view[offset:offset + metadata_size]))
+    offset += metadata_size
+    offset += -offset % 8
+    payload = view[offset:offset + payload_size]
+    offset += payload_size
+    offset += -offset % 8
+
+    children = []
+    for _ in range(children_count):
+        child, offset = read_record(view, offset)
+        children.append(child)
+    return get_filter_class(kind).from_file_record(fields, metadata, payload, children), offset
+
+
+def save_filter(bloom_filter, path):
+    with open(path, "wb") as f:
+        write_record(f, bloom_filter)
+
+
+class BufferWriter(object):
+    """
+    File-like writer into a writable buffer (e.g. a shared memory block),
+    with buffer=None it only counts the bytes written
+    """
+
+    def __init__(self, buffer=None):
+        self.buffer = None if buffer is None else memoryview(buffer).cast("B")
+        self.size = 0
+
+    def write(self, data):
+        data = memoryview(data).cast("B")
+        if self.buffer is not None:
+            self.buffer[self.size:self.size + len(data)] = data
+        self.size += len(data)
+
+
+def record_size(bloom_filter):
+    '''
+    Return the size in bytes of the record of a filter and its children
+    '''
+    writer = BufferWriter()
+    write_record(writer, bloom_filter)
+    return writer.size
+
+
+def write_filter(bloom_filter, buffer):
+    '''
+    Write the record of a filter at the start of a writable buffer of at
+    least record_size(bloom_filter) bytes
+    '''
+    write_record(BufferWriter(buffer), bloom_filter)
+
+
+def read_filter(buffer, expected_class=None):
+    '''
+    Build a filter from a buffer holding its record, the buffers of the
+    filter are views on it (read-only if the buffer is read-only)
+    '''
+    bloom_filter, _ = read_record(memoryview(buffer))
+    if expected_class is not None and not isinstance(bloom_filter, expected_class):
+        raise ValueError("Buffer holds a " + type(bloom_filter).__name__ + " not a " + expected_class.__name__)
+    return bloom_filter
+
+
+def load_filter(path, mmap=True, expected_class=None):
+    '''
+    Load a filter saved with save_filter
+    mmap=True maps the file read-only, the buffers of the filter are views
+    on the mapping so nothing is copied into the heap and the filter can be
+    queried immediately (but not modified)
+    '''
+    with open(path, "rb") as f:
+        if mmap:
+            view = memoryview(mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ))
+        else:
+            view = memoryview(bytearray(f.read()))
+    bloom_filter, _ = read_record(view)
+    if expected_class is not None and not isinstance(bloom_filter, expected_class):
+        raise ValueError("File holds a " + type(bloom_filter).__name__ + " not a " + expected_class.__name__)
+    return bloom_filter
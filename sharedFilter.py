@@ -0,0 +1,115 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from serialization import read_filter, record_size, write_filter
+
+"""
+Read-only filters in shared memory for multi-process workers.
+
+    shared = SharedFilter.create(bloom_filter)          # owner process
+    ... start the workers with shared.name ...
+    worker = SharedFilter.attach(shared.name)           # any worker
+    key in worker
+    worker.close()
+    shared.close()
+    shared.unlink()                                     # owner, once
+
+The block holds the record of serialization.py (the same bytes as a saved
+file), an attached filter is built over read-only views of the block like a
+filter loaded with mmap=True. Attaching copies nothing, it costs one
+shm_open/mmap and the parse of the record header whatever the filter size,
+and every worker shares the same physical pages.
+Works for BloomFilter, ShiftingBloomFilterM and CountingBloomFilter (and
+any filter serialization.py can save).
+"""
+
+
+class SharedFilter(object):
+    """
+    A filter whose buffers live in a multiprocessing.shared_memory block
+    -filter is the read-only filter, lookups (__contains__, contains_many)
+    can also be done on the SharedFilter itself
+    -Writes to filter (add, add_many, delete) raise TypeError in the owner
+    and in every worker, the block is never modified after create
+    -close() releases the mapping of this process, it fails with BufferError
+    while other references to the filter or its buffers are alive
+    -unlink() destroys the block, called once by the owner
+    """
+
+    def __init__(self, memory, expected_class=None, owner=False):
+        """
+        memory : SharedMemory
+            Block holding the record of a filter
+        expected_class : class
+            Raise ValueError if the block holds another filter type
+        owner : bool
+            Whether this process created the block
+        """
+        self.memory = memory
+        self.name = memory.name
+        self.owner = owner
+        self.filter = read_filter(memory.buf.toreadonly(), expected_class)
+
+    @classmethod
+    def create(cls, bloom_filter, name=None):
+        '''
+        Copy a filter into a new shared memory block (name is random if None)
+        '''
+        memory = SharedMemory(name=name, create=True, size=max(record_size(bloom_filter), 1))
+        try:
+            write_filter(bloom_filter, memory.buf)
+            return cls(memory, type(bloom_filter), owner=True)
+        except BaseException:
+            memory.close()
+            memory.unlink()
+            raise
+
+    @classmethod
+    def attach(cls, name, expected_class=None):
+        '''
+        Attach to the block of a shared filter, zero copy
+        '''
+        return cls(attach_memory(name), expected_class)
+
+    def __contains__(self, item):
+        return item in self.filter
+
+    def contains_many(self, items):
+        return self.filter.contains_many(items)
+
+    def __len__(self):
+        return len(self.filter)
+
+    def close(self):
+        self.filter = None
+        self.memory.close()
+
+    def unlink(self):
+        # an attaching process that shares our resource tracker (started with
+        # multiprocessing) unregistered the block, register it again so the
+        # unregister done by unlink finds it
+        resource_tracker.register(self.memory._name, "shared_memory")
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_memory(name):
+    '''
+    Open an existing block without tracking it, the resource tracker of an
+    attaching process would otherwise destroy the block when it exits
+    '''
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 every SharedMemory is tracked, when the tracker
+        # is shared with the owner this also drops the registration of the
+        # owner, so the owner must call unlink (it is not cleaned up if the
+        # owner crashes)
+        memory = SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
@@ -1,7 +1,13 @@
 import math
-import mmh3
+import numpy as np
 from bitarray import bitarray
 
+from bitOps import chunks, set_bits
+from fillStats import FillStats
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
+
 
 class ShiftingBloomFilterM(object):
     """
@@ -11,19 +17,26 @@ class ShiftingBloomFilterM(object):
     and it reduces number of memory accesses by half
     -This is membership query version of shifting bloom filter
     -There are also association and multiply query versions
+    -Both bits of a pair lie in the 64 bit word starting at the byte of the
+    first bit, contains_many reads that single word per hash and tests the
+    two bits with one mask
     """
-    NUM_OF_BITS = 32
-    # it will equal to 64 if computer is 64 bit
+    NUM_OF_BITS = 64
     # Number of bits in a machine word
-    MAX_OFFSET = 25
-    # it will equal to 57 if the computer is 64 bit
+    MAX_OFFSET = 57
+    # NUM_OF_BITS - 7, the first bit may be at position 7 of its byte and
+    # offsets are in [1, MAX_OFFSET - 1] so the pair always fits in the word
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by add_many / contains_many
 
-    def __init__(self, items_count, fp_prob, count_size = 0):
+    def __init__(self, items_count, fp_prob, count_size = 0, hash_strategy=None):
         """
         items_count : int
             Number of items expected to be stored in bloom filter
         fp_prob : float
             False Positive probability in decimal
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
         """
         # TODO fp rate is smaller than expected, formulas need to be checked
         self.item_low_count = items_count
@@ -39,14 +52,20 @@ class ShiftingBloomFilterM(object):
         if self.hash_count == 0:
             self.hash_count = 1
 
-        # Bit array of given size
-        self.bit_array = bitarray(self.size + self.MAX_OFFSET)
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        # Bit array of given size, rounded up to whole bytes so a filter
+        # loaded from a file (see serialization.py) has the same length
+        self.bit_array = bitarray(self.size + self.MAX_OFFSET + (-(self.size + self.MAX_OFFSET) % 8),
+                                  endian='big')
 
         # initialize all bits as 0
         self.bit_array.setall(0)
 
         self.count = 0
 
+        self.fill_stats = self.create_fill_stats()
+
     def add(self, item):
         '''
         Add an item in the filter
@@ -56,15 +75,14 @@ class ShiftingBloomFilterM(object):
         if self.count > self.item_low_count:
             print("BloomFilter reached it's limit")
             return False
-        o = self.o_function(item)
-        for i in range(self.hash_count):
-            # create digest for given item.
-            # i work as seed to mmh3.hash() function
-            # With different seed, digest created is different
-            digest = mmh3.hash(item, i) % self.size
-
+        # the extra (hash_count + 1)th hash value is used by o_function
+        item_digest = self.hash_strategy.digest(item)
+        o = self.o_function(item_digest)
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.size):
             # set the bit True in bit_array
             self.bit_array[digest], self.bit_array[digest + o] = True, True
+            self.fill_stats.mark(digest)
+            self.fill_stats.mark(digest + o)
         self.count += 1
         return True
 
@@ -72,9 +90,9 @@ class ShiftingBloomFilterM(object):
         '''
         Check for existence of an item in filter
         '''
-        o = self.o_function(item)
-        for i in range(self.hash_count):
-            digest = mmh3.hash(item, i) % self.size
+        item_digest = self.hash_strategy.digest(item)
+        o = self.o_function(item_digest)
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.size):
             if not self.bit_array[digest] & self.bit_array[digest + o]:
                 # if any of bit is False then,its not present
                 # in filter
@@ -82,13 +100,90 @@ class ShiftingBloomFilterM(object):
                 return False
         return True
 
+    def add_many(self, items):
+        '''
+        Add every item of the iterable that is not already in the filter
+        Returns the number of items added
+        '''
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            positions, offsets = self.hash_many(chunk)
+            new_items = ~self.probe_words(positions, offsets)
+            positions, offsets = positions[new_items], offsets[new_items]
+            remaining = self.item_low_count + 1 - self.count
+            if len(positions) > remaining:
+                print("BloomFilter reached it's limit")
+                positions, offsets = positions[:max(remaining, 0)], offsets[:max(remaining, 0)]
+            set_bits(self.bit_array, positions)
+            set_bits(self.bit_array, positions + offsets)
+            self.fill_stats.mark_many(positions)
+            self.fill_stats.mark_many(positions + offsets)
+            self.count += len(positions)
+            added += len(positions)
+        return added
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        results = [self.probe_words(*self.hash_many(chunk)) for chunk in chunks(items, self.CHUNK_SIZE)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def hash_many(self, items):
+        '''
+        Return a (len(items), hash_count) array of first bit positions and
+        the (len(items), 1) array of offsets
+        '''
+        digests = self.hash_strategy.digest_many(items, self.hash_count + 1)
+        positions = self.hash_strategy.indexes_many(digests, self.hash_count, self.size)
+        offsets = self.hash_strategy.indexes_many(digests, self.hash_count + 1, self.MAX_OFFSET - 1,
+                                                  start=self.hash_count) + 1
+        return positions, offsets
+
+    def probe_words(self, positions, offsets):
+        '''
+        Word level probe: read the 64 bit word holding both bits of every
+        pair and test them with a single mask
+        Returns a boolean array, True where all pairs of a row are set
+        '''
+        words = self.word_view()[positions >> 3]
+        first_bits = (63 - (positions & 7)).astype(np.uint64)
+        masks = (np.uint64(1) << first_bits) | (np.uint64(1) << (first_bits - offsets.astype(np.uint64)))
+        return ((words & masks) == masks).all(axis=1)
+
+    def word_view(self):
+        '''
+        Return a numpy view where element i is the big endian 64 bit word
+        starting at byte i of the bit array (unaligned, no copy)
+        '''
+        return np.ndarray(shape=(len(self.bit_array) // 8 - 7,), dtype='>u8', buffer=self.bit_array, strides=(1,))
+
     def __len__(self):
 
         return self.count
 
+    def create_fill_stats(self):
+        # there are no slices, the bit array is split in hash_count equal
+        # regions to measure the imbalance
+        return FillStats(-(-len(self.bit_array) // self.hash_count), self.hash_count)
+
+    def stats(self):
+        '''
+        Return the fill ratio, the estimated number of distinct items, the
+        estimated current fp rate and the fill of hash_count equal regions
+        of the bit array (see fillStats.py)
+        '''
+        return self.fill_stats.stats(self.count_set, 2 * self.hash_count, self.count)
+
+    def count_set(self, start, stop):
+        return self.bit_array.count(1, start, min(stop, len(self.bit_array)))
+
     def copy(self):
 
-        new_filter = ShiftingBloomFilterM(self.item_low_count, self.fp_prob)
+        new_filter = ShiftingBloomFilterM(self.item_low_count, self.fp_prob, hash_strategy=self.hash_strategy)
         new_filter.bit_array = self.bit_array.copy()
         return new_filter
 
@@ -97,6 +192,8 @@ class ShiftingBloomFilterM(object):
         if self.size != other.size:
             # or self.fp_prob != other.fp.prob :
             raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
 
         new_filter = self.copy()
         new_filter.bit_array = new_filter.bit_array | other.bit_array
@@ -107,6 +204,8 @@ class ShiftingBloomFilterM(object):
         if self.size != other.size:
             # or self.fp_prob != other.fp.prob :
             raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
 
         new_filter = self.copy()
         new_filter.bit_array = new_filter.bit_array & other.bit_array
@@ -122,8 +221,59 @@ class ShiftingBloomFilterM(object):
     def get_bitarray_size(self):
         return self.bit_array.buffer_info()[4]
 
-    def o_function(self, item):
-        return mmh3.hash(item, self.hash_count) % (self.MAX_OFFSET + 1) - 1
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the bit array
+        '''
+        return self.bit_array.nbytes
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py)
+        '''
+        return memory_usage.build_report(self.nbytes, memory_usage.get_metadata_size(self, ("bit_array",)),
+                                         self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the bit array is a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"size": self.size, "hash_count": self.hash_count,
+                  "item_low_count": self.item_low_count, "count": self.count, "fp_prob": self.fp_prob,
+                  "hash_strategy": self.hash_strategy.name}
+        return fields, {"max_offset": self.MAX_OFFSET}, self.bit_array, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        if metadata["max_offset"] != cls.MAX_OFFSET:
+            raise ValueError("Filter was saved with a different MAX_OFFSET")
+        new_filter = cls.__new__(cls)
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.size = fields["size"]
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.bit_array = bitarray(buffer=payload, endian='big')
+        new_filter.count = fields["count"]
+        new_filter.fill_stats = new_filter.create_fill_stats()
+        return new_filter
+
+    def o_function(self, item_digest):
+        return next(self.hash_strategy.indexes(item_digest, self.hash_count + 1, self.MAX_OFFSET - 1,
+                                               start=self.hash_count)) + 1
         # formula = h-k/2+1(e) % (W -1) + 1
         # W is max offset value
 
@@ -1,22 +1,35 @@
 import math
-import mmh3
 import numpy as np
-from bitarray import bitarray
-"""
-This implementation is only for see optimal array location size for minimum memory usage case.
-But this approach is not memory efficient because bitarray uses at least 1 byte
 
+from bitOps import chunks
+from hashing import get_hash_strategy
+from memory_usage import memory_usage
+from packedCounters import CompactCounterArray
+from serialization import load_filter, save_filter
+"""
+Counting bloom filter with variable width counters.
+Most counters need 2 bits, so counters are 2 bits wide in one packed buffer
+and the few counters that reach 3 move to a small table of wide counters
+(see CompactCounterArray in packedCounters.py). Counters never saturate, so
+deletes stay exact, for about 3.3 to 3.8 bits per counter once items_count
+keys are added, against 4 for CountingBloomFilter with count_size 4.
 """
 
 
 class T_CountingBloomFilter(object):
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by add_many / contains_many
 
-    def __init__(self, items_count, fp_prob, count_size=8):
+    def __init__(self, items_count, fp_prob, count_size=8, hash_strategy=None):
         """
         items_count : int
             Number of items expected to be stored in bloom filter
         fp_prob : float
             False Positive probability in decimal
+        count_size : int
+            Unused, counters grow as needed
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
         """
         self.count_size = count_size
         self.item_low_count = items_count
@@ -35,104 +48,59 @@ class T_CountingBloomFilter(object):
         # slice size
         self.slice_size = self.size // self.hash_count
 
-        self.bit_array = []
-        for i in range(0, self.size):
-            self.bit_array.append(bitarray(2))
-            self.bit_array[i].setall(0)
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        # wide counter table sized for items_count keys, it grows past them
+        self.bit_array = CompactCounterArray(
+            self.size, capacity=CompactCounterArray.wide_capacity(self.size, items_count * self.hash_count))
 
         self.count = 0
 
     def set_value_bit(self, index, value):
 
-        temp = bitarray(('{0:0' + str(len(self.bit_array[index])) + 'b}').format(value))
-        if temp.length() == len(self.bit_array[index]):
-            for i in range(len(self.bit_array[index]) - 1, -1, -1):
-                self.bit_array[index][i] = temp[i]
-
-            # overflow on bit value
+        self.bit_array.set(index, value)
 
     def get_bit_value(self, index):
 
-        value = 0
-        for i in range(len(self.bit_array[index]) - 1, -1, -1):
-            if self.bit_array[index][i]:
-                value += 2 ** (len(self.bit_array[index]) - 1 - i)
-
-        return value
+        return self.bit_array.get(index)
 
     def check_bit(self, index):
 
-        return self.get_bit_value(index) > 0
-
-    def half_adder(self, bit_a, bit_b):
-        return (bit_a ^ bit_b), bit_a and bit_b
-
-    def full_adder(self, bit_a, bit_b, carry=0):
-        sum1, carry1 = self.half_adder(bit_a, bit_b)
-        sum2, carry2 = self.half_adder(sum1, carry)
-        return sum2, carry1 or carry2
-
-    def binary_bitarray_adder(self, value, index):
-        bits_b = bitarray(('{0:0' + str(len(self.bit_array[index])) + 'b}').format(value))
-        carry = False
-        for i in range(len(self.bit_array[index]) - 1, -1, -1):
-            summ, carry = self.full_adder(self.bit_array[index][i], bits_b[i], carry)
-            self.bit_array[index][i] = summ
-
-        if carry:
-            self.bit_array[index] = bitarray("01") + self.bit_array[index]
-        elif self.bit_array[index][0]:
-            self.bit_array[index] = bitarray("0") + self.bit_array[index]
-
-    def binary_bitarray_sub(self,  value, index):
-        carry = 1
-        bits_b = bitarray(('{0:0' + str(len(self.bit_array[index])) + 'b}').format(value))
-        bits_b = ~ bits_b
-
-        for i in range(len(self.bit_array[index]) - 1, -1, -1):
-            summ, carry = self.full_adder(self.bit_array[index][i], bits_b[i], carry)
-            self.bit_array[index][i] = summ
-
-        if len(self.bit_array[index]) > 2:
-            if not self.bit_array[index][1]:
-                self.bit_array[index] = self.bit_array[index][1:]
+        return self.bit_array.base.get(index) > 0
 
     def add(self, item):
         '''
         Add an item in the filter
         '''
-        """
-        if item in self:
-            return False
-        """
+        return self.add_digest(self.hash_strategy.digest(item))
+
+    def add_digest(self, item_digest):
+        '''
+        Add an item in the filter from its digest (see hashing.py)
+        '''
         if self.count > self.item_low_count:
             print("BloomFilter reached it's limit")
             return False
 
         start_point = 0
-        for i in range(self.hash_count):
-            # create digest for given item.
-            # i work as seed to mmh3.hash() function
-            # With different seed, digest created is different
-            digest = mmh3.hash(item, i) % self.slice_size
-
-
-            # set the bit True in int_array
-            self.binary_bitarray_adder(1, start_point + digest)
+        # every slice derives its index from the same digest
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+            self.bit_array.increment(start_point + digest)
             start_point += self.slice_size
         self.count += 1
         return True
 
     def delete(self, item):
 
-        if item in self:
+        return self.delete_digest(self.hash_strategy.digest(item))
 
-            start_point = 0
-            for i in range(self.hash_count):
-                digest = mmh3.hash(item, i) % self.slice_size
+    def delete_digest(self, item_digest):
 
-                self.binary_bitarray_sub(1,start_point + digest)
+        if self.contains_digest(item_digest):
 
+            start_point = 0
+            for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+                self.bit_array.decrement(start_point + digest)
                 start_point += self.slice_size
             self.count -= 1
             return True
@@ -142,53 +110,98 @@ class T_CountingBloomFilter(object):
         '''
         Check for existence of an item in filter
         '''
-        start_point = 0
-        for i in range(self.hash_count):
-            digest = mmh3.hash(item, i) % self.slice_size
+        return self.contains_digest(self.hash_strategy.digest(item))
 
-            if not self.check_bit(start_point + digest):
-                # if
+    def contains_digest(self, item_digest):
+        '''
+        Check for existence of an item in filter from its digest
+        '''
+        start_point = 0
+        for digest in self.hash_strategy.indexes(item_digest, self.hash_count, self.slice_size):
+            # a counter is not 0 iff its 2 bit base is not 0
+            if not self.bit_array.base.get(start_point + digest):
                 return False
             start_point += self.slice_size
         return True
 
+    def add_many(self, items):
+        '''
+        Add every item of the iterable in the filter
+        Returns the number of items added
+        '''
+        added = 0
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            remaining = self.item_low_count + 1 - self.count
+            if remaining <= 0:
+                print("BloomFilter reached it's limit")
+                break
+            if len(chunk) > remaining:
+                print("BloomFilter reached it's limit")
+                chunk = chunk[:remaining]
+            self.bit_array.increment_many(self.hash_many(chunk))
+            self.count += len(chunk)
+            added += len(chunk)
+        return added
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        results = [self.bit_array.nonzero_many(self.hash_many(chunk)).all(axis=1)
+                   for chunk in chunks(items, self.CHUNK_SIZE)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def hash_many(self, items):
+        '''
+        Return a (len(items), hash_count) array of counter positions
+        '''
+        digests = self.hash_strategy.digest_many(items, self.hash_count)
+        start_points = np.arange(self.hash_count, dtype=np.int64) * self.slice_size
+        return self.hash_strategy.indexes_many(digests, self.hash_count, self.slice_size) + start_points
+
     def __len__(self):
 
         return self.count
 
-    # TODO consider union and intersection operations can be useful and work correctly
-    #  for counting and scalable bloom filters
-
     def copy(self):
 
-        new_filter = T_CountingBloomFilter(self.item_low_count, self.fp_prob)
+        new_filter = T_CountingBloomFilter(self.item_low_count, self.fp_prob, hash_strategy=self.hash_strategy)
         new_filter.bit_array = self.bit_array.copy()
+        new_filter.count = self.count
         return new_filter
 
     def union(self, other):
 
-        if self.size != other.size:
-            # or self.fp_prob != other.fp.prob :
-            raise ValueError("Filters must have same size for union")
-
+        self.check_compatible(other)
         new_filter = self.copy()
-        for i in range(0, new_filter.size):
-            new_filter.bit_array[i] += other.bit_array[i]
+        new_filter.bit_array.assign(self.bit_array.values() + other.bit_array.values())
+        new_filter.count += other.count
         return new_filter
 
     def intersection(self, other):
 
-        if self.size != other.size:
-            # or self.fp_prob != other.fp.prob :
-            raise ValueError("Filters must have same size for union")
-
+        self.check_compatible(other)
         new_filter = self.copy()
-        for i in range(0, new_filter.size):
-            new_filter.bit_array[i] = min(new_filter.bit_array[i], other.bit_array[i])
+        new_filter.bit_array.assign(np.minimum(self.bit_array.values(), other.bit_array.values()))
         return new_filter
 
     def __sub__(self, other):
-        pass
+
+        self.check_compatible(other)
+        new_filter = self.copy()
+        new_filter.bit_array.assign(self.bit_array.values() - other.bit_array.values())
+        new_filter.count = max(self.count - other.count, 0)
+        return new_filter
+
+    def check_compatible(self, other):
+        if self.size != other.size:
+            # or self.fp_prob != other.fp.prob :
+            raise ValueError("Filters must have same size for union")
+        if self.hash_strategy.name != other.hash_strategy.name:
+            raise ValueError("Filters must use the same hash strategy")
 
     def __or__(self, other):
         return self.union(other)
@@ -196,15 +209,76 @@ class T_CountingBloomFilter(object):
     def __and__(self, other):
         return self.intersection(other)
 
-    """
-    def calculate_hashes(self, item):
-        hashes = []
-        start_point = 0
-        for i in range(0, self.hash_count):
-            hashes.append(start_point + (mmh3.hash(item, i) % self.slice_size))
-            start_point += self.slice_size
-        return hashes
-    """
+    def get_bitarray_size(self):
+        return self.bit_array.nbytes
+
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the base counters and of the wide counter table
+        '''
+        return self.bit_array.nbytes
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py, the dict of the counts of 258
+        and more is counted as metadata without its entries)
+        '''
+        metadata_bytes = (memory_usage.get_metadata_size(self, ("bit_array",)) + self.bit_array.base.metadata_nbytes +
+                          memory_usage.get_metadata_size(self.bit_array, ("base", "wide_keys", "wide_values",
+                                                                          "key_words", "value_words")))
+        return memory_usage.build_report(self.nbytes, metadata_bytes, self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the counters are a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        # the payload is the base counters followed by the wide table keys
+        # and values, each part 8 byte aligned
+        counters = self.bit_array
+        base_size = counters.base.nbytes + (-counters.base.nbytes % 8)
+        payload = bytearray(base_size + counters.wide_keys.nbytes)
+        payload[:counters.base.nbytes] = counters.base.buffer
+        payload[base_size:] = counters.wide_keys.tobytes()
+        payload += counters.wide_values.tobytes()
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.slice_size,
+                  "count_size": self.count_size, "item_low_count": self.item_low_count, "count": self.count,
+                  "fp_prob": self.fp_prob, "hash_strategy": self.hash_strategy.name}
+        metadata = {"capacity": len(counters.wide_keys), "used": counters.used,
+                    "large": [[index, value] for index, value in counters.large.items()]}
+        return fields, metadata, payload, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = cls.__new__(cls)
+        new_filter.count_size = fields["count_size"]
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.size = fields["size"]
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.slice_size = fields["slice_size"]
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        base_nbytes = (new_filter.size * 2 + 7) // 8
+        base_size = base_nbytes + (-base_nbytes % 8)
+        capacity = metadata["capacity"]
+        keys = np.frombuffer(payload[base_size:base_size + 4 * capacity], dtype=np.uint32)
+        values = np.frombuffer(payload[base_size + 4 * capacity:base_size + 5 * capacity], dtype=np.uint8)
+        new_filter.bit_array = CompactCounterArray(new_filter.size, payload[:base_nbytes], keys, values,
+                                                   metadata["used"], dict(metadata["large"]))
+        new_filter.count = fields["count"]
+        return new_filter
 
     @classmethod
     def get_size(self, n, p):
@@ -232,4 +306,4 @@ class T_CountingBloomFilter(object):
             number of items expected to be stored in filter
         '''
         k = (m / n) * math.log(2)
-        return int(k)
\ No newline at end of file
+        return int(k)
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from blockedBloomFilter import BlockedBloomFilter
+from bloomFilter import BloomFilter
+from concurrentFilters import ConcurrentBloomFilter, ConcurrentCountingBloomFilter
+from countMinSketch import CountMinSketch
+from countingBloomFilter import CountingBloomFilter
+from cuckooFilter import CuckooFilter
+from rotatingBloomFilter import RotatingBloomFilter
+from shiftingBloomFilter import ShiftingBloomFilterM
+from t_CountingBloomFilter import T_CountingBloomFilter
+from xorFilter import XorFilter
+
+FILTERS = {
+    "bloom": lambda strategy: BloomFilter(3000, 0.01, hash_strategy=strategy),
+    "counting": lambda strategy: CountingBloomFilter(3000, 0.01, count_size=4, hash_strategy=strategy),
+    "counting_3": lambda strategy: CountingBloomFilter(3000, 0.01, count_size=3, hash_strategy=strategy),
+    "counting_overflow": lambda strategy: CountingBloomFilter(3000, 0.01, count_size=2, hash_strategy=strategy,
+                                                              overflow=True),
+    "shifting": lambda strategy: ShiftingBloomFilterM(3000, 0.01, hash_strategy=strategy),
+    "blocked": lambda strategy: BlockedBloomFilter(3000, 0.01, hash_strategy=strategy),
+    "rotating": lambda strategy: RotatingBloomFilter(3000, 0.01, hash_strategy=strategy),
+    "t_counting": lambda strategy: T_CountingBloomFilter(3000, 0.01, hash_strategy=strategy),
+    "cuckoo": lambda strategy: CuckooFilter(3000, 0.01, hash_strategy=strategy),
+    "concurrent": lambda strategy: ConcurrentBloomFilter(3000, 0.01, hash_strategy=strategy),
+    "concurrent_counting": lambda strategy: ConcurrentCountingBloomFilter(3000, 0.01, hash_strategy=strategy),
+}
+# filters that do not count a key they already report present, a batch only
+# checks the keys against the filter as it was before the batch
+DEDUPLICATING = {"rotating", "shifting"}
+
+KEY_SETS = {
+    "str": lambda: ["key" + str(i) for i in range(2000)],
+    "bytes": lambda: [b"key" + str(i).encode() for i in range(2000)],
+    "int": lambda: list(range(-1000, 1000)),
+    "numpy": lambda: np.arange(10 ** 12, 10 ** 12 + 2000, dtype=np.int64),
+}
+
+
+def probes(keys):
+    # half added keys, half absent keys of the same type
+    if isinstance(keys, np.ndarray):
+        return np.concatenate([keys[::2], keys + 5000])
+    if isinstance(keys[0], int):
+        return keys[::2] + [key + 5000 for key in keys]
+    return keys[::2] + [key + key[:1] * 2 for key in keys]
+
+
+@pytest.mark.parametrize("strategy", ["double", "seeded"])
+@pytest.mark.parametrize("keys", sorted(KEY_SETS))
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_scalar_and_batch_paths_agree(name, keys, strategy):
+    items = KEY_SETS[keys]()
+    batch = FILTERS[name](strategy)
+    scalar = FILTERS[name](strategy)
+    batch.add_many(items)
+    for item in items:
+        scalar.add(item)
+    if name in DEDUPLICATING:
+        assert len(scalar) <= len(batch) <= len(scalar) + len(items) // 100
+    else:
+        assert len(batch) == len(scalar) == len(items)
+    others = probes(items)
+    found = batch.contains_many(others)
+    assert found.dtype == bool
+    assert found.tolist() == [item in batch for item in others]
+    if name != "cuckoo":
+        # a cuckoo filter places keys in different slots depending on the order of the kicks
+        assert found.tolist() == scalar.contains_many(others).tolist()
+    assert found[:len(items[::2])].all()
+
+
+@pytest.mark.parametrize("keys", sorted(KEY_SETS))
+def test_xor_filter_scalar_and_batch_lookups_agree(keys):
+    items = KEY_SETS[keys]()
+    xor_filter = XorFilter.from_keys(items, 0.01)
+    others = probes(items)
+    found = xor_filter.contains_many(others)
+    assert found.tolist() == [item in xor_filter for item in others]
+    assert found[:len(items[::2])].all()
+
+
+@pytest.mark.parametrize("conservative", [False, True])
+@pytest.mark.parametrize("keys", sorted(KEY_SETS))
+def test_count_min_sketch_scalar_and_batch_updates_agree(keys, conservative):
+    items = KEY_SETS[keys]()
+    repeated = np.concatenate([items, items[:100]]) if isinstance(items, np.ndarray) else items + items[:100]
+    batch = CountMinSketch(0.01, 0.01, conservative=conservative)
+    scalar = CountMinSketch(0.01, 0.01, conservative=conservative)
+    batch.update_many(repeated)
+    for item in repeated:
+        scalar.add(item)
+    assert len(batch) == len(scalar) == len(repeated)
+    others = probes(items)
+    estimates = batch.estimate_many(others)
+    assert estimates.tolist() == [batch.estimate_count(item) for item in others]
+    if not conservative:
+        # counter updates commute, conservative batches raise counters in one step
+        assert estimates.tolist() == scalar.estimate_many(others).tolist()
+    assert (estimates[:len(items[::2])] >= 1).all()
+    assert (batch.estimate_many(items[:100]) >= 2).all()
+
+
+def test_empty_batches():
+    for name in sorted(FILTERS):
+        bloom_filter = FILTERS[name]("double")
+        bloom_filter.add_many([])
+        assert len(bloom_filter.contains_many([])) == 0
@@ -0,0 +1,16 @@
+import numpy as np
+
+from blockedBloomFilter import BlockedBloomFilter
+
+
+def test_probes_of_a_key_are_distinct():
+    bloom_filter = BlockedBloomFilter(20000, 0.01)
+    keys = [str(i) for i in range(20000)]
+    digests = bloom_filter.hash_strategy.digest_many(keys)
+    # keys whose h2 is a multiple of BLOCK_PRIME used to probe a single bit
+    assert (digests[:, 1] % np.uint64(BlockedBloomFilter.BLOCK_PRIME) == 0).any()
+    positions = bloom_filter.hash_many(keys)
+    assert all(len(set(row)) == bloom_filter.hash_count for row in positions.tolist())
+    for key, row in zip(keys[:1000], positions[:1000].tolist()):
+        digest = bloom_filter.hash_strategy.digest(key)
+        assert [position % BlockedBloomFilter.BLOCK_BITS for position in row] == bloom_filter.block_indexes(digest)
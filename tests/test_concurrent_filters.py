@@ -0,0 +1,76 @@
+import sys
+import threading
+
+import numpy as np
+
+from concurrentFilters import ConcurrentBloomFilter, ConcurrentCountingBloomFilter
+from fillStats import FillStats
+
+
+def test_concurrent_deletes_of_one_item_delete_it_once():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for overflow in (False, True):
+            bloom_filter = ConcurrentCountingBloomFilter(1000, 0.01, overflow=overflow)
+            for round_index in range(200):
+                key = "key" + str(round_index)
+                bloom_filter.add(key)
+                barrier = threading.Barrier(8)
+                results = []
+
+                def delete():
+                    barrier.wait()
+                    results.append(bloom_filter.delete(key))
+
+                threads = [threading.Thread(target=delete) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                assert results.count(True) == 1
+                assert not np.asarray(bloom_filter.bit_array.values()).any()
+                assert bloom_filter.count == 0
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def test_mark_during_a_refresh_is_not_lost():
+    fill_stats = FillStats(4 * FillStats.BLOCK_SIZE, 2)
+    positions = set()
+
+    def count_range(start, stop):
+        if start > 0 and not positions:
+            # a writer sets a position of a block counted earlier in this refresh
+            positions.add(3)
+            fill_stats.mark(3)
+        return sum(start <= position < stop for position in positions)
+
+    assert fill_stats.slice_counts(count_range).tolist() == [0, 0]
+    assert fill_stats.slice_counts(count_range).tolist() == [1, 0]
+
+
+def test_derived_filters_stay_concurrent():
+    keys = [str(i) for i in range(500)]
+    for first in (ConcurrentBloomFilter(1000, 0.01, stripes=16),
+                  ConcurrentCountingBloomFilter(1000, 0.01, overflow=True, stripes=16)):
+        second = first.copy()
+        first.add_many(keys[:300])
+        second.add_many(keys[200:])
+        derived = [first.copy(), first | second, first & second]
+        if isinstance(first, ConcurrentCountingBloomFilter):
+            derived.append(first - second)
+        for new_filter in derived:
+            assert type(new_filter) is type(first)
+            assert len(new_filter.stripe_locks.locks) == 16
+            assert new_filter.count_lock is not first.count_lock
+        assert derived[0].contains_many(keys[:300]).all()
+        assert derived[1].contains_many(keys).all()
+        assert derived[2].contains_many(keys[200:300]).all()
+        # a derived filter takes concurrent writes
+        threads = [threading.Thread(target=derived[1].add_many, args=(keys[i::4],)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert derived[1].contains_many(keys).all()
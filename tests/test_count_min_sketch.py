@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from countMinSketch import CountMinSketch
+
+
+def zipf_stream(size, seed=0):
+    return np.random.default_rng(seed).zipf(1.3, size) % 50000
+
+
+@pytest.mark.parametrize("conservative", [False, True])
+def test_estimates_stay_within_the_error_bound(conservative):
+    stream = zipf_stream(200000)
+    sketch = CountMinSketch(0.001, 0.01, conservative=conservative)
+    sketch.update_many(stream)
+    keys, counts = np.unique(stream, return_counts=True)
+    estimates = sketch.estimate_many(keys)
+    # never underestimates, overestimates by more than epsilon * N with probability delta
+    assert (estimates >= counts).all()
+    assert ((estimates - counts) > sketch.epsilon * len(stream)).mean() <= sketch.delta
+    # the same bound holds for absent keys, whose count is 0
+    absent = sketch.estimate_many(np.arange(10 ** 9, 10 ** 9 + 10000))
+    assert (absent > sketch.epsilon * len(stream)).mean() <= sketch.delta
+
+
+def test_conservative_update_overestimates_less():
+    stream = zipf_stream(100000)
+    keys, counts = np.unique(stream, return_counts=True)
+    errors = []
+    for conservative in (False, True):
+        sketch = CountMinSketch(0.005, 0.01, conservative=conservative)
+        sketch.update_many(stream)
+        errors.append(int((sketch.estimate_many(keys) - counts).sum()))
+    assert errors[1] < errors[0]
+
+
+def test_weighted_updates():
+    sketch = CountMinSketch(0.01, 0.01)
+    assert sketch.add("a", 5) == 5
+    sketch.update_many(["a", "b", "c"], counts=[2, 3, 4])
+    assert sketch["a"] == 7
+    assert sketch.estimate_many(["b", "c"]).tolist() == [3, 4]
+    assert len(sketch) == 14
+    assert "b" in sketch and "d" not in sketch
+    with pytest.raises(ValueError):
+        sketch.update_many(["a", "b"], counts=[1])
+
+
+def test_counters_saturate():
+    sketch = CountMinSketch(0.01, 0.01, count_size=16)
+    sketch.add("a", 70000)
+    sketch.update_many(["a"], counts=[10])
+    assert sketch["a"] == (1 << 16) - 1
+    with pytest.raises(ValueError):
+        CountMinSketch(0.01, 0.01, count_size=8)
+
+
+def test_merge_adds_the_streams():
+    first, second = zipf_stream(50000, 1), zipf_stream(50000, 2)
+    merged = CountMinSketch(0.001, 0.01, top_k=10)
+    merged.update_many(first)
+    other = CountMinSketch(0.001, 0.01, top_k=10)
+    other.update_many(second)
+    whole = CountMinSketch(0.001, 0.01, top_k=10)
+    whole.update_many(np.concatenate([first, second]))
+    result = merged | other
+    assert len(result) == len(whole)
+    keys = np.unique(np.concatenate([first, second]))
+    assert np.array_equal(result.estimate_many(keys), whole.estimate_many(keys))
+    assert result.top() == whole.top()
+    with pytest.raises(ValueError):
+        merged | CountMinSketch(0.01, 0.01)
+
+
+def test_top_k_finds_the_heavy_hitters():
+    stream = zipf_stream(200000)
+    sketch = CountMinSketch(0.001, 0.01, top_k=5)
+    for chunk in np.array_split(stream, 20):
+        sketch.update_many(chunk)
+    keys, counts = np.unique(stream, return_counts=True)
+    expected = keys[np.argsort(-counts)[:5]].tolist()
+    top = sketch.top()
+    assert [item for item, _ in top] == expected
+    assert [estimate for _, estimate in top] == sorted((estimate for _, estimate in top), reverse=True)
+    assert len(sketch.candidates) < 2 * sketch.top_k
@@ -0,0 +1,65 @@
+import operator
+
+import numpy as np
+import pytest
+
+from countingBloomFilter import CountingBloomFilter
+
+
+def overflow_filter(keys):
+    counting_filter = CountingBloomFilter(1000, 0.01, count_size=4, overflow=True)
+    counting_filter.add_many(keys)
+    return counting_filter
+
+
+@pytest.mark.parametrize("operation", [operator.or_, operator.and_, operator.sub])
+def test_combine_recomputes_overflow_count(operation):
+    keys = [str(i) for i in range(50)] * 20
+    first = overflow_filter(keys)
+    second = overflow_filter(keys[:500] + [str(i) for i in range(50, 100)])
+    counting_filter = first.copy()
+    if operation is operator.or_:
+        counting_filter |= second
+    elif operation is operator.and_:
+        counting_filter &= second
+    else:
+        counting_filter -= second
+    assert counting_filter.overflow_count == sum(value - counting_filter.max_value
+                                                 for value in counting_filter.overflow.values())
+
+
+def test_union_with_itself_doubles_overflow():
+    counting_filter = overflow_filter([str(i) for i in range(50)] * 20)
+    counts = counting_filter.get_counts()
+    union = counting_filter | counting_filter
+    assert np.array_equal(union.get_counts(), 2 * counts)
+    assert union.overflow_count == int(np.maximum(2 * counts - union.max_value, 0).sum())
+    assert union.overflow_count > counting_filter.overflow_count
+
+
+@pytest.mark.parametrize("count_size, overflow", [(4, False), (3, False), (8, False), (2, True)])
+def test_deletes_leave_no_false_negatives(count_size, overflow):
+    counting_filter = CountingBloomFilter(2000, 0.01, count_size=count_size, overflow=overflow)
+    keys = [str(i) for i in range(2000)]
+    counting_filter.add_many(keys)
+    for key in keys[:1000]:
+        assert counting_filter.delete(key)
+    assert len(counting_filter) == 1000
+    assert counting_filter.contains_many(keys[1000:]).all()
+    assert counting_filter.contains_many(keys[:1000]).mean() < 0.02
+    for key in keys[1000:]:
+        assert counting_filter.delete(key)
+    assert not counting_filter.get_counts().any()
+    assert not counting_filter.delete("absent")
+
+
+def test_overflow_keeps_deletes_exact():
+    counting_filter = CountingBloomFilter(100, 0.01, count_size=2, overflow=True)
+    counting_filter.add_many(["hot"] * 10 + ["cold"])
+    assert counting_filter.estimate_count("hot") == 10
+    assert counting_filter.overflow_count > 0
+    for _ in range(10):
+        assert counting_filter.delete("hot")
+    assert "cold" in counting_filter
+    assert counting_filter.estimate_count("cold") == 1
+    assert not counting_filter.overflow
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from countingBloomFilter import CountingBloomFilter
+from cuckooFilter import CuckooFilter
+
+
+@pytest.mark.parametrize("items_count, fp_prob", [(100000, 0.01), (1000000, 0.001), (1000, 0.01)])
+def test_fingerprints_are_packed(items_count, fp_prob):
+    cuckoo_filter = CuckooFilter(items_count, fp_prob)
+    reference = CountingBloomFilter(items_count, fp_prob, count_size=4)
+    # about fingerprint_bits / 0.95 bits per key, whatever the slot width
+    assert cuckoo_filter.nbytes * 8 / items_count < cuckoo_filter.fingerprint_bits / 0.95 + 0.5
+    assert cuckoo_filter.nbytes < reference.nbytes / 3
+
+
+def test_alt_index_is_an_involution_for_any_bucket_count():
+    cuckoo_filter = CuckooFilter(1000, 0.01)
+    assert cuckoo_filter.bucket_count & (cuckoo_filter.bucket_count - 1)
+    indexes = np.arange(cuckoo_filter.bucket_count).repeat(20)
+    fingerprints = np.arange(1, len(indexes) + 1, dtype=np.uint64) & np.uint64(cuckoo_filter.fingerprint_mask)
+    fingerprints[fingerprints == 0] = 1
+    alt_indexes = cuckoo_filter.alt_index_many(indexes, fingerprints)
+    assert ((alt_indexes >= 0) & (alt_indexes < cuckoo_filter.bucket_count)).all()
+    assert np.array_equal(cuckoo_filter.alt_index_many(alt_indexes, fingerprints), indexes)
+    assert [cuckoo_filter.alt_index(index, fingerprint) for index, fingerprint in
+            zip(indexes[:500].tolist(), fingerprints[:500].tolist())] == alt_indexes[:500].tolist()
+
+
+def test_scalar_and_batch_paths_agree():
+    keys = [str(i) for i in range(20000)]
+    batch = CuckooFilter(20000, 0.01)
+    batch.add_many(keys)
+    scalar = CuckooFilter(20000, 0.01)
+    for key in keys:
+        scalar.add(key)
+    assert batch.contains_many(keys).all()
+    assert all(key in scalar for key in keys)
+    others = ["x" + str(i) for i in range(20000)]
+    for cuckoo_filter in (batch, scalar):
+        found = cuckoo_filter.contains_many(others)
+        assert found.tolist() == [key in cuckoo_filter for key in others]
+        assert found.mean() < 0.02
+
+
+def test_full_filter_loses_no_fingerprint():
+    cuckoo_filter = CuckooFilter(10000, 0.01)
+    added = cuckoo_filter.add_many(np.arange(30000))
+    assert added >= 10000
+    assert cuckoo_filter.victim is not None
+    occupied = np.count_nonzero(cuckoo_filter.read_buckets(np.arange(cuckoo_filter.bucket_count)))
+    assert occupied + 1 == cuckoo_filter.count == added
+    assert cuckoo_filter.contains_many(np.arange(30000)).sum() >= added
+
+
+def test_older_layout_is_rejected(tmp_path):
+    cuckoo_filter = CuckooFilter(1000, 0.01)
+    cuckoo_filter.add_many(range(500))
+    fields, metadata, payload, children = cuckoo_filter.file_record()
+    loaded = CuckooFilter.from_file_record(fields, metadata, memoryview(bytearray(payload)), children)
+    assert loaded.contains_many(range(500)).all()
+    del metadata["layout"]
+    with pytest.raises(ValueError):
+        CuckooFilter.from_file_record(fields, metadata, payload, children)
@@ -0,0 +1,93 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from bloomFilter import BloomFilter
+from cuckooFilter import CuckooFilter
+from filterClient import encode_keys
+from filterServer import KEYS_BYTES, KEYS_INT, OP_ADD, RESPONSE, STATUS_OK, FilterService
+from shiftingBloomFilter import ShiftingBloomFilterM
+
+
+class Transport(object):
+    def __init__(self):
+        self.data = bytearray()
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.data += data
+
+
+def add_counts(bloom_filter, requests):
+    '''
+    Submit the add requests to one service so they share a batch, returns
+    the batch count and the (status, count) of every response by request id
+    '''
+    async def run():
+        service = FilterService("test", bloom_filter, window=1)
+        transport = Transport()
+        for request_id, keys in enumerate(requests):
+            service.submit(transport, request_id, OP_ADD, KEYS_BYTES, keys)
+        service.flush()
+        return service.batches, transport.data
+
+    batches, data = asyncio.run(run())
+    responses = {}
+    for offset in range(0, len(data), RESPONSE.size):
+        _, request_id, status, count = RESPONSE.unpack_from(data, offset)
+        responses[request_id] = (status, count)
+    return batches, [responses[request_id] for request_id in range(len(requests))]
+
+
+def test_coalesced_adds_count_keys_already_present():
+    bloom_filter = ShiftingBloomFilterM(1000, 0.01)
+    bloom_filter.add_many([b"a", b"b"])
+    batches, responses = add_counts(bloom_filter, [[b"a", b"b"], [b"c", b"d"]])
+    assert batches == 1
+    assert responses == [(STATUS_OK, 0), (STATUS_OK, 2)]
+
+
+def test_coalesced_adds_count_a_repeated_key_once():
+    bloom_filter = BloomFilter(1000, 0.01)
+    batches, responses = add_counts(bloom_filter, [[b"a", b"b"], [b"b", b"c"], [b"a"]])
+    assert batches == 1
+    assert responses == [(STATUS_OK, 2), (STATUS_OK, 1), (STATUS_OK, 0)]
+    assert bloom_filter.contains_many([b"a", b"b", b"c"]).all()
+
+
+def test_coalesced_adds_into_a_full_cuckoo_filter():
+    bloom_filter = CuckooFilter(64, 0.01)
+    first = [str(i).encode() for i in range(4 * bloom_filter.size)]
+    batches, responses = add_counts(bloom_filter, [first, [b"last"]])
+    assert batches == 1
+    assert bloom_filter.victim is not None
+    # keys refused by the full filter are not counted
+    assert responses == [(STATUS_OK, int(bloom_filter.contains_many(first).sum())),
+                         (STATUS_OK, int(b"last" in bloom_filter))]
+    assert responses[0][1] < len(first)
+
+
+def test_window_of_a_millisecond_uses_a_timer():
+    async def run():
+        service = FilterService("test", BloomFilter(1000, 0.01), window=0.005)
+        transport = Transport()
+        service.submit(transport, 0, OP_ADD, KEYS_BYTES, [b"a"])
+        timer = service.timer
+        await asyncio.sleep(0.05)
+        return timer, service.batches, transport.data
+
+    timer, batches, data = asyncio.run(run())
+    assert isinstance(timer, asyncio.TimerHandle)
+    assert batches == 1
+    assert RESPONSE.unpack_from(data)[2:] == (STATUS_OK, 1)
+
+
+def test_client_rejects_mixed_integer_and_str_keys():
+    assert encode_keys([1, 2])[0] == KEYS_INT
+    assert encode_keys(["a", b"b"])[0] == KEYS_BYTES
+    for keys in ([1, "a"], ["a", 1], [b"a", np.int64(1)]):
+        with pytest.raises(ValueError):
+            encode_keys(keys)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from bloomFilter import BloomFilter
+from countingBloomFilter import CountingBloomFilter
+from scalableBloomFilter import ScalableBloomFilter
+from shiftingBloomFilter import ShiftingBloomFilterM
+
+FILTERS = {
+    "bloom": lambda: BloomFilter(20000, 0.01),
+    "counting": lambda: CountingBloomFilter(20000, 0.01, count_size=4),
+    "counting_3": lambda: CountingBloomFilter(20000, 0.01, count_size=3),
+    "shifting": lambda: ShiftingBloomFilterM(20000, 0.01),
+}
+
+PROBES = np.arange(10 ** 9, 10 ** 9 + 100000)
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_stats_follow_the_contents(name):
+    bloom_filter = FILTERS[name]()
+    empty = bloom_filter.stats()
+    assert empty["set_positions"] == 0
+    assert empty["estimated_items"] == 0
+    bloom_filter.add_many(np.arange(10000))
+    stats = bloom_filter.stats()
+    assert stats["count"] == 10000
+    assert stats["fill_ratio"] == stats["set_positions"] / stats["size"]
+    assert stats["estimated_items"] == pytest.approx(10000, rel=0.05)
+    # the shifting filter sets pairs of nearby bits, its estimate is an upper bound
+    measured = bloom_filter.contains_many(PROBES).mean()
+    assert measured * 0.75 < stats["fp_prob"] < measured * (1.5 if name == "shifting" else 1.25)
+    assert len(stats["slice_fill"]) == bloom_filter.hash_count
+    assert stats["slice_imbalance"] < 1.1
+    # the cache is refreshed by scalar and batch adds
+    bloom_filter.add_many(np.arange(10000, 15000))
+    for key in range(15000, 20000):
+        bloom_filter.add(key)
+    stats = bloom_filter.stats()
+    # the shifting filter does not count keys it reports present
+    assert stats["count"] == len(bloom_filter) > 19900
+    assert stats["estimated_items"] == pytest.approx(20000, rel=0.05)
+    assert stats["fp_prob"] < 0.015
+
+
+@pytest.mark.parametrize("name", ["counting", "counting_3"])
+def test_stats_follow_deletes(name):
+    bloom_filter = FILTERS[name]()
+    bloom_filter.add_many(np.arange(10000))
+    full = bloom_filter.stats()
+    for key in range(5000):
+        bloom_filter.delete(key)
+    stats = bloom_filter.stats()
+    assert stats["count"] == 5000
+    assert stats["set_positions"] < full["set_positions"]
+    assert stats["estimated_items"] == pytest.approx(5000, rel=0.05)
+
+
+def test_scalable_stats_combine_the_layers():
+    scalable_filter = ScalableBloomFilter(1000, 0.01)
+    for key in range(10000):
+        scalable_filter.add(key)
+    stats = scalable_filter.stats()
+    assert len(stats["layers"]) == len(scalable_filter.bloom_filters)
+    assert stats["count"] == sum(layer.count for layer in scalable_filter.bloom_filters)
+    assert stats["estimated_items"] == pytest.approx(10000, rel=0.05)
+    assert stats["fp_prob"] < 0.01
+    assert stats["fp_prob"] == pytest.approx(1 - np.prod([1 - layer["fp_prob"] for layer in stats["layers"]]))
+
+
+@pytest.mark.parametrize("shared", [0, 2000, 5000, 10000])
+def test_union_intersection_and_jaccard_estimates(shared):
+    first = BloomFilter(20000, 0.01)
+    second = BloomFilter(20000, 0.01)
+    first.add_many(np.arange(10000))
+    second.add_many(np.arange(10000 - shared, 20000 - shared))
+    union = 20000 - shared
+    assert first.estimate_union_size(second) == pytest.approx(union, rel=0.05)
+    assert first.estimate_intersection_size(second) == pytest.approx(shared, abs=0.05 * union)
+    assert first.jaccard(second) == pytest.approx(shared / union, abs=0.03)
+    # the union estimate matches the stats of the union filter
+    assert first.estimate_union_size(second) == pytest.approx((first | second).stats()["estimated_items"])
+
+
+def test_compare_many_matches_pairwise_estimates():
+    base = BloomFilter(20000, 0.01)
+    base.add_many(np.arange(10000))
+    others = []
+    for shift in (0, 2500, 5000, 20000):
+        other = BloomFilter(20000, 0.01)
+        other.add_many(np.arange(shift, shift + 10000))
+        others.append(other)
+    results = base.compare_many(others)
+    assert results["jaccard"].tolist() == [base.jaccard(other) for other in others]
+    assert results["jaccard"][0] == pytest.approx(1, abs=0.01)
+    assert results["jaccard"][3] == pytest.approx(0, abs=0.01)
+    assert list(results["jaccard"]) == sorted(results["jaccard"], reverse=True)
+    with pytest.raises(ValueError):
+        base.compare_many([BloomFilter(100, 0.01)])
+    with pytest.raises(ValueError):
+        base.jaccard(BloomFilter(20000, 0.01, hash_strategy="seeded"))
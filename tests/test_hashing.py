@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from bloomFilter import BloomFilter
+from countingBloomFilter import CountingBloomFilter
+from hashing import HASH_STRATEGIES, get_hash_strategy
+from shiftingBloomFilter import ShiftingBloomFilterM
+
+KEY_SETS = {
+    "str": [str(i) for i in range(2000)],
+    "bytes": [str(i).encode() for i in range(2000)],
+    "int": list(range(-1000, 1000)),
+    "numpy": np.arange(-1000, 1000, dtype=np.int64),
+}
+
+
+@pytest.mark.parametrize("strategy", sorted(HASH_STRATEGIES))
+@pytest.mark.parametrize("keys", sorted(KEY_SETS))
+def test_scalar_and_batch_indexes_agree(strategy, keys):
+    hash_strategy = get_hash_strategy(strategy)
+    items = KEY_SETS[keys]
+    hash_count, slice_size = 7, 9587
+    indexes = hash_strategy.indexes_many(hash_strategy.digest_many(items, hash_count), hash_count, slice_size)
+    assert indexes.shape == (len(items), hash_count)
+    assert ((indexes >= 0) & (indexes < slice_size)).all()
+    expected = [list(hash_strategy.indexes(hash_strategy.digest(item), hash_count, slice_size)) for item in items]
+    assert indexes.tolist() == expected
+    # a lookup resumed at start gives the rest of the indexes
+    resumed = hash_strategy.indexes_many(hash_strategy.digest_many(items, hash_count), hash_count, slice_size, 3)
+    assert resumed.tolist() == [row[3:] for row in expected]
+
+
+@pytest.mark.parametrize("strategy", sorted(HASH_STRATEGIES))
+def test_equivalent_keys_have_the_same_indexes(strategy):
+    hash_strategy = get_hash_strategy(strategy)
+
+    def indexes(item):
+        return list(hash_strategy.indexes(hash_strategy.digest(item), 5, 1009))
+
+    assert indexes("key") == indexes(b"key")
+    assert indexes(42) == indexes(np.int64(42)) == indexes(np.uint8(42))
+    assert indexes(-1) == indexes(np.uint64(2 ** 64 - 1))
+    # an integer and its decimal string are different keys
+    assert indexes(42) != indexes("42")
+    mixed = [42, "42", b"key", np.int64(-1)]
+    batch = hash_strategy.indexes_many(hash_strategy.digest_many(mixed, 5), 5, 1009)
+    assert batch.tolist() == [indexes(item) for item in mixed]
+
+
+@pytest.mark.parametrize("filter_class", [BloomFilter, CountingBloomFilter, ShiftingBloomFilterM])
+@pytest.mark.parametrize("keys", sorted(KEY_SETS))
+def test_seeded_and_double_strategies_behave_alike(filter_class, keys):
+    items = KEY_SETS[keys]
+    others = ["other" + str(i) for i in range(20000)]
+    rates = []
+    for strategy in sorted(HASH_STRATEGIES):
+        bloom_filter = filter_class(len(items), 0.01, hash_strategy=strategy)
+        assert bloom_filter.hash_strategy.name == strategy
+        bloom_filter.add_many(items)
+        assert bloom_filter.contains_many(items).all()
+        rates.append(bloom_filter.contains_many(others).mean())
+    # both strategies meet the fp target of the same layout
+    assert max(rates) < 0.02
+    assert abs(rates[0] - rates[1]) < 0.01
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        get_hash_strategy("md5")
+    hash_strategy = get_hash_strategy("seeded")
+    assert get_hash_strategy(hash_strategy) is hash_strategy
+
+
+@pytest.mark.parametrize("strategy", sorted(HASH_STRATEGIES))
+def test_small_slices_have_no_false_positive_floor(strategy):
+    # 13 slices of 148 counters, reduced digests would give keys the same
+    # indexes with probability 1 / 148^2, far above fp_prob
+    bloom_filter = BloomFilter(100, 0.0001, hash_strategy=strategy)
+    assert bloom_filter.slice_size < 200
+    bloom_filter.add_many(np.arange(100))
+    assert bloom_filter.contains_many(np.arange(10 ** 9, 10 ** 9 + 200000)).mean() < 0.0005
+    hash_strategy = bloom_filter.hash_strategy
+    indexes = hash_strategy.indexes_many(hash_strategy.digest_many(np.arange(200000), bloom_filter.hash_count),
+                                         bloom_filter.hash_count, bloom_filter.slice_size)
+    assert len(np.unique(indexes, axis=0)) == len(indexes)
+
+
+def test_files_with_the_older_double_layout_are_rejected(tmp_path):
+    path = str(tmp_path / "filter.bf")
+    for strategy in sorted(HASH_STRATEGIES):
+        BloomFilter(100, 0.01, hash_strategy=strategy).save(path)
+        with open(path, "r+b") as f:
+            # version field of the header
+            f.seek(4)
+            f.write((1).to_bytes(2, "little"))
+        if strategy == "double":
+            with pytest.raises(ValueError):
+                BloomFilter.load(path)
+        else:
+            assert BloomFilter.load(path).hash_strategy.name == strategy
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from countingBloomFilter import CountingBloomFilter
+from packedCounters import PackedCounterArray, clamped_subtract, minimum, saturating_add
+
+OPERATIONS = {
+    "add": (saturating_add, lambda a, b, max_value: np.minimum(a + b, max_value)),
+    "minimum": (minimum, lambda a, b, max_value: np.minimum(a, b)),
+    "subtract": (clamped_subtract, lambda a, b, max_value: np.maximum(a - b, 0)),
+}
+
+
+def random_counters(size, count_size, seed):
+    counters = PackedCounterArray(size, count_size)
+    values = np.random.default_rng(seed).integers(0, counters.max_value + 1, size)
+    counters.assign(values)
+    return counters, values
+
+
+@pytest.mark.parametrize("count_size", PackedCounterArray.COUNT_SIZES)
+def test_scalar_and_batch_access_agree(count_size):
+    counters, values = random_counters(1001, count_size, 1)
+    assert counters.nbytes == (1001 * count_size + 7) // 8
+    assert np.array_equal(counters.values(), values)
+    assert [counters.get(index) for index in range(0, 1001, 7)] == values[::7].tolist()
+    indexes = np.arange(3, 1001, 5)
+    assert np.array_equal(counters.get_many(indexes), values[indexes])
+    counters.set_many(indexes, values[indexes] // 2)
+    values[indexes] //= 2
+    assert np.array_equal(counters.values(), values)
+    assert counters.count_nonzero(10, 900) == np.count_nonzero(values[10:900])
+
+
+@pytest.mark.parametrize("count_size", PackedCounterArray.COUNT_SIZES)
+def test_counters_saturate_and_clamp(count_size):
+    counters = PackedCounterArray(10, count_size)
+    max_value = counters.max_value
+    assert counters.increment(3, max_value) == max_value
+    assert counters.increment(3) == max_value
+    assert counters.get(2) == counters.get(4) == 0
+    assert counters.decrement(5, 2) == 0
+    counters.set(6, max_value + 10)
+    assert counters.get(6) == max_value
+    counters.set_many(np.array([7, 8]), np.array([max_value + 1, -1]))
+    assert counters.get_many([7, 8]).tolist() == [max_value, 0]
+    # repeated indexes of a batch add up and saturate
+    counters.increment_many(np.full(3, 9))
+    assert counters.get(9) == min(3, max_value)
+    counters.decrement_many(np.full(5, 9))
+    assert counters.get(9) == 0
+    assert counters.values().tolist() == [0, 0, 0, max_value, 0, 0, max_value, max_value, 0, 0]
+
+
+@pytest.mark.parametrize("count_size", PackedCounterArray.COUNT_SIZES)
+@pytest.mark.parametrize("operation", sorted(OPERATIONS))
+def test_combine_matches_numpy(count_size, operation):
+    counters, values = random_counters(999, count_size, 2)
+    other, other_values = random_counters(999, count_size, 3)
+    combine, expected = OPERATIONS[operation]
+    counters.combine(other, combine)
+    assert np.array_equal(counters.values(), expected(values, other_values, counters.max_value))
+    # other is not modified
+    assert np.array_equal(other.values(), other_values)
+
+
+def counting_filters(count_size, overflow=False):
+    keys = [str(i) for i in range(300)]
+    first = CountingBloomFilter(600, 0.01, count_size=count_size, overflow=overflow)
+    first.add_many(keys * 3)
+    second = CountingBloomFilter(600, 0.01, count_size=count_size, overflow=overflow)
+    second.add_many(keys[100:] + [str(i) for i in range(300, 600)])
+    return first, second
+
+
+@pytest.mark.parametrize("count_size", [2, 3, 4, 8])
+@pytest.mark.parametrize("operation", sorted(OPERATIONS))
+def test_counting_filter_set_operations(count_size, operation):
+    first, second = counting_filters(count_size)
+    values, other_values = first.get_counts(), second.get_counts()
+    combined = first.copy()
+    if operation == "add":
+        combined |= second
+        assert np.array_equal((first | second).get_counts(), combined.get_counts())
+    elif operation == "minimum":
+        combined &= second
+        assert np.array_equal((first & second).get_counts(), combined.get_counts())
+    else:
+        combined -= second
+        assert np.array_equal((first - second).get_counts(), combined.get_counts())
+    assert np.array_equal(combined.get_counts(), OPERATIONS[operation][1](values, other_values, first.max_value))
+    # the operands are not modified
+    assert np.array_equal(first.get_counts(), values)
+    assert np.array_equal(second.get_counts(), other_values)
+    keys = [str(i) for i in range(600)]
+    if operation == "add":
+        assert combined.contains_many(keys).all()
+    elif operation == "minimum":
+        assert combined.contains_many(keys[100:300]).all()
+
+
+@pytest.mark.parametrize("operation", sorted(OPERATIONS))
+def test_counting_filter_set_operations_keep_exact_counts(operation):
+    first, second = counting_filters(2, overflow=True)
+    values, other_values = first.get_counts(), second.get_counts()
+    assert values.max() > first.max_value
+    combined = first.copy()
+    if operation == "add":
+        combined |= second
+    elif operation == "minimum":
+        combined &= second
+    else:
+        combined -= second
+    # exact counts are combined without saturation
+    expected = OPERATIONS[operation][1](values, other_values, np.iinfo(np.int64).max)
+    assert np.array_equal(combined.get_counts(), expected)
+    assert set(combined.overflow) == set(np.flatnonzero(expected > combined.max_value).tolist())
+
+
+def test_counting_filter_set_operations_reject_other_layouts():
+    first, _ = counting_filters(4)
+    with pytest.raises(ValueError):
+        first | CountingBloomFilter(6000, 0.01, count_size=4)
+    with pytest.raises(ValueError):
+        first & CountingBloomFilter(600, 0.01, count_size=4, hash_strategy="seeded")
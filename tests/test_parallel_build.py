@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from bloomFilter import BloomFilter
+from countingBloomFilter import CountingBloomFilter
+from parallelBuild import build_parallel, read_keys, split_files
+
+
+def test_overflow_tables_are_merged():
+    keys = [str(i) for i in range(500)] * 20
+    parallel = build_parallel(keys, 10000, 0.01, workers=3, filter_class=CountingBloomFilter,
+                              overflow=True, count_size=4)
+    sequential = CountingBloomFilter(10000, 0.01, count_size=4, overflow=True)
+    sequential.add_many(keys)
+    assert parallel.overflow == sequential.overflow
+    assert parallel.overflow_count == sequential.overflow_count
+    assert np.array_equal(parallel.get_counts(), sequential.get_counts())
+    for key in keys[:500 * 19]:
+        parallel.delete(key)
+    assert parallel.contains_many(keys[:500]).all()
+
+
+class RecordingBloomFilter(BloomFilter):
+    # directory where every worker process leaves a file named after its pid
+    directory = None
+
+    def add_many(self, items):
+        open(os.path.join(self.directory, str(os.getpid())), "a").close()
+        return super().add_many(items)
+
+
+class CrashingBloomFilter(BloomFilter):
+
+    def add_many(self, items):
+        os._exit(3)
+
+
+def test_one_file_is_read_by_every_worker(tmp_path):
+    path = tmp_path / "keys.txt"
+    path.write_text("\n".join(str(i) for i in range(100000)) + "\n")
+    shard_ranges = split_files([str(path)], 4)
+    assert all(len(ranges) == 1 for ranges in shard_ranges)
+    assert [key for ranges in shard_ranges for key in read_keys(*ranges[0])] == list(read_keys(str(path)))
+    RecordingBloomFilter.directory = str(tmp_path / "workers")
+    os.mkdir(RecordingBloomFilter.directory)
+    parallel = build_parallel([path], 100000, 0.01, workers=4, filter_class=RecordingBloomFilter)
+    sequential = BloomFilter(100000, 0.01)
+    sequential.add_many(read_keys(str(path)))
+    assert len(os.listdir(RecordingBloomFilter.directory)) == 4
+    assert parallel.bit_array == sequential.bit_array
+    assert parallel.count == sequential.count
+
+
+def test_short_list_is_shared_by_every_worker(tmp_path):
+    RecordingBloomFilter.directory = str(tmp_path)
+    keys = [str(i) for i in range(10000)]
+    parallel = build_parallel(keys, 10000, 0.01, workers=4, filter_class=RecordingBloomFilter)
+    assert len(os.listdir(tmp_path)) == 4
+    assert parallel.contains_many(keys).all()
+
+
+def test_dead_worker_raises():
+    with pytest.raises(RuntimeError, match="exit code 3"):
+        build_parallel((str(i) for i in range(10 ** 6)), 10 ** 6, 0.01, workers=2, filter_class=CrashingBloomFilter)
+
+
+def test_str_keys_naming_files_are_keys(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a").write_text("from file\n")
+    keys = ["a", "b"]
+    parallel = build_parallel(keys, 1000, 0.01, workers=2)
+    assert parallel.contains_many(keys).all()
+    assert "from file" not in parallel
+    # files=True reads str paths as files
+    parallel = build_parallel(["a"], 1000, 0.01, workers=2, files=True)
+    assert "from file" in parallel and "a" not in parallel
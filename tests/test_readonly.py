@@ -0,0 +1,42 @@
+import pytest
+
+from blockedBloomFilter import BlockedBloomFilter
+from bloomFilter import BloomFilter
+from countMinSketch import CountMinSketch
+from countingBloomFilter import CountingBloomFilter
+from rotatingBloomFilter import RotatingBloomFilter
+from shiftingBloomFilter import ShiftingBloomFilterM
+from t_CountingBloomFilter import T_CountingBloomFilter
+
+FILTERS = {
+    "bloom": lambda: BloomFilter(1000, 0.01),
+    "counting": lambda: CountingBloomFilter(1000, 0.01, count_size=4),
+    "counting_overflow": lambda: CountingBloomFilter(1000, 0.01, count_size=4, overflow=True),
+    "counting_8": lambda: CountingBloomFilter(1000, 0.01, count_size=8),
+    "shifting": lambda: ShiftingBloomFilterM(1000, 0.01),
+    "blocked": lambda: BlockedBloomFilter(1000, 0.01),
+    "rotating": lambda: RotatingBloomFilter(1000, 0.01),
+    "t_counting": lambda: T_CountingBloomFilter(1000, 0.01),
+    "count_min": lambda: CountMinSketch(0.01, 0.01),
+}
+
+KEYS = [str(i) for i in range(100)]
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_add_many_on_mapped_filter_raises(tmp_path, name):
+    bloom_filter = FILTERS[name]()
+    bloom_filter.add("present")
+    path = str(tmp_path / "filter.bf")
+    bloom_filter.save(path)
+    with open(path, "rb") as f:
+        saved = f.read()
+    mapped = type(bloom_filter).load(path, mmap=True)
+    add_many = mapped.update_many if isinstance(mapped, CountMinSketch) else mapped.add_many
+    with pytest.raises(TypeError):
+        add_many(KEYS)
+    with pytest.raises(TypeError):
+        mapped.add("new")
+    # nothing reached the file
+    with open(path, "rb") as f:
+        assert f.read() == saved
@@ -0,0 +1,70 @@
+import numpy as np
+
+from rotatingBloomFilter import RotatingBloomFilter
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_repeated_keys_do_not_rotate_the_generations():
+    rotating_filter = RotatingBloomFilter(1000, 0.01)
+    keys = [str(i) for i in range(600)]
+    assert rotating_filter.add_many(keys + keys) == 600
+    assert rotating_filter.add_many(keys) == 0
+    # a key that is a false positive of the newest generation is not counted, as with add
+    new_keys = 300 - int(rotating_filter.contains_many(np.arange(300)).sum())
+    assert rotating_filter.add_many(np.arange(300).repeat(3)) == new_keys
+    assert rotating_filter.newest == 0
+    assert len(rotating_filter) == 600 + new_keys
+    assert rotating_filter.contains_many(keys).all()
+
+
+def test_false_positive_rate_across_generations():
+    rotating_filter = RotatingBloomFilter(5000, 0.01, generations=4)
+    rotating_filter.add_many(np.arange(20000))
+    assert [temp.count for temp in rotating_filter.generations] == [5000] * 4
+    assert rotating_filter.contains_many(np.arange(20000)).all()
+    # fp_prob is the target of a lookup across all the generations
+    assert rotating_filter.contains_many(np.arange(10 ** 9, 10 ** 9 + 100000)).mean() < 0.015
+
+
+def test_full_generations_expire_the_oldest_keys():
+    rotating_filter = RotatingBloomFilter(1000, 0.01, generations=3)
+    batches = [["batch" + str(batch) + "-" + str(i) for i in range(1000)] for batch in range(4)]
+    for batch in batches[:3]:
+        rotating_filter.add_many(batch)
+    nbytes = rotating_filter.nbytes
+    buffers = [temp.bit_array for temp in rotating_filter.generations]
+    assert all(rotating_filter.contains_many(batch).all() for batch in batches[:3])
+    for key in batches[3]:
+        rotating_filter.add(key)
+    # the first batch was cleared in place, nothing was reallocated
+    assert rotating_filter.contains_many(batches[0]).mean() < 0.02
+    assert all(rotating_filter.contains_many(batch).all() for batch in batches[1:])
+    assert rotating_filter.nbytes == nbytes
+    assert all(a is b for a, b in zip(buffers, (temp.bit_array for temp in rotating_filter.generations)))
+
+
+def test_time_windows_expire_the_oldest_keys():
+    clock = Clock()
+    rotating_filter = RotatingBloomFilter(1000, 0.01, generations=3, window=10, clock=clock)
+    assert not rotating_filter.add("first")
+    rotating_filter.add("refreshed")
+    clock.now = 15
+    rotating_filter.add("second")
+    # a key seen again is added in the newest generation and lives longer
+    assert rotating_filter.add("refreshed")
+    clock.now = 25
+    assert "first" in rotating_filter and "second" in rotating_filter
+    clock.now = 35
+    assert "first" not in rotating_filter
+    assert "second" in rotating_filter and "refreshed" in rotating_filter
+    # several windows without traffic expire every generation
+    clock.now = 100
+    assert not rotating_filter.contains_many(["first", "second", "refreshed"]).any()
+    assert len(rotating_filter) == 0
@@ -0,0 +1,128 @@
+import math
+
+import numpy as np
+import pytest
+
+from countingBloomFilter import CountingBloomFilter
+from cuckooFilter import CuckooFilter
+from scalableBloomFilter import ScalableBloomFilter
+
+
+def fill(scalable_filter, keys):
+    for key in keys:
+        scalable_filter.add(key)
+
+
+@pytest.mark.parametrize("growth, ratio", [(2, 0.9), (4, 0.8), (2, 0.5)])
+def test_layers_follow_the_schedule(growth, ratio):
+    scalable_filter = ScalableBloomFilter(100, 0.01, growth=growth, ratio=ratio)
+    fill(scalable_filter, range(5000))
+    assert len(scalable_filter.bloom_filters) == scalable_filter.next_layer >= 3
+    for index, layer in enumerate(scalable_filter.bloom_filters):
+        items_count, fp_prob = scalable_filter.layer_parameters(index)
+        assert items_count == 100 * growth ** index
+        assert fp_prob == pytest.approx(0.01 * (1 - ratio) * ratio ** index)
+        assert layer.item_low_count == items_count
+        assert layer.fp_prob == fp_prob
+    # the geometric series of the layer targets is bounded by fp_prob
+    assert sum(layer.fp_prob for layer in scalable_filter.bloom_filters) < 0.01
+    cost = scalable_filter.predicted_cost(len(scalable_filter.bloom_filters))
+    assert cost["nbytes"] == scalable_filter.nbytes
+    assert cost["probes"] == sum(layer.hash_count for layer in scalable_filter.bloom_filters)
+    assert cost["fp_prob"] < 0.01
+
+
+def test_compound_false_positive_rate_stays_below_target():
+    scalable_filter = ScalableBloomFilter(1000, 0.01)
+    keys = np.arange(60000)
+    fill(scalable_filter, keys.tolist())
+    assert len(scalable_filter.bloom_filters) >= 5
+    assert all(key in scalable_filter for key in keys.tolist())
+    others = range(10 ** 9, 10 ** 9 + 50000)
+    assert sum(key in scalable_filter for key in others) / len(others) < 0.01
+
+
+def test_add_reports_keys_already_present():
+    scalable_filter = ScalableBloomFilter(100, 0.001)
+    assert not scalable_filter.add("a")
+    assert scalable_filter.add("a")
+    assert scalable_filter.add(b"a")
+    assert sum(layer.count for layer in scalable_filter.bloom_filters) == 1
+
+
+def test_rejects_a_ratio_outside_0_1():
+    with pytest.raises(ValueError):
+        ScalableBloomFilter(100, 0.01, ratio=1)
+
+
+def test_compaction_keeps_every_key():
+    scalable_filter = ScalableBloomFilter(100, 0.01)
+    keys = [str(i) for i in range(3000)]
+    fill(scalable_filter, keys)
+    layers = scalable_filter.bloom_filters
+    fp_budget = sum(layer.fp_prob for layer in layers[:-1])
+    next_layer = scalable_filter.next_layer
+    # the key source can hold keys that were never added
+    report = scalable_filter.compact(keys + ["other" + str(i) for i in range(3000)])
+    assert report["layers"] == len(layers) - 1
+    assert len(scalable_filter.bloom_filters) == 2
+    assert scalable_filter.bloom_filters[1] is layers[-1]
+    merged = scalable_filter.bloom_filters[0]
+    assert merged.fp_prob == pytest.approx(fp_budget)
+    assert merged.count == report["items"] >= sum(layer.count for layer in layers[:-1])
+    assert report["probes_saved"] > 0
+    assert all(key in scalable_filter for key in keys)
+    assert sum("absent" + str(i) in scalable_filter for i in range(20000)) / 20000 < 0.01
+    # later layers keep their place in the schedule
+    assert scalable_filter.next_layer == next_layer
+
+
+def test_false_positives_of_the_key_source_are_not_counted():
+    keys = [str(i) for i in range(3000)]
+    others = ["other" + str(i) for i in range(200000)]
+    for exact in (False, True):
+        scalable_filter = ScalableBloomFilter(100, 0.01)
+        fill(scalable_filter, keys)
+        layers = scalable_filter.bloom_filters
+        items = sum(layer.count for layer in layers[:-1])
+        # keys reported present when they were added are not counted by the layers
+        reported = sum(any(key in layer for layer in layers[:-1]) for key in keys)
+        report = scalable_filter.compact(keys if exact else keys + others, exact=exact)
+        merged = scalable_filter.bloom_filters[0]
+        assert merged.count == report["items"]
+        assert all(key in scalable_filter for key in keys)
+        if exact:
+            assert merged.count == reported >= items
+        else:
+            # the source holds hundreds of false positives of the old layers
+            assert merged.count == items
+            assert merged.item_low_count > reported + 100
+
+
+def test_compaction_does_not_bring_back_deleted_keys():
+    # a key that is a false positive when it is added is not stored, deleting
+    # the keys that set its bits removes it too, fp_prob makes this unlikely
+    scalable_filter = ScalableBloomFilter(100, 0.00001, countable=True, count_size=4)
+    keys = [str(i) for i in range(1500)]
+    fill(scalable_filter, keys)
+    for key in keys[:200]:
+        assert scalable_filter.delete(key)
+    scalable_filter.compact(keys)
+    assert isinstance(scalable_filter.bloom_filters[0], CountingBloomFilter)
+    assert all(key in scalable_filter for key in keys[200:])
+    assert sum(key in scalable_filter for key in keys[:200]) <= 2
+    for key in keys[200:400]:
+        assert scalable_filter.delete(key)
+    assert sum(key in scalable_filter for key in keys[200:400]) <= 2
+
+
+def test_background_compaction():
+    scalable_filter = ScalableBloomFilter(100, 0.01, layer_type=CuckooFilter)
+    keys = list(range(2000))
+    fill(scalable_filter, keys)
+    future = scalable_filter.compact(keys, layers=3, background=True)
+    report = future.result(timeout=30)
+    assert report["layers"] == 3
+    assert all(key in scalable_filter for key in keys)
+    assert math.isclose(scalable_filter.bloom_filters[0].fp_prob,
+                        sum(scalable_filter.layer_parameters(index)[1] for index in range(3)))
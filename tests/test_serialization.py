@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from blockedBloomFilter import BlockedBloomFilter
+from bloomFilter import BloomFilter
+from concurrentFilters import ConcurrentBloomFilter, ConcurrentCountingBloomFilter, ConcurrentScalableBloomFilter
+from countMinSketch import CountMinSketch
+from countingBloomFilter import CountingBloomFilter
+from cuckooFilter import CuckooFilter
+from rotatingBloomFilter import RotatingBloomFilter
+from scalableBloomFilter import ScalableBloomFilter
+from serialization import FILTER_KINDS, get_filter_kind, load_filter, read_filter, record_size, write_filter
+from shiftingBloomFilter import ShiftingBloomFilterM
+from t_CountingBloomFilter import T_CountingBloomFilter
+from xorFilter import XorFilter
+
+KEYS = [str(i) for i in range(1500)]
+ABSENT = ["absent" + str(i) for i in range(1500)]
+
+FILTERS = {
+    "BloomFilter": lambda: BloomFilter(2000, 0.01),
+    "ShiftingBloomFilterM": lambda: ShiftingBloomFilterM(2000, 0.01, hash_strategy="seeded"),
+    "CountingBloomFilter": lambda: CountingBloomFilter(2000, 0.01, count_size=2, overflow=True),
+    "ScalableBloomFilter": lambda: ScalableBloomFilter(200, 0.01, countable=True, count_size=4),
+    "BlockedBloomFilter": lambda: BlockedBloomFilter(2000, 0.01),
+    "CuckooFilter": lambda: CuckooFilter(2000, 0.01),
+    "XorFilter": lambda: XorFilter.from_keys(KEYS, 0.01),
+    "RotatingBloomFilter": lambda: RotatingBloomFilter(1000, 0.01),
+    "CountMinSketch": lambda: CountMinSketch(0.01, 0.01, count_size=16, top_k=5),
+    "T_CountingBloomFilter": lambda: T_CountingBloomFilter(2000, 0.01),
+    "ConcurrentBloomFilter": lambda: ConcurrentBloomFilter(2000, 0.01),
+    "ConcurrentCountingBloomFilter": lambda: ConcurrentCountingBloomFilter(2000, 0.01),
+    "ConcurrentScalableBloomFilter": lambda: ConcurrentScalableBloomFilter(200, 0.01),
+}
+
+
+def build(name):
+    bloom_filter = FILTERS[name]()
+    if isinstance(bloom_filter, CountMinSketch):
+        bloom_filter.update_many(KEYS + KEYS[:10] * 50)
+    elif isinstance(bloom_filter, ScalableBloomFilter):
+        for key in KEYS:
+            bloom_filter.add(key)
+    elif isinstance(bloom_filter, CuckooFilter):
+        # a key fits at most 2 * BUCKET_SIZE times in a cuckoo filter
+        bloom_filter.add_many(KEYS + KEYS[:10])
+    elif not isinstance(bloom_filter, XorFilter):
+        bloom_filter.add_many(KEYS + KEYS[:10] * 5)
+    return bloom_filter
+
+
+def stored(bloom_filter):
+    if isinstance(bloom_filter, ScalableBloomFilter):
+        return [temp.count for temp in bloom_filter.bloom_filters]
+    return len(bloom_filter)
+
+
+def lookups(bloom_filter):
+    if isinstance(bloom_filter, CountMinSketch):
+        return bloom_filter.estimate_many(KEYS + ABSENT).tolist(), bloom_filter.top()
+    return [key in bloom_filter for key in KEYS + ABSENT]
+
+
+def test_every_kind_is_covered():
+    assert sorted(FILTERS) == sorted(class_name for _, class_name in FILTER_KINDS.values())
+    for kind, (_, class_name) in FILTER_KINDS.items():
+        assert get_filter_kind(FILTERS[class_name]()) == kind
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_save_load_round_trip(tmp_path, name, mmap):
+    bloom_filter = build(name)
+    path = str(tmp_path / "filter.bf")
+    bloom_filter.save(path)
+    loaded = type(bloom_filter).load(path, mmap=mmap)
+    assert type(loaded) is type(bloom_filter)
+    assert stored(loaded) == stored(bloom_filter)
+    assert loaded.nbytes == bloom_filter.nbytes
+    assert loaded.hash_strategy.name == bloom_filter.hash_strategy.name
+    assert lookups(loaded) == lookups(bloom_filter)
+    assert type(load_filter(path, mmap=mmap)) is type(bloom_filter)
+    if not mmap and not isinstance(loaded, XorFilter):
+        # a copy in memory stays writable and keeps working after the file is replaced
+        more = ["more" + str(i) for i in range(100)]
+        if isinstance(loaded, CountMinSketch):
+            loaded.update_many(more)
+            assert (loaded.estimate_many(more) >= 1).all()
+        else:
+            for key in more:
+                loaded.add(key)
+            BloomFilter(10, 0.1).save(path)
+            assert all(key in loaded for key in more + KEYS)
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_buffer_round_trip(name):
+    bloom_filter = build(name)
+    buffer = bytearray(record_size(bloom_filter))
+    write_filter(bloom_filter, buffer)
+    loaded = read_filter(buffer, expected_class=type(bloom_filter))
+    assert lookups(loaded) == lookups(bloom_filter)
+
+
+def test_counting_overflow_table_is_saved(tmp_path):
+    bloom_filter = build("CountingBloomFilter")
+    assert bloom_filter.overflow
+    path = str(tmp_path / "filter.bf")
+    bloom_filter.save(path)
+    for mmap in (True, False):
+        loaded = CountingBloomFilter.load(path, mmap=mmap)
+        assert loaded.overflow == bloom_filter.overflow
+        assert loaded.overflow_count == bloom_filter.overflow_count
+        assert np.array_equal(loaded.get_counts(), bloom_filter.get_counts())
+
+
+def test_load_rejects_another_filter_class(tmp_path):
+    path = str(tmp_path / "filter.bf")
+    build("BloomFilter").save(path)
+    with pytest.raises(ValueError):
+        CountingBloomFilter.load(path)
+    with pytest.raises(ValueError):
+        load_filter(path, expected_class=CuckooFilter)
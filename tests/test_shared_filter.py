@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from blockedBloomFilter import BlockedBloomFilter
+from bloomFilter import BloomFilter
+from countingBloomFilter import CountingBloomFilter
+from sharedFilter import SharedFilter
+from shiftingBloomFilter import ShiftingBloomFilterM
+
+FILTERS = {
+    "bloom": lambda: BloomFilter(1000, 0.01),
+    "counting": lambda: CountingBloomFilter(1000, 0.01, count_size=4),
+    "shifting": lambda: ShiftingBloomFilterM(1000, 0.01),
+    "blocked": lambda: BlockedBloomFilter(1000, 0.01),
+}
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_attached_filter_rejects_writes(name):
+    bloom_filter = FILTERS[name]()
+    bloom_filter.add_many([str(i) for i in range(100)])
+    new_keys = ["new" + str(i) for i in range(100)]
+    shared = SharedFilter.create(bloom_filter)
+    try:
+        attached = SharedFilter.attach(shared.name, type(bloom_filter))
+        with pytest.raises(TypeError):
+            attached.filter.add_many(new_keys)
+        with pytest.raises(TypeError):
+            attached.filter.add_many(np.arange(100))
+        with pytest.raises(TypeError):
+            attached.filter.add("new")
+        assert attached.contains_many([str(i) for i in range(100)]).all()
+        # no write reached the block
+        assert shared.contains_many(new_keys).mean() <= 0.1
+        attached.close()
+    finally:
+        shared.close()
+        shared.unlink()
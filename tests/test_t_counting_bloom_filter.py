@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from countingBloomFilter import CountingBloomFilter
+from t_CountingBloomFilter import T_CountingBloomFilter
+
+
+@pytest.mark.parametrize("fp_prob", [0.1, 0.01, 0.001])
+def test_bits_per_counter_below_count_size_4(fp_prob):
+    items_count = 200000
+    bloom_filter = T_CountingBloomFilter(items_count, fp_prob)
+    bloom_filter.add_many(np.arange(items_count))
+    reference = CountingBloomFilter(items_count, fp_prob, count_size=4)
+    # the wide table was sized for the filter and did not have to grow
+    counters = bloom_filter.bit_array
+    assert counters.capacity == counters.wide_capacity(bloom_filter.size, items_count * bloom_filter.hash_count)
+    assert bloom_filter.nbytes * 8 / bloom_filter.size < 3.35
+    assert bloom_filter.nbytes < reference.nbytes
+
+
+def test_counters_match_count_size_32():
+    items_count = 20000
+    bloom_filter = T_CountingBloomFilter(items_count, 0.01)
+    reference = CountingBloomFilter(items_count, 0.01, count_size=32)
+    keys = np.arange(items_count)
+    bloom_filter.add_many(keys[:items_count // 2])
+    reference.add_many(keys[:items_count // 2])
+    for key in keys[items_count // 2:].tolist():
+        bloom_filter.add(key)
+        reference.add(key)
+    assert np.array_equal(bloom_filter.bit_array.values(), np.asarray(reference.bit_array.values()))
+    for key in keys.tolist():
+        assert bloom_filter.delete(key)
+    assert not bloom_filter.bit_array.values().any()
+    assert bloom_filter.bit_array.used == 0
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from bloomFilter import BloomFilter
+from xorFilter import XorFilter
+
+
+@pytest.mark.parametrize("fp_prob", [0.01, 0.001, 0.1])
+def test_false_positive_rate(fp_prob):
+    keys = np.arange(50000)
+    xor_filter = XorFilter.from_keys(keys, fp_prob)
+    assert xor_filter.fingerprint_bits == XorFilter.get_fingerprint_bits(fp_prob)
+    assert xor_filter.contains_many(keys).all()
+    rate = xor_filter.contains_many(np.arange(10 ** 9, 10 ** 9 + 200000)).mean()
+    # 2^-fingerprint_bits, at most fp_prob
+    assert rate < 1.5 * 2.0 ** -xor_filter.fingerprint_bits
+    assert rate <= fp_prob * 1.1
+
+
+def test_smaller_than_a_bloom_filter():
+    keys = [str(i) for i in range(100000)]
+    xor_filter = XorFilter.from_keys(keys, 0.01)
+    bloom_filter = BloomFilter(len(keys), 0.01)
+    # the slots and the padding of the last unaligned load
+    assert 0 <= xor_filter.nbytes * 8 - xor_filter.get_size(len(keys), 0.01) < 128
+    assert xor_filter.nbytes < 0.95 * bloom_filter.nbytes
+    assert xor_filter.nbytes * 8 / len(keys) < 1.25 * xor_filter.fingerprint_bits
+
+
+def test_duplicate_keys_are_ignored():
+    keys = [str(i) for i in range(1000)]
+    xor_filter = XorFilter.from_keys(keys + keys[:500] + [key.encode() for key in keys[:100]], 0.01)
+    assert len(xor_filter) == 1000
+    assert xor_filter.contains_many(keys).all()
+    empty = XorFilter.from_keys([], 0.01)
+    assert len(empty) == 0
+    assert empty.contains_many(keys).sum() < 50
+
+
+def test_filter_is_immutable():
+    keys = [str(i) for i in range(1000)]
+    xor_filter = XorFilter.from_keys(keys, 0.01)
+    with pytest.raises(TypeError):
+        xor_filter.add("new")
+    # keys are removed by building a new filter without them
+    rebuilt = XorFilter.from_keys(keys[500:], 0.01)
+    assert rebuilt.contains_many(keys[500:]).all()
+    assert rebuilt.contains_many(keys[:500]).sum() < 25
+
+
+def test_fingerprint_bits_are_checked():
+    with pytest.raises(ValueError):
+        XorFilter.from_keys(range(10), 0.01, fingerprint_bits=33)
+    xor_filter = XorFilter.from_keys(range(1000), 0.01, fingerprint_bits=20)
+    assert xor_filter.fingerprint_bits == 20
+    assert xor_filter.contains_many(range(1000)).all()
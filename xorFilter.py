@@ -0,0 +1,278 @@
+import math
+import numpy as np
+
+from bitOps import chunks
+from hashing import MASK64, get_hash_strategy, mix64, mix64_many
+from memory_usage import memory_usage
+from serialization import load_filter, save_filter
+
+
+class XorFilter(object):
+    """
+    Static xor filter (Graf and Lemire, "Xor Filters: Faster and Smaller Than
+    Bloom and Cuckoo Filters")
+    -Built once from a finished key set with from_keys, it can not be modified
+    -Every key maps to three slots, one in each third of the table, and the xor
+    of the three slots is the fingerprint of the key, so a lookup reads exactly
+    three slots
+    -The table has 1.23 slots per key of fingerprint_bits bits each, about
+    1.23 * lg(1/p) bits per key against 1.44 * lg(1/p) for BloomFilter
+    -Slots are packed in a big endian bit buffer, a slot is read with one
+    unaligned load
+    """
+    CHUNK_SIZE = 65536
+    # number of keys hashed together by from_keys / contains_many
+    LOAD = 1.23
+    # slots per key, peeling succeeds with high probability above 1.222
+    EXTRA_SLOTS = 32
+    MAX_ATTEMPTS = 100
+    # seeds tried before giving up on a key set (a try fails with probability ~0.2)
+    HASH_RANGE = 1 << 62
+    # range of the key hash taken from the digest
+    SEED_STEP = 0x9E3779B97F4A7C15
+
+    def __init__(self, keys, fp_prob, hash_strategy=None, fingerprint_bits=None):
+        """
+        keys : iterable
+            Every key of the filter, duplicates are ignored
+        fp_prob : float
+            False Positive probability in decimal
+        hash_strategy : str or strategy object
+            "double" (default) or "seeded", see hashing.py
+        fingerprint_bits : int
+            Bits of a slot (1 to 32), computed from fp_prob if None
+        """
+        self.fp_prob = fp_prob
+        self.fingerprint_bits = fingerprint_bits or self.get_fingerprint_bits(fp_prob)
+        if not 1 <= self.fingerprint_bits <= 32:
+            raise ValueError("fingerprint_bits must be between 1 and 32")
+        self.fingerprint_mask = (1 << self.fingerprint_bits) - 1
+        self.hash_strategy = get_hash_strategy(hash_strategy)
+
+        key_hashes = [self.key_hash_many(chunk) for chunk in chunks(keys, self.CHUNK_SIZE)]
+        key_hashes = np.unique(np.concatenate(key_hashes)) if key_hashes else np.zeros(0, dtype=np.int64)
+        self.count = self.item_low_count = len(key_hashes)
+
+        # a slot is read three at a time, every third of the table is a block
+        self.block_length = max(int(self.LOAD * self.count + self.EXTRA_SLOTS) // 3, 1)
+        self.size = 3 * self.block_length
+        self.hash_count = 3
+
+        for attempt in range(self.MAX_ATTEMPTS):
+            self.seed = (attempt * self.SEED_STEP) & MASK64
+            table = self.build(key_hashes)
+            if table is not None:
+                break
+        else:
+            raise RuntimeError("Could not build the filter, the keys may have colliding hashes")
+        self.set_buffer(self.pack(table))
+
+    @classmethod
+    def from_keys(cls, keys, fp_prob, hash_strategy=None, fingerprint_bits=None):
+        '''
+        Build the filter from an iterable of keys
+        '''
+        return cls(keys, fp_prob, hash_strategy=hash_strategy, fingerprint_bits=fingerprint_bits)
+
+    def set_buffer(self, buffer):
+        self.buffer = buffer
+        # a slot is read from the 5 bytes holding it (32 bits + 7 bit offset)
+        self.words = np.ndarray(shape=(len(buffer) - 7,), dtype='>u8', buffer=buffer, strides=(1,))
+
+    def build(self, key_hashes):
+        '''
+        Peel the 3-hypergraph of the keys and assign the slots
+        Returns the table as a uint32 array, or None if peeling failed
+        '''
+        hashes = mix64_many(key_hashes.astype(np.uint64) + np.uint64(self.seed))
+        slots = self.slots_many(hashes)
+        fingerprints = self.fingerprint_many(hashes)
+        keys = np.arange(len(hashes), dtype=np.int64)
+
+        # slot -> number of keys and xor of the keys mapped to it, the only
+        # key of a slot of count 1 is its xor
+        counts = np.bincount(slots.ravel(), minlength=self.size)
+        key_xors = np.zeros(self.size, dtype=np.int64)
+        np.bitwise_xor.at(key_xors, slots.ravel(), np.repeat(keys, 3))
+
+        # peel all the slots of count 1 at once, a round never peels two
+        # slots of one key that depend on each other
+        rounds = []
+        peeled = 0
+        while True:
+            singles = np.flatnonzero(counts == 1)
+            if not len(singles):
+                break
+            round_keys, first = np.unique(key_xors[singles], return_index=True)
+            rounds.append((round_keys, singles[first]))
+            peeled += len(round_keys)
+            key_slots = slots[round_keys].ravel()
+            counts -= np.bincount(key_slots, minlength=self.size)
+            np.bitwise_xor.at(key_xors, key_slots, np.repeat(round_keys, 3))
+        if peeled != len(hashes):
+            return None
+
+        # assign in reverse peeling order, the other two slots of a key are
+        # final when its own slot is set
+        table = np.zeros(self.size, dtype=np.uint32)
+        for round_keys, peeled_slots in reversed(rounds):
+            key_slots = slots[round_keys]
+            table[peeled_slots] = (fingerprints[round_keys] ^ table[key_slots[:, 0]] ^ table[key_slots[:, 1]] ^
+                                   table[key_slots[:, 2]])
+        return table
+
+    def pack(self, table):
+        '''
+        Pack the fingerprint_bits low bits of every slot in a big endian
+        bit buffer, with 8 bytes of padding for the unaligned loads
+        '''
+        shifts = np.arange(self.fingerprint_bits - 1, -1, -1, dtype=np.uint32)
+        buffer = bytearray((self.size * self.fingerprint_bits + 7) // 8 + 8)
+        # 8 slots are a whole number of bytes
+        step = 8 * self.CHUNK_SIZE
+        for start in range(0, self.size, step):
+            bits = ((table[start:start + step, None] >> shifts) & 1).astype(np.uint8)
+            packed = np.packbits(bits.ravel())
+            offset = start * self.fingerprint_bits // 8
+            buffer[offset:offset + len(packed)] = packed.tobytes()
+        return buffer
+
+    def key_hash(self, item_digest):
+        return next(self.hash_strategy.indexes(item_digest, 1, self.HASH_RANGE))
+
+    def key_hash_many(self, items):
+        return self.hash_strategy.indexes_many(self.hash_strategy.digest_many(items, 1), 1, self.HASH_RANGE)[:, 0]
+
+    def slots_many(self, hashes):
+        block_length = np.uint64(self.block_length)
+        low = np.uint64(0xFFFFFFFF)
+        slots = np.empty((len(hashes), 3), dtype=np.int64)
+        for i, rotation in enumerate((0, 21, 42)):
+            rotated = hashes if not rotation else (hashes << np.uint64(rotation)) | (hashes >> np.uint64(64 - rotation))
+            # (x * n) >> 32 maps a 32 bit x to [0, n) without a division
+            slots[:, i] = (((rotated & low) * block_length) >> np.uint64(32)).astype(np.int64) + i * self.block_length
+        return slots
+
+    def fingerprint_many(self, hashes):
+        return ((hashes ^ (hashes >> np.uint64(32))) & np.uint64(self.fingerprint_mask)).astype(np.uint32)
+
+    def add(self, item):
+        raise TypeError("XorFilter is immutable, build a new one with from_keys")
+
+    def __contains__(self, item):
+        '''
+        Check for existence of an item in filter
+        '''
+        return self.contains_digest(self.hash_strategy.digest(item))
+
+    def contains_digest(self, item_digest):
+        '''
+        Check for existence of an item in filter from its digest
+        '''
+        h = mix64((self.key_hash(item_digest) + self.seed) & MASK64)
+        bits = self.fingerprint_bits
+        block_length = self.block_length
+        buffer = self.buffer
+        # the low 32 bits of h, rotl(h, 21) and rotl(h, 42), as in slots_many
+        bit = ((h & 0xFFFFFFFF) * block_length >> 32) * bits
+        value = h ^ (h >> 32) ^ (int.from_bytes(buffer[bit >> 3:(bit >> 3) + 5], 'big') >> (40 - bits - (bit & 7)))
+        bit = (((h & 0x7FF) << 21 | h >> 43) * block_length >> 32) * bits + block_length * bits
+        value ^= int.from_bytes(buffer[bit >> 3:(bit >> 3) + 5], 'big') >> (40 - bits - (bit & 7))
+        bit = (((h >> 22) & 0xFFFFFFFF) * block_length >> 32) * bits + 2 * block_length * bits
+        value ^= int.from_bytes(buffer[bit >> 3:(bit >> 3) + 5], 'big') >> (40 - bits - (bit & 7))
+        return not value & self.fingerprint_mask
+
+    def contains_many(self, items):
+        '''
+        Check for existence of every item of the iterable in filter
+        Returns a boolean numpy array
+        '''
+        results = []
+        bits = np.uint64(self.fingerprint_bits)
+        for chunk in chunks(items, self.CHUNK_SIZE):
+            hashes = mix64_many(self.key_hash_many(chunk).astype(np.uint64) + np.uint64(self.seed))
+            values = self.fingerprint_many(hashes).astype(np.uint64)
+            positions = self.slots_many(hashes).astype(np.uint64) * bits
+            for i in range(3):
+                words = self.words[(positions[:, i] >> np.uint64(3)).astype(np.int64)]
+                values ^= words >> (np.uint64(64) - bits - (positions[:, i] & np.uint64(7)))
+            results.append((values & np.uint64(self.fingerprint_mask)) == 0)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def __len__(self):
+        return self.count
+
+    def get_bitarray_size(self):
+        return len(self.buffer)
+
+    @property
+    def nbytes(self):
+        '''
+        Bytes of the slot buffer
+        '''
+        return len(self.buffer)
+
+    def memory_report(self):
+        '''
+        Return payload bytes, metadata overhead and bits per stored item
+        (constant time, see memory_usage.py)
+        '''
+        return memory_usage.build_report(
+            self.nbytes, memory_usage.get_metadata_size(self, ("buffer", "words")), self.count)
+
+    def save(self, path):
+        '''
+        Save the filter in the binary format of serialization.py
+        '''
+        save_filter(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved filter, with mmap=True the slots are a read-only
+        view on the mapped file
+        '''
+        return load_filter(path, mmap, cls)
+
+    def file_record(self):
+        fields = {"size": self.size, "hash_count": self.hash_count, "slice_size": self.block_length,
+                  "count_size": self.fingerprint_bits, "item_low_count": self.item_low_count, "count": self.count,
+                  "fp_prob": self.fp_prob, "hash_strategy": self.hash_strategy.name}
+        return fields, {"seed": self.seed}, self.buffer, []
+
+    @classmethod
+    def from_file_record(cls, fields, metadata, payload, children):
+        new_filter = cls.__new__(cls)
+        new_filter.fp_prob = fields["fp_prob"]
+        new_filter.fingerprint_bits = fields["count_size"]
+        new_filter.fingerprint_mask = (1 << new_filter.fingerprint_bits) - 1
+        new_filter.hash_strategy = get_hash_strategy(fields["hash_strategy"])
+        new_filter.count = fields["count"]
+        new_filter.item_low_count = fields["item_low_count"]
+        new_filter.block_length = fields["slice_size"]
+        new_filter.size = fields["size"]
+        new_filter.hash_count = fields["hash_count"]
+        new_filter.seed = metadata["seed"]
+        new_filter.set_buffer(payload)
+        return new_filter
+
+    @classmethod
+    def get_fingerprint_bits(self, p):
+        '''
+        Return the fingerprint bits(f) for a false positive probability p
+        f = lg(1/p)
+        '''
+        return min(max(math.ceil(-math.log2(p)), 1), 32)
+
+    @classmethod
+    def get_size(self, n, p):
+        """
+        Return the size of the slot buffer in bits
+        n : int
+            number of keys stored in filter
+        p : float
+            False Positive probability in decimal
+        """
+        return 3 * max(int(self.LOAD * n + self.EXTRA_SLOTS) // 3, 1) * self.get_fingerprint_bits(p)